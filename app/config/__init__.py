@@ -20,7 +20,12 @@ def get_settings():
         "notifications": {
             "adminEmail": "orumagideon535@gmail.com",
             "sendOrderNotifications": True,
-            "sendPaymentNotifications": True
+            "sendPaymentNotifications": True,
+            # Digest mode: admin notifications are collected and sent as one
+            # summary email per window (or as soon as digestMaxItems pile up)
+            "digestEnabled": False,
+            "digestWindowMinutes": 5,
+            "digestMaxItems": 20
         }
     }
     
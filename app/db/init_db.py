@@ -1,11 +1,13 @@
 # app/db/init_db.py
 from app.db.session import engine
 from app.models import *  # Import all models so SQLModel can create tables
-from sqlmodel import SQLModel
+from sqlmodel import Session, SQLModel
 from sqlalchemy import text
+from sqlalchemy.schema import CreateIndex
 import time
 import logging
 from sqlalchemy.exc import OperationalError
+from app.services import product_search, sales_rollup
 
 logger = logging.getLogger("morine.init_db")
 
@@ -61,6 +63,69 @@ def _ensure_admin_email_column():
         # that can fail if duplicate data exists. Leave to Alembic or manual migration.
 
 
+def _ensure_updated_at_columns():
+    """Add `updated_at` to tables that predate HTTP cache validators.
+
+    Existing rows are stamped with the current UTC time so every resource has
+    a usable Last-Modified value from the start.
+    """
+    with engine.begin() as conn:
+        for table in ("product", "category", "order"):
+            conn.execute(
+                text(
+                    f'ALTER TABLE "{table}" ADD COLUMN IF NOT EXISTS updated_at timestamp '
+                    "NOT NULL DEFAULT (now() at time zone 'utc')"
+                )
+            )
+
+
+def _ensure_indexes(*models):
+    """Create the composite indexes declared in `__table_args__` on existing tables.
+
+    `create_all` only builds indexes together with new tables, so databases
+    created before an index was declared get it here. `CREATE INDEX IF NOT
+    EXISTS` keeps this idempotent; compiling the index through the dialect
+    also covers expression indexes.
+    """
+    with engine.begin() as conn:
+        for model in models:
+            for index in model.__table__.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+
+def _ensure_product_search():
+    """Set up PostgreSQL full-text and fuzzy search on `product`.
+
+    Adds a generated `search_vector` tsvector column (name weighted above
+    description) which Postgres keeps in sync on every write, a GIN index over
+    it, and a pg_trgm GIN index on `name` for typo-tolerant matches. Each step
+    runs in its own transaction: without the privilege to create pg_trgm the
+    full-text part still works. `app/services/product_search.py` checks what
+    exists and otherwise uses its in-process index.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except Exception:
+        print("Warning: could not create the pg_trgm extension; product search will not match misspellings")
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "ALTER TABLE product ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                "GENERATED ALWAYS AS ("
+                "setweight(to_tsvector('english', coalesce(name, '')), 'A') || "
+                "setweight(to_tsvector('english', coalesce(description, '')), 'B')"
+                ") STORED"
+            )
+        )
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_product_search_vector ON product USING GIN (search_vector)"))
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first():
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_product_name_trgm ON product USING GIN (name gin_trgm_ops)"))
+
+
 def create_db_and_tables(retries: int = 5, backoff: float = 2.0):
     """Create missing tables and run idempotent DDL helpers.
 
@@ -147,3 +212,25 @@ def create_db_and_tables(retries: int = 5, backoff: float = 2.0):
                 conn.execute(text("ALTER TABLE \"order\" ADD COLUMN IF NOT EXISTS shipped_at timestamp"))
     except Exception:
         print("Warning: failed to ensure order.shipping columns")
+    try:
+        _ensure_updated_at_columns()
+    except Exception:
+        print("Warning: failed to ensure updated_at columns")
+    try:
+        _ensure_indexes(Order, OrderItem, Product, Category, Invoice)
+    except Exception:
+        print("Warning: failed to ensure order/orderitem/product/category/invoice indexes")
+    try:
+        _ensure_product_search()
+    except Exception:
+        print("Warning: failed to set up product full-text search")
+    # Pick the search backend from what the setup above actually created
+    product_search.detect_backend()
+    try:
+        # Databases upgraded from before the rollup existed get it built from their orders
+        with Session(engine) as session:
+            built = sales_rollup.ensure_built(session)
+        if built is not None:
+            print(f"Built daily sales rollup ({built} rows)")
+    except Exception:
+        print("Warning: failed to build the daily sales rollup")
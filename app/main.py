@@ -4,6 +4,10 @@ from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 import os
 from app.db.init_db import create_db_and_tables
+from app.services.outbox import OUTBOX_WORKER_ENABLED, outbox_worker
+from app.services import invoice_renderer
+from app.services.payment_events import payment_event_listener
+from app.services.mpesa_client import close_mpesa_client
 from app.routers.category_router import router as category_router
 from app.routers.product_router import router as product_router
 from app.routers.order_router import router as order_router
@@ -44,6 +48,20 @@ app.add_middleware(
 @app.on_event("startup")
 def on_startup():
     create_db_and_tables()
+    # Drains queued invoice PDFs and emails. Set OUTBOX_WORKER_ENABLED=false
+    # when running `python -m app.services.outbox` as a separate process.
+    if OUTBOX_WORKER_ENABLED:
+        outbox_worker.start()
+    # Relays payment notifications from other workers (PostgreSQL only)
+    payment_event_listener.start()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    outbox_worker.stop()
+    invoice_renderer.shutdown()
+    payment_event_listener.stop()
+    await close_mpesa_client()
 
 # ============================================
 # ROUTERS
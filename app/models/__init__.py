@@ -2,24 +2,34 @@
 from app.models.models import (
     Category,
     Product,
+    CatalogTombstone,
     Customer,
     Supplier,
     ProductSupply,
     Order,
     OrderItem,
     Invoice,
+    OutboxJob,
+    AdminDigestEntry,
+    PaymentIdempotencyKey,
+    DailySalesRollup,
     AdminUser,
 )
 
 __all__ = [
     "Category",
     "Product",
+    "CatalogTombstone",
     "Customer",
     "Supplier",
     "ProductSupply",
     "Order",
     "OrderItem",
     "Invoice",
+    "OutboxJob",
+    "AdminDigestEntry",
+    "PaymentIdempotencyKey",
+    "DailySalesRollup",
     "AdminUser",
 ]
 
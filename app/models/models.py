@@ -1,16 +1,44 @@
 from typing import Optional, List
-from datetime import datetime
+from datetime import date, datetime
 from sqlmodel import SQLModel, Field, Relationship
+from sqlalchemy import Column, Index, JSON, String, UniqueConstraint
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
+
+
+class name_sort_key(FunctionElement):
+    """`lower(name)` compared by code point: the `sort=name` key of
+    `GET /products/`. The catalog snapshot sorts on `name.lower()`, so both
+    paths must order (and compare cursors) the same way. PostgreSQL would
+    otherwise use the locale's collation; SQLite's default is already
+    binary, though its lower() only folds ASCII."""
+    type = String()
+    inherit_cache = True
+
+
+@compiles(name_sort_key)
+def _compile_name_sort_key(element, compiler, **kw):
+    return f"lower({compiler.process(element.clauses, **kw)})"
+
+
+@compiles(name_sort_key, "postgresql")
+def _compile_name_sort_key_postgresql(element, compiler, **kw):
+    return f'lower({compiler.process(element.clauses, **kw)}) COLLATE "C"'
 
 
 # ==========================
 # CATEGORY MODEL
 # ==========================
 class Category(SQLModel, table=True):
+    # Backs the `updated_at` scan of `GET /products/changes`
+    __table_args__ = (Index("ix_category_updated_at_id", "updated_at", "id"),)
+
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True, unique=True)
     description: Optional[str] = None
     parent_id: Optional[int] = Field(default=None, foreign_key="category.id")
+    # Bumped on every ORM/Core UPDATE; drives ETag/Last-Modified validators
+    updated_at: datetime = Field(default_factory=datetime.utcnow, sa_column_kwargs={"onupdate": datetime.utcnow})
 
     # Relationship: one category -> many products
     products: List["Product"] = Relationship(back_populates="category")
@@ -22,6 +50,14 @@ class Category(SQLModel, table=True):
 # PRODUCT MODEL
 # ==========================
 class Product(SQLModel, table=True):
+    # Composite indexes backing the keyset sort orders of `GET /products/`.
+    # Existing databases get them from `app/db/init_db.py`.
+    __table_args__ = (
+        Index("ix_product_price_id", "price", "id"),
+        Index("ix_product_category_id_id", "category_id", "id"),
+        Index("ix_product_updated_at_id", "updated_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True)
     description: Optional[str] = None
@@ -29,12 +65,31 @@ class Product(SQLModel, table=True):
     price: float
     stock_quantity: int
     image_url: Optional[str] = None
+    updated_at: datetime = Field(default_factory=datetime.utcnow, sa_column_kwargs={"onupdate": datetime.utcnow})
 
     # Relationships
     category: Optional[Category] = Relationship(back_populates="products")
     order_items: List["OrderItem"] = Relationship(back_populates="product")
 
 
+# Expression index for `sort=name`; needs the table's column, so declared here
+Index("ix_product_name_key_id", name_sort_key(Product.__table__.c.name), Product.__table__.c.id)
+
+
+# ==========================
+# CATALOG TOMBSTONE MODEL
+# ==========================
+class CatalogTombstone(SQLModel, table=True):
+    """A deleted product or category, kept so `GET /products/changes` can tell
+    mirroring clients to drop it."""
+    __table_args__ = (Index("ix_catalogtombstone_deleted_at_id", "deleted_at", "id"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    entity: str  # product, category
+    entity_id: int
+    deleted_at: datetime = Field(default_factory=datetime.utcnow)
+
+
 # ==========================
 # CUSTOMER MODEL
 # ==========================
@@ -88,7 +143,8 @@ class ProductSupply(SQLModel, table=True):
 # ==========================
 class OrderItem(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    order_id: Optional[int] = Field(default=None, foreign_key="order.id")
+    # Indexed for loading an order's items (order reads, exports, rollup updates)
+    order_id: Optional[int] = Field(default=None, foreign_key="order.id", index=True)
     product_id: Optional[int] = Field(default=None, foreign_key="product.id")
     quantity: int = 1
     price: float  # price at time of order
@@ -98,6 +154,18 @@ class OrderItem(SQLModel, table=True):
 
 
 class Order(SQLModel, table=True):
+    # Composite indexes backing keyset pagination on (created_at, id) in
+    # `GET /orders/`, optionally narrowed by the most common filters.
+    # Existing databases get them from `app/db/init_db.py`.
+    __table_args__ = (
+        Index("ix_order_created_at_id", "created_at", "id"),
+        Index("ix_order_status_created_at_id", "status", "created_at", "id"),
+        Index("ix_order_payment_status_created_at_id", "payment_status", "created_at", "id"),
+        Index("ix_order_payment_method_created_at_id", "payment_method", "created_at", "id"),
+        Index("ix_order_customer_phone_created_at_id", "customer_phone", "created_at", "id"),
+        Index("ix_order_customer_email_created_at_id", "customer_email", "created_at", "id"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     # customer_id removed - not in existing database schema
     # customer_id: Optional[int] = Field(default=None, foreign_key="customer.id")
@@ -110,8 +178,9 @@ class Order(SQLModel, table=True):
     payment_status: str = Field(default="pending")  # pending, verified, paid, failed
     mpesa_code: Optional[str] = None  # MPESA confirmation code
     payment_verified: bool = Field(default=False)
-    # Request reference id for STK Push / Pochi requests (optional)
-    mpesa_request_id: Optional[str] = None
+    # Request reference id for STK Push / Pochi requests (optional); provider
+    # callbacks are matched to their order by it
+    mpesa_request_id: Optional[str] = Field(default=None, index=True)
     total_amount: Optional[float] = None  # Total including shipping
     total_price: float  # Subtotal
     shipping_cost: float = Field(default=500.0)
@@ -120,6 +189,7 @@ class Order(SQLModel, table=True):
     tracking_number: Optional[str] = None
     shipped_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow, sa_column_kwargs={"onupdate": datetime.utcnow})
 
     # customer: Optional[Customer] = Relationship(back_populates="orders")  # Commented out since customer_id removed
     items: List[OrderItem] = Relationship(back_populates="order")
@@ -131,9 +201,9 @@ class Order(SQLModel, table=True):
 # ==========================
 class Invoice(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    order_id: Optional[int] = Field(default=None, foreign_key="order.id")
+    order_id: Optional[int] = Field(default=None, foreign_key="order.id", index=True)
     customer_id: Optional[int] = Field(default=None, foreign_key="customer.id")
-    invoice_date: datetime = Field(default_factory=datetime.utcnow)
+    invoice_date: datetime = Field(default_factory=datetime.utcnow, index=True)
     total_amount: float
     payment_status: str = Field(default="Unpaid")  # Unpaid, Paid, Pending
     payment_method: Optional[str] = None
@@ -143,6 +213,80 @@ class Invoice(SQLModel, table=True):
     customer: Optional[Customer] = Relationship(back_populates="invoices")
 
 
+# ==========================
+# OUTBOX JOB MODEL
+# ==========================
+class OutboxJob(SQLModel, table=True):
+    """Background work (invoice PDFs, emails) queued in the same transaction as
+    the change that caused it and drained by `app/services/outbox.py`."""
+    __table_args__ = (Index("ix_outboxjob_status_run_after_id", "status", "run_after", "id"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str
+    payload: dict = Field(default_factory=dict, sa_column=Column(JSON, nullable=False))
+    status: str = Field(default="pending")  # pending, running, done, dead
+    attempts: int = 0
+    max_attempts: int = 5
+    run_after: datetime = Field(default_factory=datetime.utcnow)  # next attempt not before
+    locked_until: Optional[datetime] = None  # lease held by the worker running it
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    completed_at: Optional[datetime] = None
+
+
+# ==========================
+# ADMIN DIGEST ENTRY MODEL
+# ==========================
+class AdminDigestEntry(SQLModel, table=True):
+    """An admin notification held back for the next digest email (digest mode
+    in `app_settings.json` `notifications`); deleted once the digest is queued."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    event: str  # order, payment, shipment
+    payload: dict = Field(default_factory=dict, sa_column=Column(JSON, nullable=False))
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+
+# ==========================
+# PAYMENT IDEMPOTENCY KEY MODEL
+# ==========================
+class PaymentIdempotencyKey(SQLModel, table=True):
+    """A payment reference (M-Pesa transaction code) that has been applied to
+    an order. The unique key makes provider retries and reused codes detectable
+    across workers; see `app/services/idempotency.py`."""
+    id: Optional[int] = Field(default=None, primary_key=True)
+    key: str = Field(index=True, unique=True)
+    source: str  # webhook, manual
+    # No foreign key: the key must outlive a deleted order so the code can't be reused
+    order_id: int
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+# ==========================
+# DAILY SALES ROLLUP MODEL
+# ==========================
+class DailySalesRollup(SQLModel, table=True):
+    """Sales per day and order status, kept current as orders are created,
+    change status or are deleted; read by `GET /admin/stats`. See
+    `app/services/sales_rollup.py`.
+
+    Rows with `product_id` 0 hold whole-order totals (orders, items, order
+    revenue including shipping); the others hold one product's line totals.
+    """
+    __table_args__ = (
+        UniqueConstraint("day", "status", "product_id", name="uq_dailysalesrollup_day_status_product"),
+        Index("ix_dailysalesrollup_product_id_day", "product_id", "day"),
+    )
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    day: date  # UTC date the order was placed
+    status: str
+    # No foreign key: history is kept when a product is deleted
+    product_id: int = 0
+    orders: int = 0
+    items_sold: int = 0
+    revenue: float = 0.0
+
+
 # ==========================
 # ADMIN USER MODEL
 # ==========================
@@ -1,19 +1,29 @@
 # app/routers/admin_router.py
-from fastapi import APIRouter, Depends, Body, HTTPException, status
+from fastapi import APIRouter, Depends, Body, File, HTTPException, Query, UploadFile, status
+from fastapi.responses import StreamingResponse
 from sqlmodel import Session, select
 from app.db.session import get_session, engine
 from app.config import get_settings
+import io
 import json
 import os
+from datetime import date, datetime, time, timedelta
 from pydantic import BaseModel
 from typing import Optional
 
 # models & helpers
-from app.models.models import AdminUser
+from app.models.models import AdminUser, OutboxJob
 from app.routers.auth_router import get_password_hash, verify_password, SECRET_KEY, ALGORITHM
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
 from app.services.email_service import send_email
+from app.services.catalog_cache import catalog_cache
+from app.services.response_cache import response_cache
+from app.services.idempotency import payment_keys
+from app.services.mpesa_reconciliation import reconcile_statement
+from sqlalchemy.exc import IntegrityError
+from app.services import outbox, sales_rollup
+from app.services.invoice_renderer import export_invoices_zip, invoices_between
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login")
 
@@ -166,6 +176,106 @@ async def update_admin_settings(settings: dict):
     return {"message": "Settings updated successfully", "settings": updated_settings}
 
 
+@router.get("/cache-stats")
+async def cache_stats():
+    """Hit/miss counters and sizes of this worker's in-process caches."""
+    return {
+        "catalog": catalog_cache.stats(),
+        "responses": response_cache.stats(),
+        "payment_keys": payment_keys.stats(),
+    }
+
+
+@router.get("/stats")
+def dashboard_stats(
+    days: int = Query(30, ge=1, le=366, description="Days of daily figures and top products"),
+    low_stock: int = Query(10, ge=0, description="Stock level below which a product counts as low"),
+    session: Session = Depends(get_session),
+):
+    """Dashboard figures: order count, items sold and revenue in total and by
+    status, per day for the last `days` days, top products, and stock counts.
+
+    Read from the daily sales rollup, so the cost doesn't grow with order history.
+    """
+    return sales_rollup.dashboard(session, days=days, low_stock=low_stock)
+
+
+@router.post("/stats/rebuild")
+def rebuild_dashboard_stats(session: Session = Depends(get_session)):
+    """Recompute the daily sales rollup from the orders (e.g. after editing orders in SQL)."""
+    return {"rows": sales_rollup.rebuild(session)}
+
+
+@router.get("/outbox")
+def outbox_status(session: Session = Depends(get_session)):
+    """Queue depth by status, this worker's counters, and the latest dead-lettered jobs."""
+    dead = session.exec(
+        select(OutboxJob).where(OutboxJob.status == "dead").order_by(OutboxJob.id.desc()).limit(50)
+    ).all()
+    return {
+        "counts": outbox.status_counts(session),
+        "worker": outbox.outbox_worker.stats(),
+        "dead": [
+            {
+                "id": job.id,
+                "kind": job.kind,
+                "attempts": job.attempts,
+                "last_error": job.last_error,
+                "created_at": job.created_at,
+            }
+            for job in dead
+        ],
+    }
+
+
+@router.post("/outbox/{job_id}/retry")
+def retry_outbox_job(job_id: int, session: Session = Depends(get_session)):
+    """Requeue a dead-lettered job with a fresh set of attempts."""
+    if not outbox.retry_job(session, job_id):
+        raise HTTPException(status_code=404, detail="No dead job with that id")
+    return {"requeued": job_id}
+
+
+@router.get("/invoices/export")
+def export_invoices(
+    start: date = Query(..., description="First invoice date to include"),
+    end: date = Query(..., description="Last invoice date to include"),
+):
+    """Download the invoices dated start..end (inclusive) as a ZIP of PDFs.
+
+    Missing PDFs are rendered in parallel by the render pool; the archive is
+    streamed entry by entry as they complete.
+    """
+    if end < start:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    invoices = invoices_between(datetime.combine(start, time.min), datetime.combine(end + timedelta(days=1), time.min))
+    return StreamingResponse(
+        export_invoices_zip(invoices),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="invoices_{start}_{end}.zip"'},
+    )
+
+
+@router.post("/mpesa/reconcile")
+def reconcile_mpesa(
+    statement: UploadFile = File(..., description="M-Pesa statement export (CSV)"),
+    dry_run: bool = Query(False, description="Report matches without marking orders paid"),
+    session: Session = Depends(get_session),
+):
+    """Mark unpaid M-Pesa orders paid from a statement export.
+
+    Payments are matched by receipt number, then by payer phone and amount.
+    Returns match counts and a sample of unmatched payments.
+    """
+    stream = io.TextIOWrapper(statement.file, encoding="utf-8-sig", newline="")
+    try:
+        return reconcile_statement(session, stream, dry_run=dry_run)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise HTTPException(status_code=400, detail=f"Could not read statement: {exc}")
+    except IntegrityError:
+        raise HTTPException(status_code=409, detail="Some payments were confirmed while reconciling; upload again")
+
+
 @router.post("/test-email")
 async def test_email(payload: dict = Body(...)):
     """Send a test email using configured SMTP settings. Payload: {to_email, subject, body}.
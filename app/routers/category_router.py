@@ -1,9 +1,13 @@
 # app/routers/category_router.py
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from sqlmodel import select, Session
 from app.db.session import get_session
 from app.models.models import Category
 from app.schemas.schemas import CategoryCreate, CategoryRead, CategoryUpdate
+from app.services import catalog_changes, suggest_index
+from app.services.catalog_cache import catalog_cache, catalog_last_modified
+from app.services.response_cache import response_cache
+from app.utils.http_cache import make_etag, cache_headers, is_not_modified, not_modified_response
 
 router = APIRouter(prefix="/categories", tags=["Categories"])
 
@@ -29,6 +33,8 @@ def create_category(category: CategoryCreate, session: Session = Depends(get_ses
     session.add(new_category)
     session.commit()
     session.refresh(new_category)
+    suggest_index.index_item("category", new_category.id, new_category.name)
+    catalog_cache.upsert_category(new_category)
     return new_category
 
 
@@ -36,22 +42,49 @@ def create_category(category: CategoryCreate, session: Session = Depends(get_ses
 # READ ALL CATEGORIES
 # =====================================
 @router.get("/", response_model=list[CategoryRead], status_code=status.HTTP_200_OK)
-def get_categories(session: Session = Depends(get_session)):
+def get_categories(request: Request, session: Session = Depends(get_session)):
+    # Served as pre-encoded JSON bytes while the catalog version is unchanged
+    version = catalog_cache.current_version(session)
+    if version is not None:
+        cached_response = response_cache.lookup(("categories",), version, request)
+        if cached_response is not None:
+            return cached_response
+    cached = catalog_cache.list_categories(session)
+    if cached is not None:
+        return response_cache.store(("categories",), version, cached, request, catalog_cache.last_modified())
     categories = session.exec(select(Category)).all()
-    return categories
+    return response_cache.render(
+        [CategoryRead.model_validate(category) for category in categories], request, catalog_last_modified(session)
+    )
 
 
 # =====================================
 # READ SINGLE CATEGORY BY ID
 # =====================================
 @router.get("/{category_id}", response_model=CategoryRead, status_code=status.HTTP_200_OK)
-def get_category(category_id: int, session: Session = Depends(get_session)):
-    category = session.get(Category, category_id)
-    if not category:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Category with ID {category_id} not found"
-        )
+def get_category(
+    category_id: int,
+    request: Request,
+    response: Response,
+    session: Session = Depends(get_session)
+):
+    category = catalog_cache.get_category(session, category_id)
+    if category is not None:
+        updated_at = category["updated_at"]
+    else:
+        category = session.get(Category, category_id)
+        if not category:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Category with ID {category_id} not found"
+            )
+        updated_at = category.updated_at
+
+    # Conditional GET: answer 304 without serializing the category
+    etag = make_etag("category", category_id, updated_at)
+    if is_not_modified(request, etag, updated_at):
+        return not_modified_response(etag, updated_at)
+    response.headers.update(cache_headers(etag, updated_at))
     return category
 
 
@@ -99,6 +132,8 @@ def update_category(
     session.add(category)
     session.commit()
     session.refresh(category)
+    suggest_index.index_item("category", category.id, category.name)
+    catalog_cache.upsert_category(category)
     return category
 
 
@@ -115,5 +150,8 @@ def delete_category(category_id: int, session: Session = Depends(get_session)):
         )
 
     session.delete(category)
+    catalog_changes.record_deletion(session, "category", category_id)
     session.commit()
+    suggest_index.remove_item("category", category_id)
+    catalog_cache.remove_category(category_id)
     return {"detail": f"Category with ID {category_id} deleted successfully"}
@@ -1,25 +1,134 @@
 # app/routers/order_router.py
-import os
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.responses import FileResponse
+import asyncio
+import json
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlmodel import select, Session
-from app.db.session import get_session
+from sqlalchemy import case, tuple_, update
+from sqlalchemy.orm import selectinload
+from app.db.session import engine, get_session
 from app.models.models import Order, OrderItem, Product, Invoice
-from app.schemas.schemas import OrderCreate, OrderRead, OrderUpdate, PaymentVerification
-from app.utils.pdf_generator import generate_invoice_pdf
+from app.schemas.schemas import OrderCreate, OrderRead, OrderPage, OrderUpdate, PaymentVerification
+from app.utils.pagination import encode_cursor, decode_cursor
+from app.utils.http_cache import make_etag, cache_headers, is_not_modified, not_modified_response
+from app.utils.pdf_generator import invoice_content_hash
 from app.services.email_service import (
-    send_order_notification,
-    send_payment_confirmation,
-    send_invoice_email
+    order_notification_emails,
+    payment_confirmation_emails,
+    invoice_emails,
+    shipment_notification_emails,
 )
-from app.config import get_settings
+from app.services import outbox, sales_rollup
+from app.services.invoice_renderer import build_invoice_data, invoice_pdf_bytes
+from app.services.notification_digest import queue_notifications
+from app.services.payment_events import announce, payment_events, payment_state
+from app.services.idempotency import claim, payment_key, payment_keys
+from app.services.catalog_cache import catalog_cache
+from app.services.order_export import EXPORT_FORMATS
+from app.services.mpesa_client import MpesaRequestError, MpesaUnavailable, get_mpesa_client, parse_stk_callback
 import time
 import uuid
 
 router = APIRouter(prefix="/orders", tags=["Orders"])
 
 
+# ===============================
+# ORDER LOADING & SERIALIZATION
+# ===============================
+def _order_load_options():
+    """Eager-load items and their products so serializing N orders costs a
+    fixed number of queries (orders, items, products) instead of 1 + 2N."""
+    return selectinload(Order.items).selectinload(OrderItem.product)
+
+
+def _load_order(session: Session, order_id: int) -> Optional[Order]:
+    """Fetch a single order with its items and products eagerly loaded."""
+    return session.exec(
+        select(Order).where(Order.id == order_id).options(_order_load_options())
+    ).first()
+
+
+def _serialize_order(order: Order) -> dict:
+    """Build the plain dict returned by every order endpoint (matches OrderRead)."""
+    items_response = []
+    for item in order.items:
+        product = item.product
+        items_response.append(
+            {
+                "id": item.id,
+                "product_id": item.product_id,
+                "product": {"id": product.id, "name": product.name, "price": product.price} if product else None,
+                "quantity": item.quantity,
+                "price": item.price,
+            }
+        )
+
+    return {
+        "id": order.id,
+        "customer_name": order.customer_name,
+        "customer_phone": order.customer_phone,
+        "customer_email": order.customer_email,
+        "delivery_address": order.delivery_address,
+        "status": order.status,
+        "payment_method": order.payment_method,
+        "payment_status": order.payment_status,
+        "total_amount": order.total_amount,
+        "total_price": order.total_price,
+        "shipping_cost": order.shipping_cost,
+        "shipping_provider": order.shipping_provider,
+        "tracking_number": order.tracking_number,
+        "shipped_at": order.shipped_at,
+        "created_at": order.created_at,
+        "updated_at": order.updated_at,
+        "items": items_response,
+    }
+
+
+def _order_validators(order: Order):
+    """ETag and Last-Modified for an order.
+
+    The representation embeds each line item's product name and price, so
+    those go into the ETag. The product's `updated_at` doesn't: every
+    checkout's stock decrement bumps it without changing this order.
+    Last-Modified is the order's own `updated_at`.
+    """
+    embedded = [
+        (item.id, item.product.name, item.product.price) if item.product else (item.id,)
+        for item in order.items
+    ]
+    return make_etag("order", order.id, order.updated_at, embedded), order.updated_at
+
+
+# ===============================
+# STOCK RESERVATION
+# ===============================
+def _reserve_stock(session: Session, requested: dict[int, int]):
+    """Take `requested` {product_id: quantity} out of stock in one conditional UPDATE.
+
+    The database checks `stock_quantity >= quantity` against the current row
+    as it writes it, so concurrent checkouts can never both take the last
+    units. If any line can't be covered the transaction is rolled back and a
+    400 names a product that ran out.
+    """
+    quantity = case(requested, value=Product.id)
+    result = session.exec(
+        update(Product)
+        .where(Product.id.in_(requested), Product.stock_quantity >= quantity)
+        .values(stock_quantity=Product.stock_quantity - quantity)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == len(requested):
+        return
+    session.rollback()
+    short = session.exec(
+        select(Product.name).where(Product.id.in_(requested), Product.stock_quantity < quantity).order_by(Product.id)
+    ).first()
+    raise HTTPException(status_code=400, detail=f"Insufficient stock for {short or 'one or more products'}")
+
+
 # ===============================
 # CREATE ORDER (with email notifications)
 # ===============================
@@ -29,12 +138,37 @@ def create_order(order_data: OrderCreate, session: Session = Depends(get_session
     if not order_data.items:
         raise HTTPException(status_code=400, detail="Order must have at least one product")
 
+    # All products in one IN query; validate every line before writing anything.
+    # FOR UPDATE (PostgreSQL) locks the rows in id order so two orders that
+    # share products queue behind each other instead of deadlocking.
+    product_ids = {item.product_id for item in order_data.items}
+    products = {
+        product.id: product
+        for product in session.exec(
+            select(Product).where(Product.id.in_(product_ids)).order_by(Product.id).with_for_update()
+        ).all()
+    }
+    requested = {}
+    for item in order_data.items:
+        if item.product_id not in products:
+            raise HTTPException(status_code=404, detail=f"Product ID {item.product_id} not found")
+        requested[item.product_id] = requested.get(item.product_id, 0) + item.quantity
+    for product_id, quantity in requested.items():
+        product = products[product_id]
+        if product.stock_quantity < quantity:
+            raise HTTPException(status_code=400, detail=f"Insufficient stock for {product.name}")
+    _reserve_stock(session, requested)
+
     # Calculate totals
     subtotal = 0.0
     shipping_cost = 500.0
-    total_amount = order_data.total_amount or 0.0
+    order_items = []
+    for item in order_data.items:
+        product = products[item.product_id]
+        item_price = item.price if hasattr(item, 'price') and item.price else product.price
+        subtotal += item_price * item.quantity
+        order_items.append(OrderItem(product=product, quantity=item.quantity, price=item_price))
 
-    # Initialize order
     order = Order(
         customer_name=order_data.customer_name,
         customer_email=order_data.customer_email,
@@ -45,94 +179,30 @@ def create_order(order_data: OrderCreate, session: Session = Depends(get_session
         payment_status="pending",
         notes=order_data.notes,
         created_at=datetime.utcnow(),
-        total_price=0.0,
+        total_price=subtotal,
         shipping_cost=shipping_cost,
-        total_amount=total_amount
+        total_amount=order_data.total_amount or subtotal + shipping_cost,
+        items=order_items,
     )
-    session.add(order)
-    session.commit()
-    session.refresh(order)
-
-    order_items = []
-
-    # Process each product
-    for item in order_data.items:
-        product = session.get(Product, item.product_id)
-        if not product:
-            raise HTTPException(status_code=404, detail=f"Product ID {item.product_id} not found")
-
-        if product.stock_quantity < item.quantity:
-            raise HTTPException(status_code=400, detail=f"Insufficient stock for {product.name}")
-
-        item_price = item.price if hasattr(item, 'price') and item.price else product.price
-        total_price = item_price * item.quantity
-        subtotal += total_price
-
-        # Update product stock
-        product.stock_quantity -= item.quantity
-        session.add(product)
-
-        order_item = OrderItem(
-            order_id=order.id,
-            product_id=item.product_id,
-            quantity=item.quantity,
-            price=item_price
-        )
-        session.add(order_item)
-        order_items.append(order_item)
-
-    # Update order totals
-    order.total_price = subtotal
-    if not order_data.total_amount:
-        order.total_amount = subtotal + shipping_cost
-    session.add(order)
-    session.commit()
-    session.refresh(order)
-
-    # ===============================
-    # Create Invoice Record
-    # ===============================
     new_invoice = Invoice(
-        order_id=order.id,
+        order=order,
         total_amount=order.total_amount,
         payment_method=order.payment_method,
         payment_status="Pending",
         invoice_date=datetime.utcnow()
     )
-    session.add(new_invoice)
-    session.commit()
-    session.refresh(new_invoice)
-
-    # ===============================
-    # Generate PDF Invoice/Receipt
-    # ===============================
-    order_items_data = [
-        {
-            "name": session.get(Product, item.product_id).name,
-            "quantity": item.quantity,
-            "price": item.price
-        }
-        for item in order_items
-    ]
-
-    invoice_data = {
-        "invoice_id": new_invoice.id,
-        "customer_name": order.customer_name,
-        "customer_phone": order.customer_phone,
-        "delivery_address": order.delivery_address,
-        "order_items": order_items_data,
-        "total_price": order.total_amount,
-        "invoice_date": new_invoice.invoice_date,
-    }
-
-    pdf_path = generate_invoice_pdf(invoice_data)
-    new_invoice.remarks = f"PDF generated at: {pdf_path}"
-    session.add(new_invoice)
-    session.commit()
+    session.add(order)
+    # One flush assigns the order, item and invoice ids (stock was already
+    # reserved above, in the same transaction)
+    session.flush()
 
     # ===============================
-    # Send Email Notifications
+    # Queue PDF Invoice/Receipt and Email Notifications
     # ===============================
+    # Both run in the outbox worker; the jobs commit together with the order
+    invoice_data = build_invoice_data(
+        new_invoice, order, [(item.product.name, item.quantity, item.price) for item in order_items]
+    )
     order_dict = {
         "id": order.id,
         "customer_name": order.customer_name,
@@ -144,48 +214,19 @@ def create_order(order_data: OrderCreate, session: Session = Depends(get_session
         "payment_method": order.payment_method,
         "status": order.status
     }
-
-    # Send to admin
+    # The invoice job attaches the rendered PDF to these
+    customer_emails = invoice_emails(order_dict) if order_data.send_email_to_customer else []
+    outbox.enqueue(session, "invoice", {"invoice_data": invoice_data, "emails": customer_emails})
     if order_data.send_email_to_admin:
-        send_order_notification(order_dict)
+        queue_notifications(session, "order", order_dict, order_notification_emails(order_dict))
+    # Last statement before the commit: keeps the shared per-day row locked briefly
+    sales_rollup.add_order(session, order, [(item.product_id, item.quantity, item.price) for item in order_items])
 
-    # Send invoice to customer if email provided
-    if order_data.send_email_to_customer and order.customer_email:
-        send_invoice_email(order_dict, pdf_path)
-
-    # Build a plain dict for the response to avoid setting relationship attributes
-    order_items = session.exec(
-        select(OrderItem).where(OrderItem.order_id == order.id)
-    ).all()
-
-    items_response = []
-    for item in order_items:
-        product = session.get(Product, item.product_id)
-        items_response.append(
-            {
-                "id": item.id,
-                "product_id": item.product_id,
-                "product": {"id": product.id, "name": product.name, "price": product.price} if product else None,
-                "quantity": item.quantity,
-                "price": item.price,
-            }
-        )
-
-    order_response = {
-        "id": order.id,
-        "customer_name": order.customer_name,
-        "customer_phone": order.customer_phone,
-        "customer_email": order.customer_email,
-        "delivery_address": order.delivery_address,
-        "status": order.status,
-        "payment_method": order.payment_method,
-        "payment_status": order.payment_status,
-        "total_amount": order.total_amount,
-        "total_price": order.total_price,
-        "shipping_cost": order.shipping_cost,
-        "created_at": order.created_at,
-        "items": items_response,
-    }
+    # Captured before the commit expires the loaded objects
+    order_response = _serialize_order(order)
+    session.commit()
+    # Stock levels changed; refresh them in the catalog snapshot
+    catalog_cache.refresh_products(session, product_ids)
 
     return order_response
 
@@ -200,6 +241,18 @@ def verify_payment(
     session: Session = Depends(get_session)
 ):
     """Verify MPESA payment with confirmation code."""
+    # In a real implementation, you would verify the MPESA code with Safaricom API
+    # For now, we'll do basic validation (code should be alphanumeric, 6-10 chars)
+    mpesa_code = verification.mpesa_code.strip().upper()
+    if len(mpesa_code) < 6 or len(mpesa_code) > 10:
+        raise HTTPException(status_code=400, detail="Invalid MPESA confirmation code format")
+
+    # A resubmitted code is answered from the idempotency cache
+    key = payment_key(mpesa_code, order_id)
+    applied_to = payment_keys.get(key)
+    if applied_to is not None:
+        return _verified_response(order_id, applied_to)
+
     order = session.get(Order, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
@@ -210,12 +263,6 @@ def verify_payment(
     if order.payment_verified:
         raise HTTPException(status_code=400, detail="Payment already verified")
 
-    # In a real implementation, you would verify the MPESA code with Safaricom API
-    # For now, we'll do basic validation (code should be alphanumeric, 6-10 chars)
-    mpesa_code = verification.mpesa_code.strip().upper()
-    if len(mpesa_code) < 6 or len(mpesa_code) > 10:
-        raise HTTPException(status_code=400, detail="Invalid MPESA confirmation code format")
-
     # Verify phone number matches
     if order.customer_phone != verification.phone_number:
         raise HTTPException(
@@ -223,13 +270,15 @@ def verify_payment(
             detail="Phone number does not match order"
         )
 
+    applied_to = claim(session, key, order.id, "manual")
+    if applied_to is not None:
+        return _verified_response(order_id, applied_to)
+
     # Update order payment status
     order.mpesa_code = mpesa_code
     order.payment_verified = True
     order.payment_status = "verified"
     session.add(order)
-    session.commit()
-    session.refresh(order)
 
     # Update invoice
     invoice = session.exec(select(Invoice).where(Invoice.order_id == order_id)).first()
@@ -237,9 +286,8 @@ def verify_payment(
         invoice.payment_status = "Paid"
         invoice.payment_method = "MPESA"
         session.add(invoice)
-        session.commit()
 
-    # Send payment confirmation emails
+    # Queue payment confirmation emails; committed with the payment update
     order_dict = {
         "id": order.id,
         "customer_name": order.customer_name,
@@ -251,48 +299,89 @@ def verify_payment(
         "mpesa_code": mpesa_code,
         "status": order.status
     }
-    send_payment_confirmation(order_dict)
+    queue_notifications(session, "payment", order_dict, payment_confirmation_emails(order_dict))
+    announce(session, order.id, payment_state(order))
+    session.commit()
 
+    return _verified_response(order_id, order_id)
+
+
+def _verified_response(order_id: int, applied_to: int) -> dict:
+    """Response for a verified payment; repeated submissions of the same code
+    get the same answer, a code already used for another order is refused."""
+    if applied_to != order_id:
+        raise HTTPException(status_code=400, detail="This MPESA code has already been used for another order")
     return {
         "success": True,
         "message": "Payment verified successfully",
-        "order_id": order.id,
+        "order_id": order_id,
         "payment_status": "verified"
     }
 
 
 # ===============================
-# INITIATE MPESA STK PUSH (Pochi / Simulation)
+# INITIATE MPESA STK PUSH (Daraja / Simulation)
 # ===============================
+def _push_target(order_id: int) -> Optional[dict]:
+    with Session(engine) as session:
+        order = session.get(Order, order_id)
+        if not order:
+            return None
+        return {"amount": order.total_amount or order.total_price}
+
+
+def _record_push(order_id: int, request_id: str):
+    with Session(engine) as session:
+        order = session.get(Order, order_id)
+        order.mpesa_request_id = request_id
+        if order.payment_status == "failed":
+            # A retry after a cancelled or failed prompt
+            order.payment_status = "pending"
+        session.add(order)
+        announce(session, order.id, payment_state(order))
+        session.commit()
+
+
 @router.post("/{order_id}/mpesa/push")
-def initiate_mpesa_push(order_id: int, payload: dict, session: Session = Depends(get_session)):
-    """Initiate an STK Push for the given order. If an external MPESA provider is configured
-    (via settings/payment), this will attempt to call it; otherwise we simulate and return
-    a request id. The frontend can poll the status endpoint or rely on webhook callbacks.
+async def initiate_mpesa_push(order_id: int, payload: dict):
+    """Initiate an STK Push for the given order. If Daraja credentials are configured
+    (see app/services/mpesa_client.py) the customer is prompted through the provider;
+    otherwise we simulate and return a request id. The frontend can poll the status
+    endpoint or rely on webhook callbacks.
     Payload should include: phone_number (string) and optional amount (float).
     """
-    order = session.get(Order, order_id)
-    if not order:
+    # Database work runs in the threadpool; the provider call is awaited on the
+    # event loop so a slow provider doesn't hold a worker thread
+    target = await run_in_threadpool(_push_target, order_id)
+    if target is None:
         raise HTTPException(status_code=404, detail="Order not found")
 
     phone = payload.get("phone_number")
-    amount = payload.get("amount") or order.total_amount or order.total_price
+    amount = payload.get("amount") or target["amount"]
     if not phone:
         raise HTTPException(status_code=400, detail="phone_number is required")
 
-    settings = get_settings()
-    mpesa_cfg = settings.get("payment", {}).get("mpesa", {})
-
-    # If real provider credentials are not configured, simulate a push request
-    # and store a request reference on the order record.
-    request_id = f"SIM-{order_id}-{int(time.time())}"
-    order.mpesa_request_id = request_id
-    session.add(order)
-    session.commit()
-    session.refresh(order)
-
-    # In a real integration we'd call the provider here and return their request id
-    return {"request_id": request_id, "message": "STK Push initiated (simulated)"}
+    client = get_mpesa_client()
+    if client is None:
+        # Provider credentials are not configured: simulate a push request
+        # and store a request reference on the order record.
+        # Millisecond stamp so a quick retry gets its own id
+        request_id = f"SIM-{order_id}-{int(time.time() * 1000)}"
+        message = "STK Push initiated (simulated)"
+    else:
+        try:
+            result = await client.stk_push(phone, amount, f"ORDER{order_id}", f"Order {order_id}")
+        except MpesaUnavailable as e:
+            print(f"Warning: STK push for order {order_id} failed: {e}")
+            raise HTTPException(status_code=503, detail="MPESA is temporarily unavailable, please try again")
+        except MpesaRequestError as e:
+            print(f"Warning: STK push for order {order_id} rejected: {e}")
+            raise HTTPException(status_code=502, detail="MPESA could not start the payment request")
+        request_id = result["CheckoutRequestID"]
+        message = result.get("CustomerMessage") or "STK Push initiated"
+
+    await run_in_threadpool(_record_push, order_id, request_id)
+    return {"request_id": request_id, "message": message}
 
 
 # ===============================
@@ -304,13 +393,66 @@ def mpesa_status(order_id: int, session: Session = Depends(get_session)):
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    return {
-        "order_id": order.id,
-        "payment_status": order.payment_status,
-        "payment_verified": order.payment_verified,
-        "mpesa_request_id": order.mpesa_request_id,
-        "mpesa_code": order.mpesa_code,
-    }
+    return payment_state(order)
+
+
+# ===============================
+# MPESA STATUS (pushed as server-sent events)
+# ===============================
+PAYMENT_EVENTS_HEARTBEAT_SECONDS = 15
+# Streams are closed after this long; EventSource reconnects on its own
+PAYMENT_EVENTS_MAX_SECONDS = 600
+
+
+def _current_payment_status(order_id: int) -> Optional[dict]:
+    # Own short-lived session: a request-scoped one would stay open as long as the stream
+    with Session(engine) as session:
+        order = session.get(Order, order_id)
+        return payment_state(order) if order else None
+
+
+def _sse(data: dict) -> str:
+    return f"event: status\ndata: {json.dumps(data)}\n\n"
+
+
+async def _payment_event_stream(order_id: int, queue: asyncio.Queue, current: dict, request: Request):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + PAYMENT_EVENTS_MAX_SECONDS
+    try:
+        yield "retry: 3000\n" + _sse(current)
+        while not current.get("payment_verified") and loop.time() < deadline:
+            if await request.is_disconnected():
+                break
+            try:
+                current = await asyncio.wait_for(queue.get(), PAYMENT_EVENTS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # Keeps proxies from closing an idle connection
+                yield ": keep-alive\n\n"
+                continue
+            yield _sse(current)
+    finally:
+        payment_events.unsubscribe(order_id, queue)
+
+
+@router.get("/{order_id}/mpesa/events")
+async def mpesa_events(order_id: int, request: Request):
+    """Stream the order's payment status as server-sent events.
+
+    Sends the current status, then each change as it is committed (STK push,
+    webhook confirmation, manual verification). The stream ends once the
+    payment is verified. No queries are made while waiting.
+    """
+    # Subscribe before reading so a change committed in between isn't missed
+    queue = payment_events.subscribe(order_id)
+    current = await run_in_threadpool(_current_payment_status, order_id)
+    if current is None:
+        payment_events.unsubscribe(order_id, queue)
+        raise HTTPException(status_code=404, detail="Order not found")
+    return StreamingResponse(
+        _payment_event_stream(order_id, queue, current, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # ===============================
@@ -319,9 +461,15 @@ def mpesa_status(order_id: int, session: Session = Depends(get_session)):
 @router.post("/mpesa/webhook")
 def mpesa_webhook(payload: dict, session: Session = Depends(get_session)):
     """Receive MPESA payment confirmation callbacks from provider.
-    Expected payload (varies by provider): {order_id, mpesa_code, phone_number, status, amount}
+    Expected payload (varies by provider): {order_id, mpesa_code, phone_number, status, amount},
+    or a Daraja STK callback ({"Body": {"stkCallback": ...}}), matched to its order by
+    CheckoutRequestID.
     This endpoint marks the order as paid/verified and sends notifications.
     """
+    callback = parse_stk_callback(payload)
+    if callback is not None:
+        return _stk_callback(callback, session)
+
     order_id = payload.get("order_id")
     mpesa_code = payload.get("mpesa_code")
     phone_number = payload.get("phone_number")
@@ -330,21 +478,30 @@ def mpesa_webhook(payload: dict, session: Session = Depends(get_session)):
     if not order_id:
         raise HTTPException(status_code=400, detail="order_id required")
 
+    # Only accept successful statuses
+    if str(status).upper() not in ("SUCCESS", "PAID", "COMPLETED"):
+        return {"received": True, "message": "Ignored non-successful status"}
+
+    # Provider retries of a callback we already applied are acknowledged
+    # without touching the database
+    key = payment_key(mpesa_code, int(order_id))
+    applied_to = payment_keys.get(key)
+    if applied_to is not None:
+        return _duplicate_callback(key, int(order_id), applied_to)
+
     order = session.get(Order, int(order_id))
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    # Only accept successful statuses
-    if str(status).upper() not in ("SUCCESS", "PAID", "COMPLETED"):
-        return {"received": True, "message": "Ignored non-successful status"}
+    applied_to = claim(session, key, order.id, "webhook")
+    if applied_to is not None:
+        return _duplicate_callback(key, order.id, applied_to)
 
     # Update order
     order.mpesa_code = mpesa_code or order.mpesa_code
     order.payment_verified = True
     order.payment_status = "verified"
     session.add(order)
-    session.commit()
-    session.refresh(order)
 
     # Update invoice if present
     invoice = session.exec(select(Invoice).where(Invoice.order_id == order.id)).first()
@@ -352,9 +509,8 @@ def mpesa_webhook(payload: dict, session: Session = Depends(get_session)):
         invoice.payment_status = "Paid"
         invoice.payment_method = "MPESA"
         session.add(invoice)
-        session.commit()
 
-    # Send notifications
+    # Queue notifications; committed with the payment update
     order_dict = {
         "id": order.id,
         "customer_name": order.customer_name,
@@ -366,105 +522,191 @@ def mpesa_webhook(payload: dict, session: Session = Depends(get_session)):
         "mpesa_code": order.mpesa_code,
         "status": order.status,
     }
-    send_payment_confirmation(order_dict)
+    queue_notifications(session, "payment", order_dict, payment_confirmation_emails(order_dict))
+    announce(session, order.id, payment_state(order))
+    session.commit()
 
     return {"received": True, "order_id": order.id}
 
 
+def _stk_callback(callback: dict, session: Session) -> dict:
+    """Apply a Daraja STK callback through the generic webhook path."""
+    order_id = session.exec(
+        select(Order.id).where(Order.mpesa_request_id == callback["checkout_request_id"])
+    ).first()
+    if order_id is None:
+        # Acknowledge anyway: Daraja would keep retrying a request we never sent
+        print(f"Warning: STK callback for unknown request {callback['checkout_request_id']}")
+        return {"received": True, "message": "Unknown CheckoutRequestID"}
+    if callback["status"] != "SUCCESS":
+        # Cancelled, timed out or insufficient funds: let the waiting page know
+        order = session.get(Order, order_id)
+        if not order.payment_verified:
+            order.payment_status = "failed"
+            session.add(order)
+            announce(session, order.id, payment_state(order))
+            session.commit()
+        return {"received": True, "message": callback["result_description"] or "Payment not completed"}
+    return mpesa_webhook(
+        {
+            "order_id": order_id,
+            "mpesa_code": callback["mpesa_code"],
+            "phone_number": callback["phone_number"],
+            "status": callback["status"],
+            "amount": callback["amount"],
+        },
+        session,
+    )
+
+
+def _duplicate_callback(key: str, order_id: int, applied_to: int) -> dict:
+    if applied_to != order_id:
+        # Still a 2xx: the provider can't fix this by retrying
+        print(f"Warning: payment {key} for order {order_id} was already applied to order {applied_to}")
+    return {"received": True, "order_id": order_id, "duplicate": True}
+
+
 # ===============================
 # READ ALL ORDERS
 # ===============================
-@router.get("/", response_model=list[OrderRead])
-def get_orders(session: Session = Depends(get_session)):
-    """Get all orders with their items."""
-    orders = session.exec(select(Order)).all()
-    result = []
-    # Build plain serializable dicts for each order
-    for order in orders:
-        order_items = session.exec(
-            select(OrderItem).where(OrderItem.order_id == order.id)
-        ).all()
+@router.get("/", response_model=OrderPage)
+def get_orders(
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    order_status: Optional[str] = Query(None, alias="status"),
+    payment_status: Optional[str] = None,
+    payment_method: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    customer_phone: Optional[str] = None,
+    customer_email: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
+    """Get orders newest first, one page at a time.
 
-        items_response = []
-        for item in order_items:
-            product = session.get(Product, item.product_id)
-            items_response.append(
-                {
-                    "id": item.id,
-                    "product_id": item.product_id,
-                    "product": {"id": product.id, "name": product.name, "price": product.price} if product else None,
-                    "quantity": item.quantity,
-                    "price": item.price,
-                }
-            )
-
-        result.append(
-            {
-                "id": order.id,
-                "customer_name": order.customer_name,
-                "customer_phone": order.customer_phone,
-                "customer_email": order.customer_email,
-                "delivery_address": order.delivery_address,
-                "status": order.status,
-                "payment_method": order.payment_method,
-                "payment_status": order.payment_status,
-                "total_amount": order.total_amount,
-                "total_price": order.total_price,
-                "shipping_cost": order.shipping_cost,
-                "created_at": order.created_at,
-                "items": items_response,
-            }
-        )
+    Uses keyset pagination on (created_at, id): pass the returned `next_cursor`
+    back as `cursor` to get the following page. Each page is a single index
+    range scan, so its cost doesn't grow with the size of the table.
+    """
+    query = select(Order)
+
+    if order_status:
+        query = query.where(Order.status == order_status)
+    if payment_status:
+        query = query.where(Order.payment_status == payment_status)
+    if payment_method:
+        query = query.where(Order.payment_method == payment_method)
+    if created_from:
+        query = query.where(Order.created_at >= created_from)
+    if created_to:
+        query = query.where(Order.created_at < created_to)
+    if customer_phone:
+        query = query.where(Order.customer_phone == customer_phone)
+    if customer_email:
+        query = query.where(Order.customer_email == customer_email)
+
+    if cursor:
+        cursor_created_at, cursor_id = decode_cursor(cursor, 2)
+        try:
+            cursor_created_at = datetime.fromisoformat(cursor_created_at)
+            cursor_id = int(cursor_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query = query.where(tuple_(Order.created_at, Order.id) < tuple_(cursor_created_at, cursor_id))
+
+    # Fetch one extra row to know whether another page follows
+    query = query.order_by(Order.created_at.desc(), Order.id.desc()).limit(limit + 1)
+    orders = session.exec(query.options(_order_load_options())).all()
+
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1].created_at, orders[-1].id)
+
+    return {"items": [_serialize_order(order) for order in orders], "next_cursor": next_cursor}
 
-    return result
+
+# ===============================
+# EXPORT ORDERS (streamed CSV / JSON lines)
+# ===============================
+@router.get("/export")
+def export_orders(
+    format: str = Query("csv", pattern="^(csv|jsonl)$"),
+    order_status: Optional[str] = Query(None, alias="status"),
+    payment_status: Optional[str] = None,
+    payment_method: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+):
+    """Download orders and their items, oldest first, for accounting.
+
+    CSV has one row per order item; JSONL has one order per line with its
+    items. The response is streamed from a server-side cursor, so memory use
+    doesn't depend on how many orders match. Same output as `export_orders.py`.
+    """
+    generate, media_type = EXPORT_FORMATS[format]
+    filename = f"orders_{datetime.utcnow():%Y%m%d_%H%M%S}.{format}"
+    return StreamingResponse(
+        generate(
+            status=order_status,
+            payment_status=payment_status,
+            payment_method=payment_method,
+            created_from=created_from,
+            created_to=created_to,
+        ),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 # ===============================
 # READ SINGLE ORDER
 # ===============================
 @router.get("/{order_id}", response_model=OrderRead)
-def get_order(order_id: int, session: Session = Depends(get_session)):
-    """Get a single order with its items."""
-    order = session.get(Order, order_id)
+def get_order(
+    order_id: int,
+    request: Request,
+    response: Response,
+    session: Session = Depends(get_session)
+):
+    """Get a single order with its items.
+
+    Supports conditional GET: a matching If-None-Match / If-Modified-Since
+    gets a 304 without serializing the order.
+    """
+    order = _load_order(session, order_id)
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
-    
-    # Load order items with product details
-    order_items = session.exec(
-        select(OrderItem).where(OrderItem.order_id == order_id)
-    ).all()
-    
-    # Build serializable response dict
-    items_response = []
-    for item in order_items:
-        product = session.get(Product, item.product_id)
-        items_response.append(
-            {
-                "id": item.id,
-                "product_id": item.product_id,
-                "product": {"id": product.id, "name": product.name, "price": product.price} if product else None,
-                "quantity": item.quantity,
-                "price": item.price,
-            }
-        )
 
-    order_response = {
-        "id": order.id,
-        "customer_name": order.customer_name,
-        "customer_phone": order.customer_phone,
-        "customer_email": order.customer_email,
-        "delivery_address": order.delivery_address,
-        "status": order.status,
-        "payment_method": order.payment_method,
-        "payment_status": order.payment_status,
-        "total_amount": order.total_amount,
-        "total_price": order.total_price,
-        "shipping_cost": order.shipping_cost,
-        "created_at": order.created_at,
-        "items": items_response,
-    }
+    validators = _order_validators(order)
+    if is_not_modified(request, *validators):
+        return not_modified_response(*validators)
+    response.headers.update(cache_headers(*validators))
+    return _serialize_order(order)
 
-    return order_response
+
+def _lock_order_status(session: Session, order: Order) -> bool:
+    """Write-lock the order's row while it is still in the status we read,
+    re-reading it if another request changed it first. Returns False if the
+    order was deleted meanwhile.
+
+    The rollup moves an order out of `order.status`, so that status must not
+    change before this transaction commits. Otherwise two concurrent requests
+    would both move the order out of the same status. The conditional no-op
+    UPDATE locks the row on PostgreSQL and takes the write lock on SQLite.
+    """
+    while True:
+        result = session.execute(
+            update(Order)
+            .where(Order.id == order.id, Order.status == order.status)
+            .values(status=order.status)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            return True
+        if session.exec(select(Order.id).where(Order.id == order.id)).first() is None:
+            return False
+        session.refresh(order)
 
 
 # ===============================
@@ -481,75 +723,44 @@ def update_order(
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     update_data = order_update.dict(exclude_unset=True)
-    previous_status = order.status
+    if "status" in update_data and not _lock_order_status(session, order):
+        raise HTTPException(status_code=404, detail="Order not found")
+    old_status = order.status
     for key, value in update_data.items():
         setattr(order, key, value)
-
     session.add(order)
-    session.commit()
-    session.refresh(order)
-    
-    # Build response dict including items
-    order_items = session.exec(
-        select(OrderItem).where(OrderItem.order_id == order_id)
-    ).all()
 
-    items_response = []
-    for item in order_items:
-        product = session.get(Product, item.product_id)
-        items_response.append(
-            {
-                "id": item.id,
-                "product_id": item.product_id,
-                "product": {"id": product.id, "name": product.name, "price": product.price} if product else None,
-                "quantity": item.quantity,
-                "price": item.price,
-            }
+    # If the order was just marked as shipped or tracking info added, queue
+    # notifications in the same transaction as the update
+    if update_data.get("status") == "shipped" or update_data.get("tracking_number"):
+        order_dict_notify = {
+            "id": order.id,
+            "customer_name": order.customer_name,
+            "customer_email": order.customer_email,
+            "customer_phone": order.customer_phone,
+            "delivery_address": order.delivery_address,
+            "total_amount": order.total_amount,
+            "total_price": order.total_price,
+            "payment_method": order.payment_method,
+            "status": order.status,
+            "tracking_number": order.tracking_number,
+            "shipping_provider": order.shipping_provider,
+        }
+        queue_notifications(
+            session,
+            "shipment",
+            order_dict_notify,
+            order_notification_emails(order_dict_notify) + shipment_notification_emails(order_dict_notify),
         )
+    # An admin confirming payment by hand also reaches a waiting customer
+    if "payment_status" in update_data:
+        announce(session, order.id, payment_state(order))
+    if order.status != old_status:
+        sales_rollup.change_status(session, order, sales_rollup.order_lines(session, order.id), old_status)
+    session.commit()
 
-    order_response = {
-        "id": order.id,
-        "customer_name": order.customer_name,
-        "customer_phone": order.customer_phone,
-        "customer_email": order.customer_email,
-        "delivery_address": order.delivery_address,
-        "status": order.status,
-        "payment_method": order.payment_method,
-        "payment_status": order.payment_status,
-        "total_amount": order.total_amount,
-        "total_price": order.total_price,
-        "shipping_cost": order.shipping_cost,
-        "created_at": order.created_at,
-        "items": items_response,
-    }
-    # If the order was just marked as shipped or tracking info added, send notifications
-    try:
-        if ("status" in update_data and update_data.get("status") == "shipped") or ("tracking_number" in update_data and update_data.get("tracking_number")):
-            order_dict_notify = {
-                "id": order.id,
-                "customer_name": order.customer_name,
-                "customer_email": order.customer_email,
-                "customer_phone": order.customer_phone,
-                "total_amount": order.total_amount,
-                "total_price": order.total_price,
-                "payment_method": order.payment_method,
-                "status": order.status,
-                "tracking_number": order.tracking_number,
-                "shipping_provider": order.shipping_provider,
-            }
-            # send shipment notification (best-effort)
-            try:
-                send_order_notification(order_dict_notify)  # notify admin
-            except Exception:
-                pass
-            try:
-                from app.services.email_service import send_shipment_notification
-                send_shipment_notification(order_dict_notify)
-            except Exception:
-                pass
-    except Exception:
-        # don't fail the update because notification failed
-        pass
+    # Build response dict including items
+    order_response = _serialize_order(_load_order(session, order_id))
 
     return order_response
 
@@ -561,11 +772,12 @@ def update_order(
 def delete_order(order_id: int, session: Session = Depends(get_session)):
     """Delete an order and its associated items."""
     order = session.get(Order, order_id)
-    if not order:
+    if not order or not _lock_order_status(session, order):
         raise HTTPException(status_code=404, detail="Order not found")
 
     # Delete order items first
     order_items = session.exec(select(OrderItem).where(OrderItem.order_id == order_id)).all()
+    sales_rollup.add_order(session, order, [(item.product_id, item.quantity, item.price) for item in order_items], sign=-1)
     for item in order_items:
         session.delete(item)
 
@@ -577,8 +789,12 @@ def delete_order(order_id: int, session: Session = Depends(get_session)):
 # ===============================
 # GENERATE OR DOWNLOAD INVOICE PDF FOR AN ORDER
 # ===============================
-@router.get("/{order_id}/invoice", response_class=FileResponse)
-def get_order_invoice(order_id: int, session: Session = Depends(get_session)):
+# PDFs are returned from memory; this documents the body as application/pdf
+PDF_RESPONSES = {200: {"content": {"application/pdf": {}}, "description": "The invoice PDF"}}
+
+
+@router.get("/{order_id}/invoice", response_class=Response, responses=PDF_RESPONSES)
+def get_order_invoice(order_id: int, request: Request, session: Session = Depends(get_session)):
     """Generate or return an existing PDF invoice for the given order."""
     order = session.get(Order, order_id)
     if not order:
@@ -589,46 +805,35 @@ def get_order_invoice(order_id: int, session: Session = Depends(get_session)):
     if not invoice:
         raise HTTPException(status_code=404, detail="No invoice record found for this order")
 
-    # Path where PDF should exist
-    pdf_path = f"app/static/invoices/invoice_{invoice.id}.pdf"
-
-    # Regenerate the PDF if missing
-    if not os.path.exists(pdf_path):
-        order_items = session.exec(select(OrderItem).where(OrderItem.order_id == order_id)).all()
-        order_items_data = [
-            {
-                "name": session.get(Product, item.product_id).name,
-                "quantity": item.quantity,
-                "price": item.price,
-            }
-            for item in order_items
-        ]
-
-        invoice_data = {
-            "invoice_id": invoice.id,
-            "customer_name": order.customer_name,
-            "customer_phone": order.customer_phone,
-            "delivery_address": order.delivery_address,
-            "order_items": order_items_data,
-            "total_price": order.total_amount or order.total_price,
-            "invoice_date": invoice.invoice_date,
-        }
-
-        pdf_path = generate_invoice_pdf(invoice_data)
-
-    # Return the file for download
-    return FileResponse(
-        pdf_path,
-        filename=f"invoice_{invoice.id}.pdf",
-        media_type="application/pdf"
+    # The rendered PDF is cached under a hash of its content, so this is a
+    # cache lookup unless the items or totals changed since the last render
+    items = session.exec(
+        select(Product.name, OrderItem.quantity, OrderItem.price, OrderItem.product_id)
+        .join(Product, Product.id == OrderItem.product_id, isouter=True)
+        .where(OrderItem.order_id == order_id)
+        .order_by(OrderItem.id)
+    ).all()
+    invoice_data = build_invoice_data(
+        invoice, order, [(name or f"Product #{product_id}", quantity, price) for name, quantity, price, product_id in items]
+    )
+    etag = f'"{invoice_content_hash(invoice_data)}"'
+    if is_not_modified(request, etag):
+        return not_modified_response(etag)
+    pdf = invoice_pdf_bytes(invoice_data)
+
+    # Return the bytes for download; no file is needed
+    return Response(
+        content=pdf,
+        media_type="application/pdf",
+        headers={**cache_headers(etag), "Content-Disposition": f'attachment; filename="invoice_{invoice.id}.pdf"'},
     )
 
 
 # ===============================
 # GENERATE RECEIPT PDF (for customers without email)
 # ===============================
-@router.get("/{order_id}/receipt", response_class=FileResponse)
-def get_order_receipt(order_id: int, session: Session = Depends(get_session)):
+@router.get("/{order_id}/receipt", response_class=Response, responses=PDF_RESPONSES)
+def get_order_receipt(order_id: int, request: Request, session: Session = Depends(get_session)):
     """Generate a receipt PDF for the given order (same as invoice but named receipt)."""
     # Reuse invoice generation
-    return get_order_invoice(order_id, session)
+    return get_order_invoice(order_id, request, session)
@@ -1,12 +1,20 @@
 # app/routers/product_router.py
 import os
+from typing import Optional
 from fastapi import (
-    APIRouter, Depends, HTTPException, status, UploadFile, File, Form
+    APIRouter, Depends, HTTPException, status, UploadFile, File, Form, Query, Request, Response
 )
 from sqlmodel import select, Session
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload, load_only, selectinload
 from app.db.session import get_session
-from app.models.models import Product, Category
-from app.schemas.schemas import ProductRead, ProductUpdate
+from app.models.models import Product, Category, name_sort_key
+from app.schemas.schemas import CatalogChanges, CategoryRead, ProductPage, ProductRead, ProductUpdate, Suggestion
+from app.services import catalog_changes, product_search, suggest_index
+from app.services.catalog_cache import catalog_cache, catalog_last_modified
+from app.services.response_cache import response_cache
+from app.utils.pagination import encode_cursor, decode_cursor
+from app.utils.http_cache import make_etag, cache_headers, is_not_modified, not_modified_response
 
 router = APIRouter(prefix="/products", tags=["Products"])
 
@@ -14,6 +22,46 @@ router = APIRouter(prefix="/products", tags=["Products"])
 UPLOAD_DIR = "app/static/images"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Keyset sort orders for the product listing: sort key columns and direction.
+# Every key ends with `id` so the ordering is total and cursors are stable.
+# `relevance` (search results only) is built per request from the search rank.
+PRODUCT_SORTS = {
+    "newest": ((Product.id,), True),
+    "price_asc": ((Product.price, Product.id), False),
+    "price_desc": ((Product.price, Product.id), True),
+    "name": ((name_sort_key(Product.name), Product.id), False),
+}
+
+# Fields that can be requested through the `fields=` sparse fieldset
+PRODUCT_FIELDS = set(ProductRead.model_fields)
+
+
+def _after_product_write(product: Product):
+    """Push a committed create/update into the in-process search, typeahead and catalog caches."""
+    product_search.index_product(product)
+    suggest_index.index_item("product", product.id, product.name)
+    catalog_cache.upsert_product(product)
+
+
+def _after_product_delete(product_id: int):
+    product_search.remove_product(product_id)
+    suggest_index.remove_item("product", product_id)
+    catalog_cache.remove_product(product_id)
+
+
+def _product_validators(product_id: int, updated_at, category_updated_at):
+    """ETag and Last-Modified for a product, whose representation embeds its category."""
+    etag = make_etag("product", product_id, updated_at, category_updated_at)
+    last_modified = max((stamp for stamp in (updated_at, category_updated_at) if stamp), default=None)
+    return etag, last_modified
+
+
+def _load_product(session: Session, product_id: int) -> Optional[Product]:
+    """Fetch a product and its category in a single joined query."""
+    return session.exec(
+        select(Product).where(Product.id == product_id).options(joinedload(Product.category))
+    ).first()
+
 
 # =====================================
 # CREATE PRODUCT (with optional image)
@@ -62,65 +110,207 @@ def create_product(
 
     session.add(new_product)
     session.commit()
-    session.refresh(new_product)
-    
-    # Load category relationship
-    if new_product.category_id:
-        new_product.category = session.get(Category, new_product.category_id)
-    
+
+    # Reload with the category relationship in the same round trip
+    new_product = _load_product(session, new_product.id)
+    _after_product_write(new_product)
+
     return new_product
 
 # =====================================
-# READ ALL PRODUCTS (with filtering and search)
+# READ ALL PRODUCTS (with filtering, search, sorting and pagination)
 # =====================================
-@router.get("/", response_model=list[ProductRead])
+@router.get("/", response_model=ProductPage)
 def get_products(
+    request: Request,
     category_id: int = None,
     search: str = None,
+    search_mode: str = Query("fulltext", pattern="^(fulltext|substring)$"),
+    sort: Optional[str] = Query(None, pattern="^(relevance|newest|price_asc|price_desc|name)$"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
     session: Session = Depends(get_session)
 ):
-    """Retrieve all products with optional category filtering and search"""
-    query = select(Product)
-    
+    """Retrieve products one page at a time with optional filtering and search.
+
+    Pages are keyset-paginated on the chosen sort order; pass the returned
+    `next_cursor` back as `cursor` for the next page. `fields` is a
+    comma-separated sparse fieldset (e.g. `id,name,price,image_url`) that
+    limits both the columns loaded and the keys returned per product.
+
+    `search` uses the full-text backend by default (see
+    `app/services/product_search.py`) and sorts by relevance unless another
+    `sort` is given; `search_mode=substring` keeps the old ILIKE match.
+    """
+    selected = None
+    if fields:
+        requested = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = set(requested) - PRODUCT_FIELDS
+        if unknown:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unknown fields: {', '.join(sorted(unknown))}"
+            )
+        # Keep the caller's field order; `id` is always returned
+        selected = list(dict.fromkeys(["id", *requested]))
+
+    use_fulltext = bool(search) and search_mode == "fulltext"
+    if sort is None:
+        sort = "relevance" if use_fulltext else "newest"
+    elif sort == "relevance" and not use_fulltext:
+        sort = "newest"
+
+    if use_fulltext:
+        match_clause, rank = product_search.search_clauses(session, search)
+
+    # Everything except relevance-ranked search is served from the catalog
+    # snapshot, as JSON bytes pre-encoded per query shape and catalog version
+    if not use_fulltext:
+        version = catalog_cache.current_version(session)
+        cache_key = ("products", category_id, search, sort, limit, cursor, tuple(selected or ()))
+        if version is not None:
+            cached_response = response_cache.lookup(cache_key, version, request)
+            if cached_response is not None:
+                return cached_response
+
+        cursor_values = decode_cursor(cursor, len(PRODUCT_SORTS[sort][0])) if cursor else None
+        try:
+            cached = catalog_cache.list_products(session, sort, limit, cursor_values, category_id, search)
+        except TypeError:
+            # Cursor values of the wrong type for this sort order
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+        if cached is not None:
+            items, last_key = cached
+            if selected is not None:
+                items = [{name: item[name] for name in selected} for item in items]
+            page = {"items": items, "next_cursor": encode_cursor(*last_key) if last_key else None}
+            return response_cache.store(cache_key, version, page, request, catalog_cache.last_modified())
+
+    if sort == "relevance":
+        sort_columns, descending = (rank, Product.id), True
+    else:
+        sort_columns, descending = PRODUCT_SORTS[sort]
+    # Select the sort keys alongside each product so the cursor can be built
+    # from the last row without touching unloaded attributes
+    query = select(Product, *sort_columns)
+    if use_fulltext:
+        query = query.where(match_clause)
+
+    if selected is not None:
+        # Only load the requested columns
+        columns = {name for name in selected if name != "category"}
+        if "category" in selected:
+            columns.add("category_id")
+        query = query.options(load_only(*(getattr(Product, name) for name in columns)))
+
+    # Categories for the whole page come from one extra IN query
+    if selected is None or "category" in selected:
+        query = query.options(selectinload(Product.category))
+
     # Filter by category if provided
     if category_id:
         query = query.where(Product.category_id == category_id)
     
-    # Search by name or description if provided
-    if search:
+    # Substring search by name or description
+    if search and not use_fulltext:
         search_term = f"%{search.lower()}%"
         query = query.where(
             (Product.name.ilike(search_term)) | 
             (Product.description.ilike(search_term))
         )
-    
-    products = session.exec(query).all()
-    
-    # Load category relationships
-    for product in products:
-        if product.category_id:
-            product.category = session.get(Category, product.category_id)
-    
-    return products
+
+    if cursor:
+        values = decode_cursor(cursor, len(sort_columns))
+        key = tuple_(*sort_columns)
+        query = query.where(key < tuple_(*values) if descending else key > tuple_(*values))
+
+    order_by = [col.desc() if descending else col.asc() for col in sort_columns]
+    # Fetch one extra row to know whether another page follows
+    rows = session.exec(query.order_by(*order_by).limit(limit + 1)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*rows[-1][1:])
+    products = [row[0] for row in rows]
+
+    if selected is None:
+        items = [ProductRead.model_validate(product) for product in products]
+    else:
+        items = []
+        for product in products:
+            item = {name: getattr(product, name) for name in selected if name != "category"}
+            if "category" in selected:
+                item["category"] = CategoryRead.model_validate(product.category) if product.category else None
+            items.append(item)
+    # Same validators as the cached path, computed from the rendered body
+    return response_cache.render(
+        {"items": items, "next_cursor": next_cursor}, request, catalog_last_modified(session)
+    )
+
+
+# =====================================
+# TYPEAHEAD SUGGESTIONS
+# =====================================
+@router.get("/suggest", response_model=list[Suggestion])
+def suggest_products(
+    q: str = Query(..., min_length=1, max_length=100),
+    limit: int = Query(10, ge=1, le=25),
+    session: Session = Depends(get_session)
+):
+    """Prefix suggestions for the storefront search box, served from memory."""
+    return suggest_index.suggest(session, q, limit)
+
+
+# =====================================
+# CATALOG CHANGE FEED
+# =====================================
+@router.get("/changes", response_model=CatalogChanges)
+def get_catalog_changes(
+    since: Optional[str] = Query(
+        None, description="`next_since` from the previous poll, or an ISO timestamp; omit for a full sync"
+    ),
+    limit: int = Query(500, ge=1, le=5000, description="Maximum rows per stream"),
+    session: Session = Depends(get_session)
+):
+    """Products and categories created, updated or deleted since `since`,
+    for clients that keep a local mirror of the catalog."""
+    return catalog_changes.changes_since(session, since, limit)
 
 
 # =====================================
 # READ SINGLE PRODUCT BY ID
 # =====================================
 @router.get("/{product_id}", response_model=ProductRead)
-def get_product(product_id: int, session: Session = Depends(get_session)):
-    """Retrieve a single product by its ID"""
-    product = session.get(Product, product_id)
-    if not product:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Product with ID {product_id} not found"
-        )
-    
-    # Load category relationship
-    if product.category_id:
-        product.category = session.get(Category, product.category_id)
-    
+def get_product(
+    product_id: int,
+    request: Request,
+    response: Response,
+    session: Session = Depends(get_session)
+):
+    """Retrieve a single product by its ID.
+
+    Supports conditional GET: a matching If-None-Match / If-Modified-Since
+    gets a 304 before any response body is built.
+    """
+    product = catalog_cache.get_product(session, product_id)
+    if product is not None:
+        category = product["category"]
+        validators = _product_validators(product_id, product["updated_at"], category and category["updated_at"])
+    else:
+        product = _load_product(session, product_id)
+        if not product:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Product with ID {product_id} not found"
+            )
+        category = product.category
+        validators = _product_validators(product_id, product.updated_at, category and category.updated_at)
+
+    if is_not_modified(request, *validators):
+        return not_modified_response(*validators)
+    response.headers.update(cache_headers(*validators))
     return product
 
 
@@ -194,12 +384,11 @@ def update_product(
 
     session.add(product)
     session.commit()
-    session.refresh(product)
-    
-    # Load category relationship
-    if product.category_id:
-        product.category = session.get(Category, product.category_id)
-    
+
+    # Reload with the category relationship in the same round trip
+    product = _load_product(session, product_id)
+    _after_product_write(product)
+
     return product
 
 
@@ -223,5 +412,7 @@ def delete_product(product_id: int, session: Session = Depends(get_session)):
             os.remove(image_path)
 
     session.delete(product)
+    catalog_changes.record_deletion(session, "product", product_id)
     session.commit()
+    _after_product_delete(product_id)
     return {"detail": f"Product with ID {product_id} deleted successfully"}
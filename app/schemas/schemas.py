@@ -20,6 +20,7 @@ class CategoryCreate(CategoryBase):
 class CategoryRead(CategoryBase):
     id: int
     parent_id: Optional[int] = None
+    updated_at: Optional[datetime] = None
 
     model_config = ConfigDict(from_attributes=True)
 
@@ -48,11 +49,38 @@ class ProductCreate(ProductBase):
 
 class ProductRead(ProductBase):
     id: int
+    updated_at: Optional[datetime] = None
     category: Optional["CategoryRead"] = None
 
     model_config = ConfigDict(from_attributes=True)
 
 
+class ProductPage(SQLModel):
+    items: List[ProductRead]
+    next_cursor: Optional[str] = None  # pass back as `cursor` to fetch the next page
+
+
+class Suggestion(SQLModel):
+    type: str  # "product" or "category"
+    id: int
+    name: str
+
+
+class ProductChange(ProductBase):
+    """Flat product row in the change feed; categories are synced alongside."""
+    id: int
+    updated_at: datetime
+
+
+class CatalogChanges(SQLModel):
+    products: List[ProductChange]  # created or updated since `since`
+    categories: List[CategoryRead]
+    deleted_products: List[int]
+    deleted_categories: List[int]
+    next_since: str  # pass back as `since` on the next poll
+    has_more: bool  # poll again right away to drain the backlog
+
+
 class ProductUpdate(SQLModel):
     name: Optional[str] = None
     description: Optional[str] = None
@@ -190,9 +218,16 @@ class OrderRead(OrderBase):
     tracking_number: Optional[str] = None
     shipped_at: Optional[datetime] = None
     created_at: datetime
+    updated_at: Optional[datetime] = None
     items: List[OrderItemRead]
 
     model_config = ConfigDict(from_attributes=True)
+
+
+class OrderPage(SQLModel):
+    items: List[OrderRead]
+    next_cursor: Optional[str] = None  # pass back as `cursor` to fetch the next page
+
         
 class OrderUpdate(SQLModel):
     customer_name: Optional[str] = None
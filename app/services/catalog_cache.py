@@ -0,0 +1,395 @@
+"""In-process snapshot of the product catalog for read-heavy endpoints.
+
+Products and categories are held as small `__slots__` records keyed by id.
+`GET /products/`, `GET /products/{id}` and the category reads are answered
+from the snapshot; only relevance-ranked full-text search still goes to the
+database.
+
+Writes go through the routers, which patch the snapshot right after their
+commit (write-through), so the worker that handled a write serves it
+immediately. Other worker processes pick it up when their snapshot expires
+after `CATALOG_CACHE_TTL_SECONDS`. Stock changes from checkouts are the
+exception: they update the records in place without bumping the version,
+so pre-encoded listing bodies stay warm under checkout load and may show
+stock up to one TTL old. If the catalog grows past
+`CATALOG_CACHE_MAX_PRODUCTS` the cache switches itself off and every read
+goes to the database, which keeps memory bounded.
+
+Collection Last-Modified is the newest product/category `updated_at` or
+tombstone `deleted_at`, so deleting a row also moves it forward.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+from bisect import bisect_left, bisect_right
+from typing import Optional
+from sqlalchemy import func
+from sqlmodel import Session, select
+from app.models.models import CatalogTombstone, Category, Product
+
+CATALOG_CACHE_ENABLED = os.getenv("CATALOG_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CATALOG_CACHE_TTL_SECONDS = float(os.getenv("CATALOG_CACHE_TTL_SECONDS", "30"))
+CATALOG_CACHE_MAX_PRODUCTS = int(os.getenv("CATALOG_CACHE_MAX_PRODUCTS", "50000"))
+
+
+class ProductRecord:
+    __slots__ = ("id", "name", "description", "category_id", "price", "stock_quantity", "image_url", "updated_at")
+
+    def __init__(self, id, name, description, category_id, price, stock_quantity, image_url, updated_at):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.category_id = category_id
+        self.price = price
+        self.stock_quantity = stock_quantity
+        self.image_url = image_url
+        self.updated_at = updated_at
+
+    @classmethod
+    def from_model(cls, product: Product) -> "ProductRecord":
+        return cls(
+            product.id, product.name, product.description, product.category_id,
+            product.price, product.stock_quantity, product.image_url, product.updated_at,
+        )
+
+
+# Fields a checkout changes; neither is a sort key
+_STOCK_FIELDS = ("stock_quantity", "updated_at")
+_LISTING_FIELDS = tuple(name for name in ProductRecord.__slots__ if name not in _STOCK_FIELDS)
+
+
+class CategoryRecord:
+    __slots__ = ("id", "name", "description", "parent_id", "updated_at")
+
+    def __init__(self, id, name, description, parent_id, updated_at):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.parent_id = parent_id
+        self.updated_at = updated_at
+
+    @classmethod
+    def from_model(cls, category: Category) -> "CategoryRecord":
+        return cls(category.id, category.name, category.description, category.parent_id, category.updated_at)
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "description": self.description,
+            "parent_id": self.parent_id,
+            "updated_at": self.updated_at,
+        }
+
+
+# Sort key extractors matching `PRODUCT_SORTS` in the product router. Keys
+# are the same tuples the database path puts into pagination cursors.
+SORT_KEYS = {
+    "newest": (lambda p: (p.id,), True),
+    "price_asc": (lambda p: (p.price, p.id), False),
+    "price_desc": (lambda p: (p.price, p.id), True),
+    # Same key as `name_sort_key` in SQL, so cursors work across both paths
+    "name": (lambda p: (p.name.lower(), p.id), False),
+}
+
+
+class CatalogSnapshot:
+    def __init__(self, products: dict, categories: dict, deleted_at: Optional[datetime] = None):
+        self.products: dict[int, ProductRecord] = products
+        self.categories: dict[int, CategoryRecord] = categories
+        self.loaded_at = time.monotonic()
+        self._sorted: dict[str, tuple[list, list]] = {}
+        # Newest change seen by this snapshot, for collection Last-Modified
+        stamps = [r.updated_at for r in products.values()] + [c.updated_at for c in categories.values()] + [deleted_at]
+        self.last_modified: Optional[datetime] = max((s for s in stamps if s), default=None)
+
+    def touch(self, stamp: Optional[datetime]):
+        stamp = stamp or datetime.utcnow()
+        if self.last_modified is None or stamp > self.last_modified:
+            self.last_modified = stamp
+
+    def sorted_view(self, sort: str):
+        """(keys, records) in ascending key order for `sort`, built lazily."""
+        view = self._sorted.get(sort)
+        if view is None:
+            key_fn, _ = SORT_KEYS[sort]
+            records = sorted(self.products.values(), key=key_fn)
+            view = ([key_fn(r) for r in records], records)
+            self._sorted[sort] = view
+        return view
+
+    def drop_sorted_views(self):
+        self._sorted = {}
+
+    def product_dict(self, record: ProductRecord) -> dict:
+        category = self.categories.get(record.category_id) if record.category_id else None
+        return {
+            "id": record.id,
+            "name": record.name,
+            "description": record.description,
+            "price": record.price,
+            "stock_quantity": record.stock_quantity,
+            "image_url": record.image_url,
+            "category_id": record.category_id,
+            "updated_at": record.updated_at,
+            "category": category.as_dict() if category else None,
+        }
+
+
+def catalog_last_modified(session: Session) -> Optional[datetime]:
+    """Newest catalog change straight from the database (three index lookups),
+    for responses served without the snapshot."""
+    stamps = session.exec(
+        select(
+            select(func.max(Product.updated_at)).scalar_subquery(),
+            select(func.max(Category.updated_at)).scalar_subquery(),
+            select(func.max(CatalogTombstone.deleted_at)).scalar_subquery(),
+        )
+    ).one()
+    return max((stamp for stamp in stamps if stamp), default=None)
+
+
+PRODUCT_COLUMNS = (
+    Product.id, Product.name, Product.description, Product.category_id,
+    Product.price, Product.stock_quantity, Product.image_url, Product.updated_at,
+)
+CATEGORY_COLUMNS = (Category.id, Category.name, Category.description, Category.parent_id, Category.updated_at)
+
+
+class CatalogCache:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._retry_load_at = 0.0
+        self.version = 0
+        self.too_large = False
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.patches = 0
+        self.stock_updates = 0
+        self.invalidations = 0
+
+    # ---------- loading ----------
+    def _load(self, session: Session) -> Optional[CatalogSnapshot]:
+        total = session.exec(select(func.count()).select_from(Product)).one()
+        if total > CATALOG_CACHE_MAX_PRODUCTS:
+            # Don't re-count on every request; check again after one TTL
+            self.too_large = True
+            self._retry_load_at = time.monotonic() + CATALOG_CACHE_TTL_SECONDS
+            return None
+        products = {row[0]: ProductRecord(*row) for row in session.exec(select(*PRODUCT_COLUMNS)).all()}
+        categories = {row[0]: CategoryRecord(*row) for row in session.exec(select(*CATEGORY_COLUMNS)).all()}
+        deleted_at = session.exec(select(func.max(CatalogTombstone.deleted_at))).one()
+        self.too_large = False
+        self.loads += 1
+        self.version += 1
+        return CatalogSnapshot(products, categories, deleted_at)
+
+    def _current(self, session: Session) -> Optional[CatalogSnapshot]:
+        """Current snapshot, (re)loading it if missing or expired.
+
+        Returns None when the cache is disabled or the catalog is too large
+        to hold, so the caller falls back to SQL.
+        """
+        if not CATALOG_CACHE_ENABLED:
+            return None
+        snap = self._snapshot
+        if snap is not None and time.monotonic() - snap.loaded_at <= CATALOG_CACHE_TTL_SECONDS:
+            return snap
+        with self._lock:
+            snap = self._snapshot
+            if snap is not None and time.monotonic() - snap.loaded_at <= CATALOG_CACHE_TTL_SECONDS:
+                return snap
+            if self.too_large and time.monotonic() < self._retry_load_at:
+                return None
+            self._snapshot = self._load(session)
+            return self._snapshot
+
+    def current_version(self, session: Session) -> Optional[int]:
+        """Version of the live snapshot (reloading it if expired), or None if
+        the cache is unavailable. Any patch or reload bumps it."""
+        return self.version if self._current(session) is not None else None
+
+    def last_modified(self) -> Optional[datetime]:
+        snap = self._snapshot
+        return snap.last_modified if snap else None
+
+    def _record(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    # ---------- reads ----------
+    def list_products(
+        self,
+        session: Session,
+        sort: str,
+        limit: int,
+        cursor_values: Optional[list] = None,
+        category_id: Optional[int] = None,
+        search: Optional[str] = None,
+    ):
+        """Page of product dicts plus the sort key of its last row, or None.
+
+        The key is only returned when more matching rows follow. Returns None
+        if the snapshot is unavailable. Filtering and keyset pagination mirror
+        the SQL path in `get_products`.
+        """
+        snap = self._current(session)
+        self._record(snap is not None)
+        if snap is None:
+            return None
+        keys, records = snap.sorted_view(sort)
+        _, descending = SORT_KEYS[sort]
+        term = search.lower() if search else None
+
+        if descending:
+            start = bisect_left(keys, tuple(cursor_values)) - 1 if cursor_values else len(keys) - 1
+            indexes = range(start, -1, -1)
+        else:
+            start = bisect_right(keys, tuple(cursor_values)) if cursor_values else 0
+            indexes = range(start, len(keys))
+
+        page = []
+        page_last_key = None
+        for i in indexes:
+            record = records[i]
+            if category_id and record.category_id != category_id:
+                continue
+            if term and term not in (record.name or "").lower() and term not in (record.description or "").lower():
+                continue
+            if len(page) == limit:
+                # Another matching row exists, so the caller gets a cursor
+                return page, page_last_key
+            page.append(snap.product_dict(record))
+            page_last_key = keys[i]
+        return page, None
+
+    def get_product(self, session: Session, product_id: int) -> Optional[dict]:
+        snap = self._current(session)
+        # A missing id could have been created by another worker since the
+        # snapshot was taken, so it counts as a miss and falls back to SQL
+        record = snap.products.get(product_id) if snap else None
+        self._record(record is not None)
+        return snap.product_dict(record) if record else None
+
+    def list_categories(self, session: Session) -> Optional[list[dict]]:
+        snap = self._current(session)
+        self._record(snap is not None)
+        if snap is None:
+            return None
+        return [c.as_dict() for c in sorted(snap.categories.values(), key=lambda c: c.id)]
+
+    def get_category(self, session: Session, category_id: int) -> Optional[dict]:
+        snap = self._current(session)
+        record = snap.categories.get(category_id) if snap else None
+        self._record(record is not None)
+        return record.as_dict() if record else None
+
+    # ---------- write-through ----------
+    def _patch(self, fn):
+        with self._lock:
+            snap = self._snapshot
+            if snap is None:
+                return
+            fn(snap)
+            snap.drop_sorted_views()
+            self.version += 1
+            self.patches += 1
+
+    def upsert_product(self, product: Product):
+        record = ProductRecord.from_model(product)
+
+        def apply(snap):
+            snap.products[record.id] = record
+            snap.touch(record.updated_at)
+
+        self._patch(apply)
+
+    def remove_product(self, product_id: int):
+        def apply(snap):
+            snap.products.pop(product_id, None)
+            snap.touch(None)
+
+        self._patch(apply)
+
+    def upsert_category(self, category: Category):
+        record = CategoryRecord.from_model(category)
+
+        def apply(snap):
+            snap.categories[record.id] = record
+            snap.touch(record.updated_at)
+
+        self._patch(apply)
+
+    def remove_category(self, category_id: int):
+        def apply(snap):
+            snap.categories.pop(category_id, None)
+            snap.touch(None)
+
+        self._patch(apply)
+
+    def refresh_products(self, session: Session, product_ids):
+        """Re-read a few products after a checkout changed their stock, in one IN query.
+
+        Stock and `updated_at` are copied into the existing records, so the
+        sorted views stay valid and the version (and every pre-encoded
+        listing) is kept. A product whose other fields changed too is patched
+        normally.
+        """
+        if self._snapshot is None or not product_ids:
+            return
+        rows = session.exec(select(*PRODUCT_COLUMNS).where(Product.id.in_(list(product_ids)))).all()
+        changed = []
+        with self._lock:
+            snap = self._snapshot
+            if snap is None:
+                return
+            for row in rows:
+                fresh = ProductRecord(*row)
+                record = snap.products.get(fresh.id)
+                if record is None or any(getattr(record, f) != getattr(fresh, f) for f in _LISTING_FIELDS):
+                    changed.append(fresh)
+                    continue
+                for name in _STOCK_FIELDS:
+                    setattr(record, name, getattr(fresh, name))
+                snap.touch(fresh.updated_at)
+                self.stock_updates += 1
+        if not changed:
+            return
+
+        def apply(snap):
+            for record in changed:
+                snap.products[record.id] = record
+                snap.touch(record.updated_at)
+
+        self._patch(apply)
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+            self.version += 1
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        snap = self._snapshot
+        return {
+            "enabled": CATALOG_CACHE_ENABLED,
+            "too_large": self.too_large,
+            "version": self.version,
+            "products": len(snap.products) if snap else 0,
+            "categories": len(snap.categories) if snap else 0,
+            "age_seconds": round(time.monotonic() - snap.loaded_at, 1) if snap else None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "loads": self.loads,
+            "patches": self.patches,
+            "stock_updates": self.stock_updates,
+            "invalidations": self.invalidations,
+        }
+
+
+catalog_cache = CatalogCache()
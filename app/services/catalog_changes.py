@@ -0,0 +1,113 @@
+"""Incremental catalog change feed behind `GET /products/changes`.
+
+Clients keep a local mirror of products and categories and poll with the
+`next_since` token from their previous response. The token holds one
+`(timestamp, id)` keyset position per stream (products and categories by
+`updated_at`, deletions by `catalog_tombstone.deleted_at`), so each poll is
+three short index range scans and ties on a timestamp never skip rows.
+
+Rows stamped within the last `CHANGES_SETTLE_SECONDS` are held back until the
+next poll: `updated_at` is set when a transaction flushes, so a slower
+transaction can still commit a row older than one a client has already seen.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import HTTPException
+from sqlalchemy import tuple_
+from sqlmodel import Session, select
+from app.models.models import CatalogTombstone, Category, Product
+from app.utils.pagination import encode_cursor, decode_cursor
+
+CHANGES_SETTLE_SECONDS = float(os.getenv("CHANGES_SETTLE_SECONDS", "2"))
+
+PRODUCT_CHANGE_COLUMNS = (
+    Product.id, Product.name, Product.description, Product.price, Product.stock_quantity,
+    Product.image_url, Product.category_id, Product.updated_at,
+)
+CATEGORY_CHANGE_COLUMNS = (Category.id, Category.name, Category.description, Category.parent_id, Category.updated_at)
+
+
+def record_deletion(session: Session, entity: str, entity_id: int):
+    """Add a tombstone for a deleted product/category; commit it with the delete."""
+    session.add(CatalogTombstone(entity=entity, entity_id=entity_id))
+
+
+def _parse_since(session: Session, since: Optional[str]) -> list:
+    """Keyset positions `[(stamp, id) | None] * 3` for products, categories, tombstones.
+
+    `since` is either a token from a previous response or an ISO timestamp.
+    Without it the client is doing a full sync, so every live row is sent and
+    only deletions from now on matter.
+    """
+    if not since:
+        latest = session.exec(
+            select(CatalogTombstone.deleted_at, CatalogTombstone.id)
+            .order_by(CatalogTombstone.deleted_at.desc(), CatalogTombstone.id.desc())
+            .limit(1)
+        ).first()
+        return [None, None, tuple(latest) if latest else None]
+    try:
+        stamp = datetime.fromisoformat(since)
+    except ValueError:
+        pass
+    else:
+        if stamp.tzinfo is not None:
+            # Stored timestamps are naive UTC
+            stamp = (stamp - stamp.utcoffset()).replace(tzinfo=None)
+        return [(stamp, 0)] * 3
+
+    values = decode_cursor(since, 6)
+    positions = []
+    try:
+        for stamp, row_id in zip(values[::2], values[1::2]):
+            positions.append((datetime.fromisoformat(stamp), int(row_id)) if stamp is not None else None)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return positions
+
+
+def _scan(session: Session, columns, stamp_col, id_col, position, settled_before: datetime, limit: int):
+    """Rows past `position` in (stamp, id) order, at most `limit`, plus an overflow flag."""
+    query = select(*columns).where(stamp_col <= settled_before)
+    if position is not None:
+        query = query.where(tuple_(stamp_col, id_col) > tuple_(*position))
+    rows = session.exec(query.order_by(stamp_col, id_col).limit(limit + 1)).all()
+    return rows[:limit], len(rows) > limit
+
+
+def changes_since(session: Session, since: Optional[str], limit: int) -> dict:
+    """Products, categories and deletions changed after `since`, up to `limit` of each."""
+    product_pos, category_pos, tombstone_pos = _parse_since(session, since)
+    settled_before = datetime.utcnow() - timedelta(seconds=CHANGES_SETTLE_SECONDS)
+
+    products, more_products = _scan(
+        session, PRODUCT_CHANGE_COLUMNS, Product.updated_at, Product.id, product_pos, settled_before, limit
+    )
+    categories, more_categories = _scan(
+        session, CATEGORY_CHANGE_COLUMNS, Category.updated_at, Category.id, category_pos, settled_before, limit
+    )
+    tombstones, more_tombstones = _scan(
+        session,
+        (CatalogTombstone.id, CatalogTombstone.entity, CatalogTombstone.entity_id, CatalogTombstone.deleted_at),
+        CatalogTombstone.deleted_at, CatalogTombstone.id, tombstone_pos, settled_before, limit,
+    )
+
+    if products:
+        product_pos = (products[-1].updated_at, products[-1].id)
+    if categories:
+        category_pos = (categories[-1].updated_at, categories[-1].id)
+    if tombstones:
+        tombstone_pos = (tombstones[-1].deleted_at, tombstones[-1].id)
+
+    next_since = encode_cursor(*[
+        value for position in (product_pos, category_pos, tombstone_pos) for value in (position or (None, None))
+    ])
+    return {
+        "products": [dict(row._mapping) for row in products],
+        "categories": [dict(row._mapping) for row in categories],
+        "deleted_products": [t.entity_id for t in tombstones if t.entity == "product"],
+        "deleted_categories": [t.entity_id for t in tombstones if t.entity == "category"],
+        "next_since": next_since,
+        "has_more": more_products or more_categories or more_tombstones,
+    }
@@ -1,200 +1,274 @@
 # app/services/email_service.py
-import smtplib
 import os
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
-from typing import Optional
+from typing import Optional, Sequence, Union
 from app.config import get_settings
+from app.services.smtp_transport import get_transport
+from app.utils.templates import Safe, Template, get_template
+
+# An attachment is either a ready MIME part (see `attachment_part`) or
+# (filename, bytes), encoded per message
+Attachment = Union[MIMEBase, tuple]
+
+def _smtp_settings() -> dict:
+    settings = get_settings()
+    # Email configuration - should be in environment variables
+    return {
+        "host": os.getenv("SMTP_SERVER", "smtp.gmail.com"),
+        "port": int(os.getenv("SMTP_PORT", "587")),
+        "username": os.getenv("SMTP_USERNAME", settings.get("notifications", {}).get("adminEmail", "orumagideon535@gmail.com")),
+        "password": os.getenv("SMTP_PASSWORD", ""),  # Should be app-specific password
+        "starttls": os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes"),
+    }
+
+
+def attachment_part(filename: str, data: bytes) -> MIMEBase:
+    """
+    Base64-encode `data` once into a MIME part that can be attached to any
+    number of messages (e.g. one invoice PDF rendered in memory).
+    """
+    part = MIMEBase("application", "octet-stream")
+    part.set_payload(data)
+    encoders.encode_base64(part)
+    part.add_header("Content-Disposition", f"attachment; filename= {filename}")
+    return part
+
+
+def _build_message(
+    sender: str,
+    to_email: str,
+    subject: str,
+    body: str,
+    attachment_path: Optional[str] = None,
+    attachments: Sequence[Attachment] = ()
+) -> MIMEMultipart:
+    msg = MIMEMultipart()
+    msg["From"] = sender
+    msg["To"] = to_email
+    msg["Subject"] = subject
+    msg.attach(MIMEText(body, "html"))
+    
+    # Add attachment if provided
+    if attachment_path and os.path.exists(attachment_path):
+        with open(attachment_path, "rb") as attachment:
+            msg.attach(attachment_part(os.path.basename(attachment_path), attachment.read()))
+    for attachment in attachments:
+        msg.attach(attachment if isinstance(attachment, MIMEBase) else attachment_part(*attachment))
+    return msg
+
+
+def send_many(messages: list[dict]) -> list[Optional[Exception]]:
+    """
+    Send several composed messages (see `_message`) over one pooled SMTP
+    session. Returns None per accepted message, or the exception it failed
+    with. Nothing is sent (all None) if SMTP is not configured.
+    """
+    config = _smtp_settings()
+    
+    # If no password configured, skip email sending
+    if not config["password"]:
+        for message in messages:
+            print(f"SMTP_PASSWORD not configured. Email to {message['to_email']} would be sent with subject: {message['subject']}")
+        return [None] * len(messages)
+    
+    transport = get_transport(**config)
+    return transport.send_many([_build_message(config["username"], **message) for message in messages])
+
+
+def deliver(
+    to_email: str,
+    subject: str,
+    body: str,
+    attachment_path: Optional[str] = None,
+    attachments: Sequence[Attachment] = ()
+) -> bool:
+    """
+    Send an email with optional PDF attachment, raising on SMTP errors so the
+    outbox worker can retry. Returns False if SMTP is not configured.
+    """
+    if not _smtp_settings()["password"]:
+        print(f"SMTP_PASSWORD not configured. Email to {to_email} would be sent with subject: {subject}")
+        return False
+    error = send_many([_message(to_email, subject, body, attachment_path, attachments)])[0]
+    if error is not None:
+        raise error
+    return True
+
 
 def send_email(
     to_email: str,
     subject: str,
     body: str,
-    attachment_path: Optional[str] = None
+    attachment_path: Optional[str] = None,
+    attachments: Sequence[Attachment] = ()
 ) -> bool:
     """
     Send an email with optional PDF attachment.
     Returns True if successful, False otherwise.
     """
     try:
-        settings = get_settings()
-        
-        # Email configuration - should be in environment variables
-        smtp_server = os.getenv("SMTP_SERVER", "smtp.gmail.com")
-        smtp_port = int(os.getenv("SMTP_PORT", "587"))
-        smtp_username = os.getenv("SMTP_USERNAME", settings.get("notifications", {}).get("adminEmail", "orumagideon535@gmail.com"))
-        smtp_password = os.getenv("SMTP_PASSWORD", "")  # Should be app-specific password
-        
-        # If no password configured, skip email sending
-        if not smtp_password:
-            print(f"SMTP_PASSWORD not configured. Email to {to_email} would be sent with subject: {subject}")
-            return False
-        
-        # Create message
-        msg = MIMEMultipart()
-        msg["From"] = smtp_username
-        msg["To"] = to_email
-        msg["Subject"] = subject
-        msg.attach(MIMEText(body, "html"))
-        
-        # Add attachment if provided
-        if attachment_path and os.path.exists(attachment_path):
-            with open(attachment_path, "rb") as attachment:
-                part = MIMEBase("application", "octet-stream")
-                part.set_payload(attachment.read())
-                encoders.encode_base64(part)
-                part.add_header(
-                    "Content-Disposition",
-                    f"attachment; filename= {os.path.basename(attachment_path)}"
-                )
-                msg.attach(part)
-        
-        # Send email
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-        server.login(smtp_username, smtp_password)
-        text = msg.as_string()
-        server.sendmail(smtp_username, to_email, text)
-        server.quit()
-        
-        return True
+        return deliver(to_email, subject, body, attachment_path, attachments)
     except Exception as e:
         print(f"Error sending email to {to_email}: {str(e)}")
         return False
 
 
-def send_order_notification(order_data: dict) -> bool:
-    """Send order notification to admin."""
+def _message(
+    to_email: str,
+    subject: str,
+    body: str,
+    attachment_path: Optional[str] = None,
+    attachments: Sequence[Attachment] = ()
+) -> dict:
+    """One composed email, as queued in the outbox (see `app/services/outbox.py`).
+    Only path attachments survive queueing; in-memory ones are for direct sends."""
+    message = {"to_email": to_email, "subject": subject, "body": body, "attachment_path": attachment_path}
+    if attachments:
+        message["attachments"] = list(attachments)
+    return message
+
+
+# ============================================
+# MESSAGE COMPOSITION
+# ============================================
+# Each builder returns the list of emails an event produces (possibly empty
+# when notifications are switched off). The request path queues them in the
+# outbox; the `send_*` helpers below send them directly. Bodies come from
+# `app/templates/email/`, compiled once per process.
+
+SUBJECTS = {
+    name: Template(source, escape=False)
+    for name, source in {
+        "order_notification": "New Order Received - Order #{id}",
+        "payment_admin": "Payment Verified - Order #{id}",
+        "payment_customer": "Payment Confirmed - Order #{id}",
+        "invoice": "Invoice - Order #{id}",
+        "shipment_customer": "Your Order #{id} has been shipped",
+        "shipment_admin": "Order #{id} Shipped",
+        "digest": "Morine Gypsum digest - {count} notification{plural}",
+    }.items()
+}
+
+DIGEST_EVENT_LABELS = {"order": "New order", "payment": "Payment verified", "shipment": "Shipped"}
+
+
+def _admin_email(settings: dict) -> str:
+    return settings.get("notifications", {}).get("adminEmail", "orumagideon535@gmail.com")
+
+
+def _order_context(order_data: dict) -> dict:
+    """Template context for an order event; missing values show as N/A."""
+    context = {key: ("N/A" if value is None else value) for key, value in order_data.items()}
+    for key in ("customer_name", "customer_phone", "customer_email", "delivery_address",
+                "payment_method", "mpesa_code", "tracking_number", "shipping_provider"):
+        context.setdefault(key, "N/A")
+    context.setdefault("status", "pending")
+    context["amount"] = order_data.get("total_amount") or order_data.get("total_price") or 0
+    return context
+
+
+def _render(name: str, context: dict, to_email: str, attachment_path: Optional[str] = None) -> dict:
+    return _message(
+        to_email,
+        SUBJECTS[name].render(context),
+        get_template(f"email/{name}.html").render(context),
+        attachment_path,
+    )
+
+
+def order_notification_emails(order_data: dict) -> list[dict]:
+    """Order notification to admin."""
     settings = get_settings()
-    admin_email = settings.get("notifications", {}).get("adminEmail", "orumagideon535@gmail.com")
-    
     if not settings.get("notifications", {}).get("sendOrderNotifications", True):
+        return []
+    return [_render("order_notification", _order_context(order_data), _admin_email(settings))]
+
+
+def payment_confirmation_emails(order_data: dict) -> list[dict]:
+    """Payment confirmation to admin and customer."""
+    settings = get_settings()
+    context = _order_context(order_data)
+    messages = []
+    if settings.get("notifications", {}).get("sendPaymentNotifications", True):
+        messages.append(_render("payment_admin", context, _admin_email(settings)))
+    if order_data.get("customer_email"):
+        messages.append(_render("payment_customer", context, order_data["customer_email"]))
+    return messages
+
+
+def invoice_emails(order_data: dict, invoice_path: Optional[str] = None) -> list[dict]:
+    """Invoice to customer email. Without `invoice_path` the caller attaches the PDF."""
+    if not order_data.get("customer_email"):
+        return []
+    return [_render("invoice", _order_context(order_data), order_data["customer_email"], invoice_path)]
+
+
+def shipment_notification_emails(order_data: dict) -> list[dict]:
+    """Shipment notification to customer and admin."""
+    settings = get_settings()
+    context = _order_context(order_data)
+    messages = []
+    if order_data.get("customer_email"):
+        messages.append(_render("shipment_customer", context, order_data["customer_email"]))
+    if settings.get("notifications", {}).get("sendOrderNotifications", True):
+        messages.append(_render("shipment_admin", context, _admin_email(settings)))
+    return messages
+
+
+def admin_digest_emails(entries: list[dict]) -> list[dict]:
+    """One summary email to admin covering several held-back notifications.
+    Each entry is {event, created_at, order} (see `app/services/notification_digest.py`)."""
+    if not entries:
+        return []
+    row_template = get_template("email/digest_row.html")
+    rows = []
+    for entry in entries:
+        context = _order_context(entry["order"])
+        order = entry["order"]
+        context["time"] = entry["created_at"][:16].replace("T", " ")
+        context["event"] = DIGEST_EVENT_LABELS.get(entry["event"], entry["event"])
+        context["details"] = order.get("mpesa_code") or order.get("tracking_number") or ""
+        rows.append(row_template.render(context))
+    context = {"rows": Safe("".join(rows)), "count": len(entries), "plural": "s" if len(entries) != 1 else ""}
+    return [_render("digest", context, _admin_email(get_settings()))]
+
+
+# ============================================
+# DIRECT SENDING
+# ============================================
+def _send_all(messages: list[dict]) -> bool:
+    if not messages:
         return False
-    
-    subject = f"New Order Received - Order #{order_data['id']}"
-    body = f"""
-    <html>
-    <body>
-        <h2>New Order Received</h2>
-        <p><strong>Order ID:</strong> #{order_data['id']}</p>
-        <p><strong>Customer:</strong> {order_data['customer_name']}</p>
-        <p><strong>Phone:</strong> {order_data['customer_phone']}</p>
-        <p><strong>Email:</strong> {order_data.get('customer_email', 'N/A')}</p>
-        <p><strong>Delivery Address:</strong> {order_data['delivery_address']}</p>
-        <p><strong>Total Amount:</strong> KES {order_data.get('total_amount', order_data.get('total_price', 0)):,.2f}</p>
-        <p><strong>Payment Method:</strong> {order_data.get('payment_method', 'N/A')}</p>
-        <p><strong>Status:</strong> {order_data.get('status', 'pending')}</p>
-    </body>
-    </html>
-    """
-    
-    return send_email(admin_email, subject, body)
+    if not _smtp_settings()["password"]:
+        send_many(messages)  # logs what would have been sent
+        return False
+    errors = send_many(messages)
+    for message, error in zip(messages, errors):
+        if error is not None:
+            print(f"Error sending email to {message['to_email']}: {str(error)}")
+    return not any(errors)
+
+
+def send_order_notification(order_data: dict) -> bool:
+    """Send order notification to admin."""
+    return _send_all(order_notification_emails(order_data))
 
 
 def send_payment_confirmation(order_data: dict) -> bool:
     """Send payment confirmation to admin and customer."""
-    settings = get_settings()
-    admin_email = settings.get("notifications", {}).get("adminEmail", "orumagideon535@gmail.com")
-    
-    # Send to admin
-    if settings.get("notifications", {}).get("sendPaymentNotifications", True):
-        subject = f"Payment Verified - Order #{order_data['id']}"
-        body = f"""
-        <html>
-        <body>
-            <h2>Payment Verified</h2>
-            <p><strong>Order ID:</strong> #{order_data['id']}</p>
-            <p><strong>Customer:</strong> {order_data['customer_name']}</p>
-            <p><strong>Amount:</strong> KES {order_data.get('total_amount', order_data.get('total_price', 0)):,.2f}</p>
-            <p><strong>Payment Method:</strong> {order_data.get('payment_method', 'N/A')}</p>
-            <p><strong>MPESA Code:</strong> {order_data.get('mpesa_code', 'N/A')}</p>
-        </body>
-        </html>
-        """
-        send_email(admin_email, subject, body)
-    
-    # Send to customer if email provided
-    customer_email = order_data.get('customer_email')
-    if customer_email:
-        subject = f"Payment Confirmed - Order #{order_data['id']}"
-        body = f"""
-        <html>
-        <body>
-            <h2>Payment Confirmed</h2>
-            <p>Dear {order_data['customer_name']},</p>
-            <p>Your payment for Order #{order_data['id']} has been verified.</p>
-            <p><strong>Amount:</strong> KES {order_data.get('total_amount', order_data.get('total_price', 0)):,.2f}</p>
-            <p>Thank you for your purchase!</p>
-        </body>
-        </html>
-        """
-        send_email(customer_email, subject, body)
-    
+    _send_all(payment_confirmation_emails(order_data))
     return True
 
 
 def send_invoice_email(order_data: dict, invoice_path: str) -> bool:
     """Send invoice to customer email."""
-    customer_email = order_data.get('customer_email')
-    if not customer_email:
-        return False
-    
-    subject = f"Invoice - Order #{order_data['id']}"
-    body = f"""
-    <html>
-    <body>
-        <h2>Your Invoice</h2>
-        <p>Dear {order_data['customer_name']},</p>
-        <p>Thank you for your order! Please find your invoice attached.</p>
-        <p><strong>Order ID:</strong> #{order_data['id']}</p>
-        <p><strong>Total Amount:</strong> KES {order_data.get('total_amount', order_data.get('total_price', 0)):,.2f}</p>
-        <p>Best regards,<br>Morine Gypsum</p>
-    </body>
-    </html>
-    """
-    
-    return send_email(customer_email, subject, body, invoice_path)
+    return _send_all(invoice_emails(order_data, invoice_path))
 
 
 def send_shipment_notification(order_data: dict) -> bool:
     """Send shipment notification to customer and admin."""
-    settings = get_settings()
-    admin_email = settings.get("notifications", {}).get("adminEmail", "orumagideon535@gmail.com")
-
-    # Notify customer
-    customer_email = order_data.get("customer_email")
-    if customer_email:
-        subject = f"Your Order #{order_data['id']} has been shipped"
-        body = f"""
-        <html>
-        <body>
-            <h2>Your Order has been Shipped</h2>
-            <p>Dear {order_data.get('customer_name')},</p>
-            <p>Your order <strong>#{order_data['id']}</strong> has been shipped.</p>
-            <p><strong>Tracking Number:</strong> {order_data.get('tracking_number', 'N/A')}</p>
-            <p><strong>Shipping Provider:</strong> {order_data.get('shipping_provider', 'N/A')}</p>
-            <p>Thank you for shopping with us.</p>
-        </body>
-        </html>
-        """
-        send_email(customer_email, subject, body)
-
-    # Notify admin
-    if settings.get("notifications", {}).get("sendOrderNotifications", True):
-        subject = f"Order #{order_data['id']} Shipped"
-        body = f"""
-        <html>
-        <body>
-            <h2>Order Shipped</h2>
-            <p>Order <strong>#{order_data['id']}</strong> has been marked as shipped.</p>
-            <p><strong>Customer:</strong> {order_data.get('customer_name')}</p>
-            <p><strong>Tracking:</strong> {order_data.get('tracking_number', 'N/A')}</p>
-        </body>
-        </html>
-        """
-        send_email(admin_email, subject, body)
-
+    _send_all(shipment_notification_emails(order_data))
     return True
-
@@ -0,0 +1,106 @@
+"""Idempotent handling of payment confirmations.
+
+M-Pesa providers retry callbacks until they get a 2xx, often several times
+within seconds. Each payment reference (the M-Pesa transaction code) is
+recorded in `PaymentIdempotencyKey` in the same transaction that applies it
+to the order, and the unique index on `key` decides which worker wins when
+retries race. Keys that are known to be applied are also kept in an LRU of
+`PAYMENT_IDEMPOTENCY_CACHE_SIZE` entries, so a repeated callback is
+answered without touching the database.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import Session, select
+from app.models.models import PaymentIdempotencyKey
+
+PAYMENT_IDEMPOTENCY_CACHE_SIZE = int(os.getenv("PAYMENT_IDEMPOTENCY_CACHE_SIZE", "10000"))
+
+
+def payment_key(mpesa_code: Optional[str], order_id: int) -> str:
+    """Idempotency key for a confirmation. Callbacks without a transaction
+    code can only be told apart by order, so at most one of those applies."""
+    if mpesa_code:
+        return f"mpesa:{mpesa_code.strip().upper()}"
+    return f"mpesa-order:{order_id}"
+
+
+class IdempotencyCache:
+    """LRU of key -> order id for keys whose transaction has committed."""
+
+    def __init__(self, size: int = PAYMENT_IDEMPOTENCY_CACHE_SIZE):
+        self.size = size
+        self._entries: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[int]:
+        with self._lock:
+            order_id = self._entries.get(key)
+            if order_id is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return order_id
+
+    def put(self, key: str, order_id: int):
+        with self._lock:
+            self._entries[key] = order_id
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "max_size": self.size, "hits": self.hits, "misses": self.misses}
+
+
+payment_keys = IdempotencyCache()
+
+
+def claim(session: Session, key: str, order_id: int, source: str) -> Optional[int]:
+    """Record `key` for `order_id` in `session`'s transaction.
+
+    Must run before the caller writes anything: returns None if the key is
+    new (the caller goes on and commits), otherwise rolls the session back
+    and returns the order id the key was already applied to. When another
+    worker holds the same key in an open transaction, this waits for it.
+    """
+    # Usual case for a retry that reached a worker without the key cached: a read, no write
+    existing = _applied_to(session, key)
+    if existing is None:
+        session.add(PaymentIdempotencyKey(key=key, order_id=order_id, source=source))
+        try:
+            session.flush()
+        except IntegrityError:
+            # Lost a race with a concurrent retry
+            session.rollback()
+            existing = _applied_to(session, key)
+            if existing is None:
+                raise
+    if existing is not None:
+        session.rollback()
+        payment_keys.put(key, existing)
+        return existing
+    session.info.setdefault("idempotency_keys", []).append((key, order_id))
+    return None
+
+
+def _applied_to(session: Session, key: str) -> Optional[int]:
+    return session.exec(select(PaymentIdempotencyKey.order_id).where(PaymentIdempotencyKey.key == key)).first()
+
+
+@event.listens_for(SASession, "after_commit")
+def _remember_committed(session):
+    for key, order_id in session.info.pop("idempotency_keys", ()):
+        payment_keys.put(key, order_id)
+
+
+@event.listens_for(SASession, "after_rollback")
+def _forget_uncommitted(session):
+    session.info.pop("idempotency_keys", None)
@@ -0,0 +1,251 @@
+"""Invoice PDF rendering off the request thread.
+
+ReportLab layout is pure-Python CPU work, so rendering inside the API
+process holds the GIL and slows every other request. Renders go to a pool
+of `PDF_RENDER_WORKERS` processes (default: one per core) instead; the
+calling thread just waits on the result. `PDF_RENDER_WORKERS=0` renders
+inline, e.g. for local debugging.
+
+PDFs are rendered into memory and handed out as bytes, both to HTTP
+responses and as email attachments. Recent renders are kept in an LRU of
+`INVOICE_PDF_MEMORY_CACHE` entries keyed by content hash. With
+`INVOICE_PDF_PERSIST` (the default) each render is also saved to the
+sharded store under `INVOICE_STORAGE_DIR` so it survives restarts and is
+shared between processes.
+
+`export_invoices_zip` builds on the pool to stream a ZIP of many invoices,
+rendering them in parallel and writing each entry as soon as it is ready.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from datetime import datetime
+from typing import Iterable, Iterator, Optional
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, select
+from app.db.session import engine
+from app.models.models import Invoice, Order, OrderItem
+from app.utils.pdf_generator import invoice_content_hash, load_invoice_pdf, render_invoice_pdf, save_invoice_pdf
+
+logger = logging.getLogger("morine.invoices")
+
+PDF_RENDER_WORKERS = int(os.getenv("PDF_RENDER_WORKERS", str(os.cpu_count() or 1)))
+INVOICE_PDF_PERSIST = os.getenv("INVOICE_PDF_PERSIST", "true").lower() in ("1", "true", "yes")
+INVOICE_PDF_MEMORY_CACHE = int(os.getenv("INVOICE_PDF_MEMORY_CACHE", "128"))
+EXPORT_BATCH_SIZE = 200
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_recent: "OrderedDict[str, bytes]" = OrderedDict()
+_recent_lock = threading.Lock()
+
+
+def build_invoice_data(invoice: Invoice, order: Order, items: list) -> dict:
+    """What `render_invoice_pdf` prints; `items` are (name, quantity, price)."""
+    return {
+        "invoice_id": invoice.id,
+        "customer_name": order.customer_name,
+        "customer_phone": order.customer_phone,
+        "delivery_address": order.delivery_address,
+        "order_items": [{"name": name, "quantity": quantity, "price": price} for name, quantity, price in items],
+        "total_price": order.total_amount or order.total_price,
+        "invoice_date": invoice.invoice_date,
+    }
+
+
+# ==========================
+# PROCESS POOL
+# ==========================
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: forking a process that runs server and worker threads can
+            # copy locks held by those threads into the child
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_RENDER_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _remember(key: str, pdf: bytes):
+    with _recent_lock:
+        _recent[key] = pdf
+        _recent.move_to_end(key)
+        while len(_recent) > INVOICE_PDF_MEMORY_CACHE:
+            _recent.popitem(last=False)
+
+
+def _cached(invoice_id: int, content_hash: str) -> Optional[bytes]:
+    key = f"{invoice_id}:{content_hash}"
+    with _recent_lock:
+        pdf = _recent.get(key)
+        if pdf is not None:
+            _recent.move_to_end(key)
+            return pdf
+    pdf = load_invoice_pdf(invoice_id, content_hash) if INVOICE_PDF_PERSIST else None
+    if pdf is not None:
+        _remember(key, pdf)
+    return pdf
+
+
+def _store(invoice_id: int, content_hash: str, pdf: bytes):
+    _remember(f"{invoice_id}:{content_hash}", pdf)
+    if INVOICE_PDF_PERSIST:
+        try:
+            save_invoice_pdf(invoice_id, content_hash, pdf)
+        except OSError:
+            # The bytes are still served; the next request renders again
+            logger.exception("failed to store invoice %s", invoice_id)
+
+
+def submit_render(invoice_data: dict) -> Future:
+    """Future for the invoice's PDF bytes; already done if it is cached."""
+    invoice_id = invoice_data["invoice_id"]
+    content_hash = invoice_content_hash(invoice_data)
+    pdf = _cached(invoice_id, content_hash)
+    if pdf is not None or PDF_RENDER_WORKERS <= 0:
+        future = Future()
+        try:
+            if pdf is None:
+                pdf = render_invoice_pdf(invoice_data)
+                _store(invoice_id, content_hash, pdf)
+            future.set_result(pdf)
+        except Exception as exc:
+            future.set_exception(exc)
+        return future
+
+    rendered = _get_pool().submit(render_invoice_pdf, invoice_data)
+    result = Future()
+
+    def _done(done: Future):
+        # Runs on the pool's result thread; storing here means the bytes are
+        # cached even if the caller stopped waiting
+        try:
+            pdf = done.result()
+        except BaseException as exc:
+            result.set_exception(exc)
+            return
+        _store(invoice_id, content_hash, pdf)
+        result.set_result(pdf)
+
+    rendered.add_done_callback(_done)
+    return result
+
+
+def invoice_pdf_bytes(invoice_data: dict) -> bytes:
+    """Render (or find) the invoice PDF and return its bytes."""
+    return submit_render(invoice_data).result()
+
+
+def render_many(invoices: Iterable[dict], window: Optional[int] = None) -> Iterator[tuple[dict, Optional[bytes]]]:
+    """Render invoices in parallel, yielding (invoice_data, pdf) as each one finishes.
+
+    At most `window` renders are in flight at a time so a long export holds
+    only a handful of PDFs in memory. A failed render yields None.
+    """
+    window = window or max(2, 2 * PDF_RENDER_WORKERS)
+    pending: dict[Future, dict] = {}
+    source = iter(invoices)
+    exhausted = False
+    while pending or not exhausted:
+        while not exhausted and len(pending) < window:
+            data = next(source, None)
+            if data is None:
+                exhausted = True
+                break
+            pending[submit_render(data)] = data
+        if not pending:
+            break
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            data = pending.pop(future)
+            try:
+                yield data, future.result()
+            except Exception:
+                logger.exception("failed to render invoice %s", data["invoice_id"])
+                yield data, None
+
+
+# ==========================
+# BULK EXPORT
+# ==========================
+def invoices_between(start: datetime, end: datetime) -> Iterator[dict]:
+    """Invoice data for invoices dated in [start, end), read in id-ordered batches."""
+    last_id = 0
+    while True:
+        with Session(engine) as session:
+            invoices = session.exec(
+                select(Invoice)
+                .where(Invoice.invoice_date >= start, Invoice.invoice_date < end, Invoice.id > last_id)
+                .options(selectinload(Invoice.order).selectinload(Order.items).selectinload(OrderItem.product))
+                .order_by(Invoice.id)
+                .limit(EXPORT_BATCH_SIZE)
+            ).all()
+            batch = [
+                build_invoice_data(
+                    invoice,
+                    invoice.order,
+                    [
+                        (item.product.name if item.product else f"Product #{item.product_id}", item.quantity, item.price)
+                        for item in sorted(invoice.order.items, key=lambda item: item.id)
+                    ],
+                )
+                for invoice in invoices
+                if invoice.order is not None
+            ]
+        if not invoices:
+            return
+        last_id = invoices[-1].id
+        yield from batch
+
+
+class _ChunkWriter:
+    """Write-only, unseekable sink for `zipfile`; the caller drains it after each entry."""
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data, self._chunks = b"".join(self._chunks), []
+        return data
+
+
+def export_invoices_zip(invoices: Iterable[dict]) -> Iterator[bytes]:
+    """Stream a ZIP of invoice PDFs, one chunk per entry, in completion order.
+
+    Only the renders in flight are held in memory. PDFs are already
+    compressed, so entries are stored as-is. Invoices that failed to render
+    are listed in `errors.txt` at the end of the archive.
+    """
+    sink = _ChunkWriter()
+    failed = []
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED) as archive:
+        for data, pdf in render_many(invoices):
+            if pdf is None:
+                failed.append(data["invoice_id"])
+                continue
+            archive.writestr(f"invoice_{data['invoice_id']}.pdf", pdf)
+            yield sink.drain()
+        if failed:
+            archive.writestr("errors.txt", "".join(f"invoice {invoice_id}: render failed\n" for invoice_id in failed))
+    yield sink.drain()
@@ -0,0 +1,338 @@
+"""Async client for the Safaricom Daraja STK-push API.
+
+`initiate_mpesa_push` awaits this client on the event loop, so a slow
+provider doesn't tie up a threadpool worker. The client:
+
+- keeps one `httpx.AsyncClient` with a keep-alive connection pool;
+- caches the OAuth token until shortly before it expires, with a single
+  refresh in flight at a time;
+- applies connect/read timeouts (`MPESA_TIMEOUT_SECONDS`);
+- retries with exponential backoff and full jitter, at most
+  `MPESA_MAX_RETRIES` times. It only retries when the push can't have
+  reached the customer: connection failures, 429 and 503. Repeating a push
+  that timed out mid-flight could prompt the customer twice;
+- opens a circuit breaker after `MPESA_BREAKER_THRESHOLD` consecutive
+  failures. Pushes then fail fast with `MpesaUnavailable` for
+  `MPESA_BREAKER_RESET_SECONDS` before a single trial request is let through.
+
+The client is only used when `MPESA_CONSUMER_KEY`, `MPESA_CONSUMER_SECRET`,
+`MPESA_SHORTCODE`, `MPESA_PASSKEY` and `MPESA_CALLBACK_URL` are all set;
+otherwise pushes are simulated. `MPESA_BASE_URL` defaults to the Daraja
+sandbox. For offline testing, point it at `scripts/mock_daraja.py`.
+"""
+import asyncio
+import base64
+import logging
+import os
+import random
+import time
+from datetime import datetime
+from typing import Optional
+import httpx
+
+logger = logging.getLogger("morine.mpesa")
+
+MPESA_BASE_URL = os.getenv("MPESA_BASE_URL", "https://sandbox.safaricom.co.ke")
+MPESA_TIMEOUT_SECONDS = float(os.getenv("MPESA_TIMEOUT_SECONDS", "10"))
+MPESA_MAX_RETRIES = int(os.getenv("MPESA_MAX_RETRIES", "2"))
+MPESA_BACKOFF_SECONDS = float(os.getenv("MPESA_BACKOFF_SECONDS", "0.5"))
+MPESA_BREAKER_THRESHOLD = int(os.getenv("MPESA_BREAKER_THRESHOLD", "5"))
+MPESA_BREAKER_RESET_SECONDS = float(os.getenv("MPESA_BREAKER_RESET_SECONDS", "30"))
+# Refresh the token this long before Daraja says it expires
+TOKEN_EXPIRY_MARGIN_SECONDS = 60
+
+_RETRY_STATUSES = (429, 503)
+# Daraja's errorCode for an expired or revoked access token
+INVALID_TOKEN_ERROR_CODE = "404.001.03"
+
+
+class MpesaError(Exception):
+    pass
+
+
+class MpesaUnavailable(MpesaError):
+    """The provider can't be reached right now (or the circuit is open)."""
+
+
+class MpesaRequestError(MpesaError):
+    """The provider rejected the request."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, error_code: Optional[str] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.error_code = error_code
+
+
+def to_msisdn(phone: str) -> str:
+    """Daraja wants 2547XXXXXXXX; customers type 07XX, +2547XX, 7XX..."""
+    digits = "".join(ch for ch in phone if ch.isdigit())
+    if digits.startswith("254"):
+        return digits
+    if digits.startswith("0"):
+        return "254" + digits[1:]
+    return "254" + digits
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed -> open -> half-open (one trial) -> closed."""
+
+    def __init__(self, threshold: int = MPESA_BREAKER_THRESHOLD, reset_seconds: float = MPESA_BREAKER_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_flight = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def before_request(self):
+        state = self.state
+        if state == "open" or (state == "half-open" and self._trial_in_flight):
+            raise MpesaUnavailable("M-Pesa provider unavailable (circuit open)")
+        if state == "half-open":
+            self._trial_in_flight = True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.failures >= self.threshold or self.opened_at is not None:
+            self.opened_at = time.monotonic()
+
+    def release_trial(self):
+        """Give up a half-open trial that ended without an answer either way."""
+        self._trial_in_flight = False
+
+
+class DarajaClient:
+    def __init__(
+        self,
+        consumer_key: str,
+        consumer_secret: str,
+        shortcode: str,
+        passkey: str,
+        callback_url: str,
+        base_url: str = MPESA_BASE_URL,
+        transaction_type: str = "CustomerPayBillOnline",
+        timeout: float = MPESA_TIMEOUT_SECONDS,
+        max_retries: int = MPESA_MAX_RETRIES,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.consumer_key = consumer_key
+        self.consumer_secret = consumer_secret
+        self.shortcode = shortcode
+        self.passkey = passkey
+        self.callback_url = callback_url
+        self.base_url = base_url
+        self.transaction_type = transaction_type
+        self.max_retries = max_retries
+        self.breaker = CircuitBreaker()
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(timeout, connect=min(timeout, 5.0)),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60),
+            transport=transport,
+        )
+        self._token: Optional[str] = None
+        self._token_expires = 0.0
+        self._token_lock = asyncio.Lock()
+        self.token_fetches = 0
+        self.requests = 0
+
+    async def aclose(self):
+        await self._http.aclose()
+
+    # ---------- auth ----------
+    async def _access_token(self) -> str:
+        if self._token and time.monotonic() < self._token_expires:
+            return self._token
+        async with self._token_lock:
+            # Another request may have refreshed it while we waited
+            if self._token and time.monotonic() < self._token_expires:
+                return self._token
+            response = await self._send(
+                "GET",
+                "/oauth/v1/generate",
+                params={"grant_type": "client_credentials"},
+                auth=(self.consumer_key, self.consumer_secret),
+            )
+            body = response.json()
+            self.token_fetches += 1
+            self._token = body["access_token"]
+            self._token_expires = time.monotonic() + max(0, int(body.get("expires_in", 3599)) - TOKEN_EXPIRY_MARGIN_SECONDS)
+            return self._token
+
+    # ---------- transport ----------
+    async def _send(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """One logical request with retries, counted once by the breaker.
+
+        Every way out of the attempts settles the breaker, so a half-open
+        trial can't be left marked in flight.
+        """
+        self.breaker.before_request()
+        try:
+            response = await self._attempts(method, url, **kwargs)
+        except MpesaRequestError:
+            # The provider is up and answered; a rejection is not an outage
+            self.breaker.record_success()
+            raise
+        except asyncio.CancelledError:
+            # The caller went away; that says nothing about the provider
+            self.breaker.release_trial()
+            raise
+        except BaseException:
+            self.breaker.record_failure()
+            if self.breaker.state == "open":
+                logger.error("M-Pesa circuit open after %d consecutive failures", self.breaker.failures)
+            raise
+        self.breaker.record_success()
+        return response
+
+    async def _attempts(self, method: str, url: str, **kwargs) -> httpx.Response:
+        for attempt in range(self.max_retries + 1):
+            retryable = False
+            try:
+                self.requests += 1
+                response = await self._http.request(method, url, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as exc:
+                # Never reached the provider; safe to repeat
+                error: MpesaError = MpesaUnavailable(f"M-Pesa provider unreachable: {exc!r}")
+                retryable = True
+            except httpx.TransportError as exc:
+                error = MpesaUnavailable(f"M-Pesa request failed: {exc!r}")
+            else:
+                if response.status_code < 400:
+                    return response
+                if response.status_code in _RETRY_STATUSES:
+                    error = MpesaUnavailable(f"M-Pesa provider busy ({response.status_code})")
+                    retryable = True
+                elif response.status_code >= 500:
+                    error = MpesaUnavailable(f"M-Pesa provider error ({response.status_code}): {response.text[:200]}")
+                else:
+                    raise MpesaRequestError(
+                        f"M-Pesa rejected the request ({response.status_code}): {response.text[:200]}",
+                        status_code=response.status_code,
+                        error_code=_error_code(response),
+                    )
+            if not retryable or attempt == self.max_retries:
+                break
+            logger.warning("%s %s failed (%s); retrying", method, url, error)
+            await asyncio.sleep(random.uniform(0, MPESA_BACKOFF_SECONDS * 2 ** attempt))
+        raise error
+
+    # ---------- API ----------
+    async def stk_push(self, phone: str, amount: float, reference: str, description: str = "Payment") -> dict:
+        """Ask Daraja to prompt `phone` for `amount`. Returns Daraja's response
+        (MerchantRequestID, CheckoutRequestID, ResponseCode, CustomerMessage)."""
+        timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+        password = base64.b64encode(f"{self.shortcode}{self.passkey}{timestamp}".encode()).decode()
+        msisdn = to_msisdn(phone)
+        body = {
+            "BusinessShortCode": self.shortcode,
+            "Password": password,
+            "Timestamp": timestamp,
+            "TransactionType": self.transaction_type,
+            "Amount": max(1, int(round(amount))),
+            "PartyA": msisdn,
+            "PartyB": self.shortcode,
+            "PhoneNumber": msisdn,
+            "CallBackURL": self.callback_url,
+            "AccountReference": reference[:12],
+            "TransactionDesc": description[:13],
+        }
+        for attempt in range(2):
+            token = await self._access_token()
+            try:
+                response = await self._send(
+                    "POST", "/mpesa/stkpush/v1/processrequest", json=body, headers={"Authorization": f"Bearer {token}"}
+                )
+            except MpesaRequestError as exc:
+                # A token revoked before its expiry: fetch a new one once.
+                # Any other rejection (bad phone, amount...) is final.
+                token_rejected = exc.status_code == 401 or exc.error_code == INVALID_TOKEN_ERROR_CODE
+                if token_rejected and attempt == 0 and self._token == token:
+                    self._token = None
+                    continue
+                raise
+            result = response.json()
+            if str(result.get("ResponseCode")) != "0":
+                raise MpesaRequestError(result.get("ResponseDescription") or result.get("errorMessage") or "STK push rejected")
+            return result
+        raise MpesaRequestError("STK push rejected")
+
+    def stats(self) -> dict:
+        return {
+            "base_url": self.base_url,
+            "breaker": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "requests": self.requests,
+            "token_fetches": self.token_fetches,
+        }
+
+
+def _error_code(response: httpx.Response) -> Optional[str]:
+    try:
+        body = response.json()
+    except ValueError:
+        return None
+    return body.get("errorCode") if isinstance(body, dict) else None
+
+
+def parse_stk_callback(payload: dict) -> Optional[dict]:
+    """Flatten a Daraja STK callback ({"Body": {"stkCallback": ...}}) into
+    {checkout_request_id, status, mpesa_code, amount, phone_number}, or None
+    if `payload` isn't one."""
+    callback = (payload.get("Body") or {}).get("stkCallback") if isinstance(payload, dict) else None
+    if not callback:
+        return None
+    items = {
+        item.get("Name"): item.get("Value")
+        for item in (callback.get("CallbackMetadata") or {}).get("Item", [])
+    }
+    return {
+        "checkout_request_id": callback.get("CheckoutRequestID"),
+        "status": "SUCCESS" if str(callback.get("ResultCode")) == "0" else "FAILED",
+        "result_description": callback.get("ResultDesc"),
+        "mpesa_code": items.get("MpesaReceiptNumber"),
+        "amount": items.get("Amount"),
+        "phone_number": str(items["PhoneNumber"]) if items.get("PhoneNumber") else None,
+    }
+
+
+_client: Optional[DarajaClient] = None
+
+
+def get_mpesa_client() -> Optional[DarajaClient]:
+    """Shared client, or None when Daraja credentials aren't configured."""
+    global _client
+    if _client is None:
+        config = {
+            "consumer_key": os.getenv("MPESA_CONSUMER_KEY"),
+            "consumer_secret": os.getenv("MPESA_CONSUMER_SECRET"),
+            "shortcode": os.getenv("MPESA_SHORTCODE"),
+            "passkey": os.getenv("MPESA_PASSKEY"),
+            "callback_url": os.getenv("MPESA_CALLBACK_URL"),
+        }
+        if not all(config.values()):
+            return None
+        _client = DarajaClient(
+            **config, transaction_type=os.getenv("MPESA_TRANSACTION_TYPE", "CustomerPayBillOnline")
+        )
+    return _client
+
+
+async def close_mpesa_client():
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
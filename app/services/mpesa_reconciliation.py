@@ -0,0 +1,303 @@
+"""Reconcile an M-Pesa statement export against unpaid M-Pesa orders.
+
+Used by `POST /admin/mpesa/reconcile` and `scripts/reconcile_mpesa.py`.
+
+1. Unpaid M-Pesa orders are loaded once into two hash indexes: the code a
+   customer already submitted (`order.mpesa_code`), and (phone, amount in
+   cents), oldest order first.
+2. The CSV is read row by row; each completed incoming payment is matched by
+   its receipt number first, then by payer phone and amount. Every order is
+   matched at most once.
+3. Payments whose receipt number was already applied (see
+   `app/services/idempotency.py`) are dropped before matching, a chunk of
+   rows at a time, so they never take an order.
+4. One transaction applies the rest: a bulk `UPDATE` of the orders that are
+   still unpaid, a bulk `UPDATE` of their invoices, the idempotency keys, and
+   the confirmation emails. Customers get their usual confirmation and the
+   admin one summary; a customer still on the payment page is told through
+   `app/services/payment_events.py`.
+
+Statement layouts differ between the M-Pesa app, the web portal and Pochi
+exports, so columns are found by header name (see `COLUMN_ALIASES`) and any
+lines before the header row are skipped. Payer numbers that the statement
+masks (`2547******89`) can only be matched by receipt number.
+"""
+import csv
+import re
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Iterable, Optional, TextIO
+from sqlalchemy import case, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select
+from app.config import get_settings
+from app.models.models import Invoice, Order, PaymentIdempotencyKey
+from app.services import outbox
+from app.services.email_service import admin_digest_emails, payment_confirmation_emails
+from app.services.idempotency import payment_key, payment_keys
+from app.services.payment_events import announce, payment_state
+
+# Keep IN lists well below SQLite's bound-parameter limit
+CHUNK_SIZE = 500
+UNMATCHED_SAMPLE_SIZE = 50
+
+COLUMN_ALIASES = {
+    "code": ("receipt no.", "receipt no", "receipt", "receipt number", "transaction id", "transid", "mpesa_code", "code"),
+    "amount": ("paid in", "paid_in", "amount", "transamount", "credit"),
+    "phone": ("phone", "phone number", "phone_number", "msisdn", "other party info", "sender"),
+    "details": ("details", "description", "narrative"),
+    "status": ("transaction status", "status"),
+}
+
+_PHONE = re.compile(r"(?<!\d)(?:\+?254|0)?([17]\d{8})(?!\d)")
+
+
+def normalize_phone(value: Optional[str]) -> Optional[str]:
+    """`0712345678` form of a Kenyan mobile number found in `value`, or None."""
+    if not value:
+        return None
+    match = _PHONE.search(re.sub(r"(?<=\d)[\s-](?=\d)", "", value))
+    return f"0{match.group(1)}" if match else None
+
+
+def to_cents(value) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    try:
+        return int(round(float(str(value).replace(",", "").strip()) * 100))
+    except ValueError:
+        return None
+
+
+def _header_index(row: list[str]) -> Optional[dict]:
+    """Column positions if `row` is the statement's header row."""
+    cells = [cell.strip().lower() for cell in row]
+    columns = {}
+    for name, aliases in COLUMN_ALIASES.items():
+        for alias in aliases:
+            if alias in cells:
+                columns[name] = cells.index(alias)
+                break
+    return columns if "code" in columns and "amount" in columns else None
+
+
+def read_statement(stream: TextIO) -> Iterable[dict]:
+    """Incoming payments in the statement as {code, phone, cents}, one row at a time.
+
+    Rows in a non-completed state, outgoing transactions (no paid-in amount)
+    and lines without a receipt number are skipped.
+    """
+    reader = csv.reader(stream)
+    columns = None
+    for row in reader:
+        if columns is None:
+            columns = _header_index(row)
+            continue
+
+        def cell(name):
+            index = columns.get(name)
+            return row[index].strip() if index is not None and index < len(row) else ""
+
+        code = cell("code").upper()
+        cents = to_cents(cell("amount"))
+        if not code or not cents or cents <= 0:
+            continue
+        status = cell("status").lower()
+        if status and status not in ("completed", "success", "successful"):
+            continue
+        yield {"code": code, "phone": normalize_phone(cell("phone")) or normalize_phone(cell("details")), "cents": cents}
+    if columns is None:
+        raise ValueError("No header row with receipt number and amount columns found")
+
+
+class _PendingOrders:
+    """Unpaid M-Pesa orders indexed by submitted code and by (phone, cents)."""
+
+    def __init__(self, session: Session):
+        rows = session.exec(
+            select(Order.id, Order.customer_phone, Order.total_amount, Order.total_price, Order.mpesa_code)
+            .where(Order.payment_method == "mpesa", Order.payment_verified == False)  # noqa: E712
+            .order_by(Order.created_at, Order.id)
+        ).all()
+        self.by_code: dict[str, int] = {}
+        self.by_phone_amount: dict[tuple, deque] = defaultdict(deque)
+        self.matched: set[int] = set()
+        for order_id, phone, total_amount, total_price, mpesa_code in rows:
+            if mpesa_code:
+                self.by_code[mpesa_code.strip().upper()] = order_id
+            phone = normalize_phone(phone)
+            cents = to_cents(total_amount or total_price)
+            if phone and cents:
+                self.by_phone_amount[(phone, cents)].append(order_id)
+        self.count = len(rows)
+
+    def match(self, payment: dict) -> tuple[Optional[int], Optional[str]]:
+        order_id = self.by_code.get(payment["code"])
+        if order_id is not None and order_id not in self.matched:
+            self.matched.add(order_id)
+            return order_id, "code"
+        candidates = self.by_phone_amount.get((payment["phone"], payment["cents"]))
+        while candidates:
+            order_id = candidates.popleft()
+            if order_id not in self.matched:
+                self.matched.add(order_id)
+                return order_id, "phone_amount"
+        return None, None
+
+
+def _chunks(items: list, size: int = CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _chunks_of(items: Iterable, size: int = CHUNK_SIZE):
+    """Lists of up to `size` items from any iterable, without reading ahead further."""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _applied_codes(session: Session, keys: list[str]) -> set[str]:
+    applied = set()
+    for chunk in _chunks(keys):
+        applied.update(
+            session.exec(select(PaymentIdempotencyKey.key).where(PaymentIdempotencyKey.key.in_(chunk))).all()
+        )
+    return applied
+
+
+def _apply(session: Session, matches: dict[int, str]) -> list[int]:
+    """Mark the matched orders paid and queue confirmations; returns the ids
+    actually updated (orders paid in the meantime are left alone)."""
+    updated: list[int] = []
+    for chunk in _chunks(list(matches)):
+        result = session.execute(
+            update(Order)
+            .where(Order.id.in_(chunk), Order.payment_verified == False)  # noqa: E712
+            .values(
+                payment_verified=True,
+                payment_status="verified",
+                mpesa_code=case({order_id: matches[order_id] for order_id in chunk}, value=Order.id),
+            )
+            .returning(Order.id)
+            .execution_options(synchronize_session=False)
+        )
+        updated.extend(result.scalars().all())
+    if not updated:
+        return updated
+
+    for chunk in _chunks(updated):
+        session.execute(
+            update(Invoice)
+            .where(Invoice.order_id.in_(chunk))
+            .values(payment_status="Paid", payment_method="MPESA")
+            .execution_options(synchronize_session=False)
+        )
+    session.execute(
+        insert(PaymentIdempotencyKey),
+        [{"key": payment_key(matches[order_id], order_id), "order_id": order_id, "source": "statement",
+          "created_at": datetime.utcnow()} for order_id in updated],
+    )
+
+    # Confirmations: the usual email per customer, one summary for the admin
+    settings = get_settings()
+    admin_email = settings.get("notifications", {}).get("adminEmail", "orumagideon535@gmail.com")
+    messages, entries = [], []
+    now = datetime.utcnow().isoformat()
+    for chunk in _chunks(updated):
+        orders = session.exec(
+            select(Order).where(Order.id.in_(chunk)).order_by(Order.id).execution_options(populate_existing=True)
+        ).all()
+        for order in orders:
+            announce(session, order.id, payment_state(order))
+            order_dict = {
+                "id": order.id,
+                "customer_name": order.customer_name,
+                "customer_email": order.customer_email,
+                "customer_phone": order.customer_phone,
+                "total_amount": order.total_amount,
+                "total_price": order.total_price,
+                "payment_method": order.payment_method,
+                "mpesa_code": matches[order.id],
+                "status": order.status,
+            }
+            messages.extend(m for m in payment_confirmation_emails(order_dict) if m["to_email"] != admin_email)
+            entries.append({"event": "payment", "created_at": now, "order": order_dict})
+    if settings.get("notifications", {}).get("sendPaymentNotifications", True):
+        messages.extend(admin_digest_emails(entries))
+    outbox.enqueue_emails(session, messages)
+    return updated
+
+
+def reconcile_statement(session: Session, stream: TextIO, dry_run: bool = False) -> dict:
+    """Match a statement CSV against unpaid M-Pesa orders and mark matches paid.
+
+    Returns counts plus a sample of unmatched payments. With `dry_run` nothing
+    is written.
+    """
+    pending = _PendingOrders(session)
+    matches: dict[int, str] = {}
+    methods: dict[int, str] = {}
+    seen_codes: set[str] = set()
+    rows = 0
+    already_applied = 0
+    unmatched = 0
+    unmatched_sample = []
+    for chunk in _chunks_of(read_statement(stream)):
+        payments = []
+        for payment in chunk:
+            rows += 1
+            # Exports that span overlapping periods repeat rows
+            if payment["code"] in seen_codes:
+                continue
+            seen_codes.add(payment["code"])
+            payments.append(payment)
+        # Receipt numbers already applied through the webhook or a previous
+        # run are dropped before matching, so they can't take a pending order
+        # that is waiting for its own receipt
+        applied = _applied_codes(session, [payment_key(payment["code"], None) for payment in payments])
+        for payment in payments:
+            if payment_key(payment["code"], None) in applied:
+                already_applied += 1
+                continue
+            order_id, method = pending.match(payment)
+            if order_id is None:
+                unmatched += 1
+                if len(unmatched_sample) < UNMATCHED_SAMPLE_SIZE:
+                    unmatched_sample.append(
+                        {"code": payment["code"], "phone": payment["phone"], "amount": payment["cents"] / 100}
+                    )
+                continue
+            matches[order_id] = payment["code"]
+            methods[order_id] = method
+    keys = {order_id: payment_key(code, order_id) for order_id, code in matches.items()}
+
+    updated = []
+    if matches and not dry_run:
+        try:
+            updated = _apply(session, matches)
+            session.commit()
+        except IntegrityError:
+            # A receipt number was applied concurrently; nothing was written
+            session.rollback()
+            raise
+        for order_id in updated:
+            payment_keys.put(keys[order_id], order_id)
+
+    return {
+        "dry_run": dry_run,
+        "payments": rows,
+        "pending_orders": pending.count,
+        "matched": len(matches),
+        "matched_by_code": sum(1 for order_id in matches if methods[order_id] == "code"),
+        "matched_by_phone_amount": sum(1 for order_id in matches if methods[order_id] == "phone_amount"),
+        "already_applied": already_applied,
+        "marked_paid": len(updated),
+        "unmatched": unmatched,
+        "unmatched_sample": unmatched_sample,
+    }
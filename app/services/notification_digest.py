@@ -0,0 +1,85 @@
+"""Digest mode for admin notification emails.
+
+With `notifications.digestEnabled` set in `app_settings.json`, admin copies of
+order, payment and shipment emails are stored as `AdminDigestEntry` rows
+instead of being queued one by one. The outbox worker checks the backlog on
+every poll and turns it into a single summary email once the oldest entry is
+`digestWindowMinutes` old or `digestMaxItems` entries have piled up.
+Customer emails are always queued immediately.
+"""
+from datetime import datetime, timedelta
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import delete, func
+from sqlmodel import Session, select
+from app.config import get_settings
+from app.db.session import engine
+from app.models.models import AdminDigestEntry
+from app.services import outbox
+from app.services.email_service import admin_digest_emails
+
+
+def _digest_settings() -> dict:
+    notifications = get_settings().get("notifications", {})
+    return {
+        "admin_email": notifications.get("adminEmail", "orumagideon535@gmail.com"),
+        "enabled": bool(notifications.get("digestEnabled", False)),
+        "window": timedelta(minutes=float(notifications.get("digestWindowMinutes", 5))),
+        "max_items": max(1, int(notifications.get("digestMaxItems", 20))),
+    }
+
+
+def queue_notifications(session: Session, event: str, order_data: dict, messages: list[dict]):
+    """Queue the emails composed for an order event in `session`'s transaction.
+
+    In digest mode the admin's copy is replaced by a digest entry.
+    """
+    config = _digest_settings()
+    if config["enabled"]:
+        admin_messages = [m for m in messages if m["to_email"] == config["admin_email"]]
+        if admin_messages:
+            session.add(AdminDigestEntry(event=event, payload=jsonable_encoder(order_data)))
+            messages = [m for m in messages if m["to_email"] != config["admin_email"]]
+    outbox.enqueue_emails(session, messages)
+
+
+@outbox.periodic_task
+def flush_digest(force: bool = False) -> int:
+    """Queue one summary email for held-back entries if the batch is due.
+
+    The entries are deleted in the same transaction that queues the email;
+    if another worker got to some of them first, the transaction is rolled
+    back and the batch is retried on the next poll. Returns the number of
+    entries sent.
+    """
+    config = _digest_settings()
+    with Session(engine) as session:
+        count, oldest = session.exec(select(func.count(), func.min(AdminDigestEntry.created_at))).one()
+        if not count:
+            return 0
+        due = (
+            force
+            # Switching digest mode off releases whatever is still held
+            or not config["enabled"]
+            or count >= config["max_items"]
+            or oldest <= datetime.utcnow() - config["window"]
+        )
+        if not due:
+            return 0
+
+        entries = session.exec(
+            select(AdminDigestEntry).order_by(AdminDigestEntry.id).limit(config["max_items"])
+        ).all()
+        ids = [entry.id for entry in entries]
+        messages = admin_digest_emails(
+            [
+                {"event": entry.event, "created_at": entry.created_at.isoformat(), "order": entry.payload}
+                for entry in entries
+            ]
+        )
+        result = session.exec(delete(AdminDigestEntry).where(AdminDigestEntry.id.in_(ids)))
+        if result.rowcount != len(ids):
+            session.rollback()
+            return 0
+        outbox.enqueue_emails(session, messages)
+        session.commit()
+        return len(ids)
@@ -0,0 +1,141 @@
+"""Stream orders and their items as CSV or JSON lines.
+
+Used by `GET /orders/export` and `export_orders.py`. Orders are read with
+one joined query over a server-side cursor (`stream_results`, fetched
+`ORDER_EXPORT_BATCH_SIZE` rows at a time). Only plain columns are selected,
+so no ORM objects are built. Output is yielded in chunks of about
+`CHUNK_BYTES`, so memory use stays flat however many orders are exported.
+
+- CSV has one row per order item, with the order's columns repeated. An order
+  without items gets one row with empty item columns.
+- JSONL has one order per line, with its items in an `items` list.
+
+The export runs in its own session, which stays open while the output is
+consumed.
+"""
+import csv
+import io
+import json
+import os
+from datetime import date, datetime
+from itertools import groupby
+from typing import Iterator, Optional
+from sqlmodel import Session, select
+from app.db.session import engine
+from app.models.models import Order, OrderItem, Product
+
+ORDER_EXPORT_BATCH_SIZE = int(os.getenv("ORDER_EXPORT_BATCH_SIZE", "1000"))
+CHUNK_BYTES = 64 * 1024
+
+ORDER_COLUMNS = (
+    "id",
+    "created_at",
+    "status",
+    "payment_method",
+    "payment_status",
+    "payment_verified",
+    "mpesa_code",
+    "customer_name",
+    "customer_phone",
+    "customer_email",
+    "delivery_address",
+    "total_price",
+    "shipping_cost",
+    "total_amount",
+    "shipping_provider",
+    "tracking_number",
+    "shipped_at",
+)
+ITEM_COLUMNS = ("item_id", "product_id", "product_name", "quantity", "price")
+# Written as ISO 8601 in CSV, as in JSONL
+_DATETIME_INDEXES = (ORDER_COLUMNS.index("created_at"), ORDER_COLUMNS.index("shipped_at"))
+
+
+def _export_query(
+    status: Optional[str] = None,
+    payment_status: Optional[str] = None,
+    payment_method: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+):
+    query = (
+        select(
+            *(getattr(Order, name) for name in ORDER_COLUMNS),
+            OrderItem.id.label("item_id"),
+            OrderItem.product_id,
+            Product.name.label("product_name"),
+            OrderItem.quantity,
+            OrderItem.price,
+        )
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+        .outerjoin(Product, Product.id == OrderItem.product_id)
+    )
+    if status:
+        query = query.where(Order.status == status)
+    if payment_status:
+        query = query.where(Order.payment_status == payment_status)
+    if payment_method:
+        query = query.where(Order.payment_method == payment_method)
+    if created_from:
+        query = query.where(Order.created_at >= created_from)
+    if created_to:
+        query = query.where(Order.created_at < created_to)
+    return query.order_by(Order.created_at, Order.id, OrderItem.id)
+
+
+def _rows(**filters) -> Iterator:
+    with Session(engine) as session:
+        result = session.execute(
+            _export_query(**filters).execution_options(stream_results=True, yield_per=ORDER_EXPORT_BATCH_SIZE)
+        )
+        for partition in result.partitions():
+            yield from partition
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def export_csv(**filters) -> Iterator[str]:
+    """CSV text in chunks: a header, then one row per order item."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(("order_id",) + ORDER_COLUMNS[1:] + ITEM_COLUMNS)
+    for row in _rows(**filters):
+        row = list(row)
+        for index in _DATETIME_INDEXES:
+            if row[index] is not None:
+                row[index] = row[index].isoformat()
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_jsonl(**filters) -> Iterator[str]:
+    """JSON lines in chunks: one order per line with its `items`."""
+    lines = []
+    size = 0
+    width = len(ORDER_COLUMNS)
+    # Rows arrive ordered by order, so each order's items are consecutive
+    for order_id, rows in groupby(_rows(**filters), key=lambda row: row[0]):
+        rows = list(rows)
+        order = dict(zip(ORDER_COLUMNS, rows[0][:width]))
+        order["items"] = [dict(zip(ITEM_COLUMNS, row[width:])) for row in rows if row[width] is not None]
+        line = json.dumps(order, default=_json_default) + "\n"
+        lines.append(line)
+        size += len(line)
+        if size >= CHUNK_BYTES:
+            yield "".join(lines)
+            lines, size = [], 0
+    yield "".join(lines)
+
+
+EXPORT_FORMATS = {
+    "csv": (export_csv, "text/csv"),
+    "jsonl": (export_jsonl, "application/x-ndjson"),
+}
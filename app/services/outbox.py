@@ -0,0 +1,362 @@
+"""Transactional outbox for work that shouldn't run inside an HTTP request.
+
+Request handlers call `enqueue()` with the same session that writes the
+order, so a job exists if and only if its change was committed. A worker
+(thread pool started with the app, or `python -m app.services.outbox` as a
+separate process) claims due jobs from the `outboxjob` table and runs the
+handler registered for their `kind`.
+
+- Claiming is a conditional UPDATE per job, so any number of app processes
+  and workers can poll the same table without running a job twice.
+- A claimed job holds a lease (`OUTBOX_LEASE_SECONDS`); jobs whose worker
+  died are picked up again once it expires.
+- Failures are retried with exponential backoff and jitter. After
+  `max_attempts` a job is marked `dead` and kept for inspection and manual
+  retry through `/admin/outbox`.
+- At most `OUTBOX_CONCURRENCY` jobs run at once per worker.
+- A handler may return follow-up jobs as (kind, payload) pairs. They are
+  enqueued in the transaction that marks the job done, so a job that fails
+  and is retried never queues them twice.
+"""
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Optional
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import and_, delete, event, func, or_, update
+from sqlalchemy.orm import Session as SASession
+from sqlmodel import Session, select
+from app.db.session import engine
+from app.models.models import OutboxJob
+from app.services.email_service import attachment_part, deliver
+from app.services.invoice_renderer import invoice_pdf_bytes
+
+logger = logging.getLogger("morine.outbox")
+
+OUTBOX_WORKER_ENABLED = os.getenv("OUTBOX_WORKER_ENABLED", "true").lower() in ("1", "true", "yes")
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "4"))
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "6"))
+OUTBOX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_BACKOFF_SECONDS", "30"))  # doubles per attempt
+OUTBOX_MAX_BACKOFF_SECONDS = float(os.getenv("OUTBOX_MAX_BACKOFF_SECONDS", "3600"))
+OUTBOX_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+OUTBOX_RETENTION_DAYS = float(os.getenv("OUTBOX_RETENTION_DAYS", "7"))
+PURGE_INTERVAL_SECONDS = 3600
+
+_handlers: dict[str, Callable[[dict], Optional[Iterable[tuple]]]] = {}
+_periodic_tasks: list[Callable[[], object]] = []
+# Set after a commit that enqueued jobs so the local worker doesn't wait a full poll interval
+_wakeup = threading.Event()
+
+
+def job_handler(kind: str):
+    """Register the function that runs jobs of `kind`. It receives the job
+    payload, signals failure by raising, and may return follow-up jobs as
+    (kind, payload) pairs."""
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def periodic_task(fn):
+    """Register a no-argument function the worker calls on every poll, e.g. to
+    turn accumulated state into jobs. It should be cheap when there's nothing to do."""
+    _periodic_tasks.append(fn)
+    return fn
+
+
+# ==========================
+# ENQUEUEING
+# ==========================
+def enqueue(session: Session, kind: str, payload: dict, max_attempts: Optional[int] = None) -> OutboxJob:
+    """Add a job to `session`; it is committed (or rolled back) with the caller's transaction."""
+    job = OutboxJob(kind=kind, payload=jsonable_encoder(payload), max_attempts=max_attempts or OUTBOX_MAX_ATTEMPTS)
+    session.add(job)
+    session.info["outbox_enqueued"] = True
+    return job
+
+
+def enqueue_emails(session: Session, messages: list[dict]):
+    """Queue one `email` job per message composed by `app/services/email_service.py`."""
+    for message in messages:
+        enqueue(session, "email", message)
+
+
+@event.listens_for(SASession, "after_commit")
+def _wake_worker(session):
+    if session.info.pop("outbox_enqueued", False):
+        _wakeup.set()
+
+
+@event.listens_for(SASession, "after_rollback")
+def _forget_enqueued(session):
+    session.info.pop("outbox_enqueued", None)
+
+
+# ==========================
+# WORKER
+# ==========================
+def _backoff(attempts: int) -> timedelta:
+    delay = min(OUTBOX_MAX_BACKOFF_SECONDS, OUTBOX_BACKOFF_SECONDS * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+class OutboxWorker:
+    def __init__(self, concurrency: int = OUTBOX_CONCURRENCY, poll_seconds: float = OUTBOX_POLL_SECONDS):
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._last_purge = 0.0
+        self.succeeded = 0
+        self.retried = 0
+        self.dead_lettered = 0
+
+    # ---------- lifecycle ----------
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="outbox")
+        self._thread = threading.Thread(target=self._run, name="outbox-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30):
+        """Stop claiming jobs and wait for the running ones to finish."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        _wakeup.set()
+        self._thread.join(timeout)
+        self._pool.shutdown(wait=True)
+        self._thread = None
+        self._pool = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                for task in _periodic_tasks:
+                    task()
+                claimed = self.run_once()
+                if time.monotonic() - self._last_purge > PURGE_INTERVAL_SECONDS:
+                    self._last_purge = time.monotonic()
+                    purge_finished()
+            except Exception:
+                logger.exception("outbox poll failed")
+                claimed = 0
+            if not claimed:
+                _wakeup.wait(self.poll_seconds)
+                _wakeup.clear()
+
+    def run_once(self) -> int:
+        """Claim as many due jobs as there are free slots and hand them to the pool."""
+        with self._lock:
+            free = self.concurrency - self._in_flight
+        if free <= 0:
+            return 0
+        jobs = claim_jobs(free)
+        for job in jobs:
+            with self._lock:
+                self._in_flight += 1
+            self._pool.submit(self._execute, job)
+        return len(jobs)
+
+    # ---------- execution ----------
+    def _execute(self, job: OutboxJob):
+        try:
+            follow_ups = run_job(job)
+        except Exception as exc:
+            if self._fail(job, exc):
+                self.dead_lettered += 1
+            else:
+                self.retried += 1
+        else:
+            self._finish(job, follow_ups or ())
+            self.succeeded += 1
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            # A slot is free again
+            _wakeup.set()
+
+    def _finish(self, job: OutboxJob, follow_ups: Iterable[tuple] = ()):
+        with Session(engine) as session:
+            result = session.exec(
+                update(OutboxJob)
+                .where(OutboxJob.id == job.id, OutboxJob.status == "running")
+                .values(status="done", completed_at=datetime.utcnow(), locked_until=None, last_error=None)
+            )
+            # Only the worker that still holds the job queues its follow-ups
+            if result.rowcount:
+                for kind, payload in follow_ups:
+                    enqueue(session, kind, payload)
+            session.commit()
+
+    def _fail(self, job: OutboxJob, exc: Exception) -> bool:
+        """Schedule a retry, or dead-letter the job once it is out of attempts.
+        Returns True if the job was dead-lettered."""
+        error = f"{type(exc).__name__}: {exc}"[:2000]
+        dead = job.attempts >= job.max_attempts
+        values = {"locked_until": None, "last_error": error}
+        if dead:
+            values.update(status="dead", completed_at=datetime.utcnow())
+            logger.error("outbox job %s (%s) dead after %s attempts: %s", job.id, job.kind, job.attempts, error)
+        else:
+            values.update(status="pending", run_after=datetime.utcnow() + _backoff(job.attempts))
+            logger.warning("outbox job %s (%s) attempt %s failed: %s", job.id, job.kind, job.attempts, error)
+        with Session(engine) as session:
+            session.exec(
+                update(OutboxJob).where(OutboxJob.id == job.id, OutboxJob.status == "running").values(**values)
+            )
+            session.commit()
+        return dead
+
+    def stats(self) -> dict:
+        return {
+            "running": self._thread is not None,
+            "concurrency": self.concurrency,
+            "in_flight": self._in_flight,
+            "succeeded": self.succeeded,
+            "retried": self.retried,
+            "dead_lettered": self.dead_lettered,
+        }
+
+
+def claim_jobs(limit: int) -> list[OutboxJob]:
+    """Lease up to `limit` due jobs to this worker.
+
+    Each claim is a conditional UPDATE that re-checks the job is still
+    claimable, so concurrent workers can't take the same job.
+    """
+    now = datetime.utcnow()
+    claimable = or_(
+        and_(OutboxJob.status == "pending", OutboxJob.run_after <= now),
+        # Lease expired: the worker that held it stopped without reporting back
+        and_(OutboxJob.status == "running", OutboxJob.locked_until < now),
+    )
+    with Session(engine) as session:
+        candidates = session.exec(
+            select(OutboxJob.id).where(claimable).order_by(OutboxJob.run_after, OutboxJob.id).limit(limit)
+        ).all()
+        claimed = []
+        for job_id in candidates:
+            result = session.exec(
+                update(OutboxJob)
+                .where(OutboxJob.id == job_id, claimable)
+                .values(
+                    status="running",
+                    locked_until=now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+                    attempts=OutboxJob.attempts + 1,
+                )
+            )
+            if result.rowcount:
+                claimed.append(job_id)
+        session.commit()
+        if not claimed:
+            return []
+        jobs = session.exec(select(OutboxJob).where(OutboxJob.id.in_(claimed)).order_by(OutboxJob.id)).all()
+        for job in jobs:
+            session.expunge(job)
+        return jobs
+
+
+def run_job(job: OutboxJob) -> Optional[Iterable[tuple]]:
+    handler = _handlers.get(job.kind)
+    if handler is None:
+        raise LookupError(f"no handler registered for outbox job kind {job.kind!r}")
+    return handler(job.payload)
+
+
+def purge_finished(older_than_days: float = OUTBOX_RETENTION_DAYS) -> int:
+    """Delete completed jobs past the retention window (dead jobs are kept)."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    with Session(engine) as session:
+        result = session.exec(delete(OutboxJob).where(OutboxJob.status == "done", OutboxJob.completed_at < cutoff))
+        session.commit()
+        return result.rowcount
+
+
+# ==========================
+# ADMIN HELPERS
+# ==========================
+def status_counts(session: Session) -> dict:
+    rows = session.exec(select(OutboxJob.status, func.count()).group_by(OutboxJob.status)).all()
+    return {status: count for status, count in rows}
+
+
+def retry_job(session: Session, job_id: int) -> bool:
+    """Put a dead job back in the queue with a fresh set of attempts."""
+    result = session.exec(
+        update(OutboxJob)
+        .where(OutboxJob.id == job_id, OutboxJob.status == "dead")
+        .values(status="pending", attempts=0, run_after=datetime.utcnow(), completed_at=None)
+    )
+    session.commit()
+    _wakeup.set()
+    return bool(result.rowcount)
+
+
+# ==========================
+# JOB HANDLERS
+# ==========================
+def _invoice_data(payload_data: dict) -> dict:
+    invoice_data = dict(payload_data)
+    invoice_data["invoice_date"] = datetime.fromisoformat(invoice_data["invoice_date"])
+    return invoice_data
+
+
+@job_handler("email")
+def _send_email_job(payload: dict):
+    """Send one message; `invoice_attachment` attaches that invoice's PDF
+    (already rendered by the invoice job, so read from the cache)."""
+    message = dict(payload)
+    attachments = ()
+    invoice_attachment = message.pop("invoice_attachment", None)
+    if invoice_attachment:
+        invoice_data = _invoice_data(invoice_attachment)
+        pdf = invoice_pdf_bytes(invoice_data)
+        attachments = [attachment_part(f"invoice_{invoice_data['invoice_id']}.pdf", pdf)]
+    deliver(**message, attachments=attachments)
+
+
+@job_handler("invoice")
+def _invoice_job(payload: dict):
+    """Render the invoice PDF (cached, so once even across retries), then queue
+    one email job per customer message with it attached. Each message is sent
+    and retried on its own, so a failed send doesn't repeat the others."""
+    invoice_pdf_bytes(_invoice_data(payload["invoice_data"]))
+    return [("email", {**message, "invoice_attachment": payload["invoice_data"]}) for message in payload.get("emails", [])]
+
+
+outbox_worker = OutboxWorker()
+
+
+def main():
+    """Run the worker in the foreground until interrupted."""
+    # Modules that register handlers or periodic tasks with the outbox
+    from app.services import notification_digest  # noqa: F401
+
+    logging.basicConfig(level=logging.INFO)
+    outbox_worker.start()
+    logger.info("outbox worker running with concurrency %s", outbox_worker.concurrency)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        outbox_worker.stop()
+
+
+if __name__ == "__main__":
+    # Standalone worker process: `python -m app.services.outbox`. Delegate to
+    # the importable module so registrations made by other modules land in
+    # the same registries the worker reads.
+    from app.services import outbox
+    outbox.main()
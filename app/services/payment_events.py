@@ -0,0 +1,179 @@
+"""Push payment status changes to waiting clients.
+
+`GET /orders/{id}/mpesa/events` holds a server-sent-events stream open per
+waiting customer and subscribes it to that order here, so a confirmation
+reaches the browser as soon as it is committed instead of on the next poll.
+
+Handlers call `announce()` with the session that records the payment; the
+event goes out only if that transaction commits:
+
+- On PostgreSQL it is sent with `pg_notify` inside the transaction. Every API
+  process runs a `PaymentEventListener` that LISTENs on the channel and
+  delivers to its own subscribers, so it doesn't matter which worker the
+  provider's webhook hit.
+- Elsewhere (SQLite in development) it is delivered to this process's
+  subscribers after commit.
+"""
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+from collections import defaultdict
+from typing import Optional
+from fastapi.encoders import jsonable_encoder
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session as SASession
+from app.db.session import engine
+
+logger = logging.getLogger("morine.payments")
+
+PAYMENT_EVENTS_CHANNEL = os.getenv("PAYMENT_EVENTS_CHANNEL", "payment_status")
+
+
+def _use_notify() -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+# ==========================
+# IN-PROCESS PUB/SUB
+# ==========================
+class PaymentEventBus:
+    """Fan-out from any thread to asyncio queues, one per open stream."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # order id -> {queue: the event loop that owns it}
+        self._subscribers: dict[int, dict] = defaultdict(dict)
+        self.published = 0
+
+    def subscribe(self, order_id: int) -> asyncio.Queue:
+        """Queue receiving status dicts for `order_id`; call from the event loop."""
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers[order_id][queue] = asyncio.get_running_loop()
+        return queue
+
+    def unsubscribe(self, order_id: int, queue: asyncio.Queue):
+        with self._lock:
+            subscribers = self._subscribers.get(order_id)
+            if subscribers is not None:
+                subscribers.pop(queue, None)
+                if not subscribers:
+                    del self._subscribers[order_id]
+
+    def publish(self, order_id: int, status: dict):
+        with self._lock:
+            subscribers = list(self._subscribers.get(order_id, {}).items())
+        self.published += 1
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, status)
+            except RuntimeError:
+                # The subscriber's loop has closed
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            streams = sum(len(subscribers) for subscribers in self._subscribers.values())
+        return {"orders": len(self._subscribers), "streams": streams, "published": self.published}
+
+
+payment_events = PaymentEventBus()
+
+
+def payment_state(order) -> dict:
+    """What waiting clients are told about an order's payment; also the body of
+    `GET /orders/{id}/mpesa/status`."""
+    return {
+        "order_id": order.id,
+        "payment_status": order.payment_status,
+        "payment_verified": order.payment_verified,
+        "mpesa_request_id": order.mpesa_request_id,
+        "mpesa_code": order.mpesa_code,
+    }
+
+
+def announce(session: SASession, order_id: int, status: dict):
+    """Publish `status` for `order_id` once `session`'s transaction commits."""
+    message = {"order_id": order_id, "status": jsonable_encoder(status)}
+    if _use_notify():
+        session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": PAYMENT_EVENTS_CHANNEL, "payload": json.dumps(message)},
+        )
+    else:
+        session.info.setdefault("payment_events", []).append(message)
+
+
+@event.listens_for(SASession, "after_commit")
+def _publish_committed(session):
+    for message in session.info.pop("payment_events", ()):
+        payment_events.publish(message["order_id"], message["status"])
+
+
+@event.listens_for(SASession, "after_rollback")
+def _forget_uncommitted(session):
+    session.info.pop("payment_events", None)
+
+
+# ==========================
+# CROSS-PROCESS FAN-OUT
+# ==========================
+class PaymentEventListener:
+    """Background thread that LISTENs for payment notifications and publishes
+    them on the local bus. Reconnects with a short delay if the connection drops."""
+
+    def __init__(self, channel: str = PAYMENT_EVENTS_CHANNEL):
+        self.channel = channel
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._thread is not None or not _use_notify():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="payment-events", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("payment event listener failed; reconnecting")
+                self._stop.wait(2)
+
+    def _listen(self):
+        conn = engine.raw_connection()
+        try:
+            dbapi = conn.driver_connection
+            dbapi.autocommit = True
+            with dbapi.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            while not self._stop.is_set():
+                # Wake at least once a second to notice stop()
+                if select.select([dbapi], [], [], 1.0) == ([], [], []):
+                    continue
+                dbapi.poll()
+                while dbapi.notifies:
+                    notify = dbapi.notifies.pop(0)
+                    try:
+                        message = json.loads(notify.payload)
+                        payment_events.publish(int(message["order_id"]), message["status"])
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning("ignoring malformed payment event: %r", notify.payload)
+        finally:
+            # The connection was switched to autocommit/LISTEN; don't return it to the pool
+            conn.invalidate()
+
+
+payment_event_listener = PaymentEventListener()
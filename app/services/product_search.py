@@ -0,0 +1,243 @@
+"""Product search backends used by `GET /products/?search=`.
+
+On PostgreSQL, matching and ranking run in the database against the
+`product.search_vector` tsvector column (GIN-indexed) plus, when the pg_trgm
+extension is available, a trigram index on `product.name` for fuzzy matches;
+both are created in `app/db/init_db.py`.
+
+Any other database (e.g. SQLite in local development), or a Postgres database
+where the search column couldn't be created, falls back to an in-process
+inverted index built from the product table on first use and kept up to date
+by the product router. That index is per process, so it is meant for
+single-worker development setups.
+"""
+import math
+import re
+import threading
+from typing import Optional
+from bisect import bisect_left
+from collections import defaultdict
+from sqlalchemy import Float, Numeric, case, cast, false, func, literal, literal_column, or_, text
+from sqlmodel import Session, select
+from app.db.session import engine
+from app.models.models import Product
+
+TS_CONFIG = "english"
+# Ranks are rounded to this many decimals in SQL so the value in a cursor
+# compares equal to the row it came from
+RANK_DECIMALS = 6
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def is_postgres() -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+# "fulltext+trigram", "fulltext" or "fallback"; set on first use
+_backend: Optional[str] = None
+
+
+def detect_backend() -> str:
+    """Choose the search backend from what exists in the database."""
+    global _backend
+    backend = "fallback"
+    if is_postgres():
+        try:
+            with engine.connect() as conn:
+                has_vector = conn.execute(
+                    text(
+                        "SELECT 1 FROM information_schema.columns "
+                        "WHERE table_name = 'product' AND column_name = 'search_vector'"
+                    )
+                ).first()
+                has_trigram = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+            if has_vector:
+                backend = "fulltext+trigram" if has_trigram else "fulltext"
+        except Exception:
+            print("Warning: could not inspect product search setup; using the in-process index")
+    _backend = backend
+    return backend
+
+
+def backend() -> str:
+    return _backend or detect_backend()
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+# ==========================
+# POSTGRES BACKEND
+# ==========================
+def _prefix_tsquery(terms: list[str]) -> str:
+    """AND all terms together, treating the last one as a prefix so partially
+    typed words still match (`gyp` -> `gyp:*`)."""
+    return " & ".join(terms[:-1] + [f"{terms[-1]}:*"])
+
+
+def _postgres_search(term: str, trigram: bool):
+    terms = tokenize(term)
+    if not terms:
+        return false(), literal(0.0)
+    search_vector = literal_column("product.search_vector")
+    tsquery = func.to_tsquery(TS_CONFIG, _prefix_tsquery(terms))
+    where = search_vector.op("@@")(tsquery)
+    # Name matches are weighted 'A' in the vector so they rank above
+    # description-only matches
+    rank = func.ts_rank(search_vector, tsquery)
+    if trigram:
+        # `%` is pg_trgm's similarity operator (threshold `pg_trgm.similarity_threshold`,
+        # 0.3 by default); unlike `similarity() >= x` it can use the trigram index.
+        # Trigram similarity lifts close misspellings.
+        where = or_(where, Product.name.op("%")(term))
+        rank = rank + func.similarity(Product.name, term)
+    # ts_rank/similarity are float4; a fixed-precision float8 survives the
+    # round trip through the JSON cursor unchanged
+    return where, cast(func.round(cast(rank, Numeric), RANK_DECIMALS), Float)
+
+
+# ==========================
+# IN-PROCESS FALLBACK
+# ==========================
+class InvertedIndex:
+    """Token -> product id postings over product names and descriptions."""
+
+    NAME_WEIGHT = 2.0
+    DESCRIPTION_WEIGHT = 1.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._postings: dict[str, dict[int, float]] = defaultdict(dict)
+        self._doc_tokens: dict[int, set[str]] = {}
+        self._vocabulary: list[str] = []  # sorted, for prefix lookups
+        self._vocabulary_dirty = False
+
+    def __len__(self):
+        return len(self._doc_tokens)
+
+    def _add(self, product_id: int, name: str, description: str):
+        weights: dict[str, float] = defaultdict(float)
+        for token in tokenize(description):
+            weights[token] = max(weights[token], self.DESCRIPTION_WEIGHT)
+        for token in tokenize(name):
+            weights[token] = self.NAME_WEIGHT
+        for token, weight in weights.items():
+            self._postings[token][product_id] = weight
+        self._doc_tokens[product_id] = set(weights)
+        self._vocabulary_dirty = True
+
+    def _remove(self, product_id: int):
+        for token in self._doc_tokens.pop(product_id, ()):
+            postings = self._postings.get(token)
+            if postings is not None:
+                postings.pop(product_id, None)
+                if not postings:
+                    del self._postings[token]
+        self._vocabulary_dirty = True
+
+    def upsert(self, product_id: int, name: str, description: str):
+        with self._lock:
+            self._remove(product_id)
+            self._add(product_id, name, description)
+
+    def remove(self, product_id: int):
+        with self._lock:
+            self._remove(product_id)
+
+    def _expand_prefix(self, prefix: str) -> list[str]:
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        start = bisect_left(self._vocabulary, prefix)
+        matches = []
+        for token in self._vocabulary[start:]:
+            if not token.startswith(prefix):
+                break
+            matches.append(token)
+        return matches
+
+    def search(self, term: str) -> dict[int, float]:
+        """Return {product_id: score} for products matching every query term.
+
+        The last term matches as a prefix. Scores are weight * idf summed over
+        terms, so rare words and name hits rank highest.
+        """
+        terms = tokenize(term)
+        if not terms:
+            return {}
+        with self._lock:
+            total = len(self._doc_tokens) or 1
+            scores: Optional[dict[int, float]] = None
+            for i, query_term in enumerate(terms):
+                tokens = self._expand_prefix(query_term) if i == len(terms) - 1 else [query_term]
+                term_scores: dict[int, float] = {}
+                for token in tokens:
+                    postings = self._postings.get(token, {})
+                    idf = math.log(1 + total / (1 + len(postings)))
+                    for product_id, weight in postings.items():
+                        term_scores[product_id] = max(term_scores.get(product_id, 0.0), weight * idf)
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {pid: s + term_scores[pid] for pid, s in scores.items() if pid in term_scores}
+                if not scores:
+                    return {}
+            return scores
+
+
+_index = InvertedIndex()
+_index_loaded = False
+_load_lock = threading.Lock()
+
+
+def _ensure_index_loaded(session: Session):
+    global _index_loaded
+    if _index_loaded:
+        return
+    with _load_lock:
+        if _index_loaded:
+            return
+        rows = session.exec(select(Product.id, Product.name, Product.description)).all()
+        for product_id, name, description in rows:
+            _index.upsert(product_id, name, description)
+        _index_loaded = True
+
+
+def _fallback_search(session: Session, term: str):
+    _ensure_index_loaded(session)
+    scores = _index.search(term)
+    if not scores:
+        return false(), literal(0.0)
+    rank = case({product_id: round(score, RANK_DECIMALS) for product_id, score in scores.items()}, value=Product.id, else_=0.0)
+    return Product.id.in_(scores), rank
+
+
+# ==========================
+# PUBLIC API
+# ==========================
+def search_clauses(session: Session, term: str):
+    """Return `(where_clause, rank_expression)` for a product search term.
+
+    `where_clause` restricts a `select(Product)` to matches and
+    `rank_expression` orders them by relevance (higher is better).
+    """
+    current = backend()
+    if current != "fallback":
+        return _postgres_search(term, trigram=current == "fulltext+trigram")
+    return _fallback_search(session, term)
+
+
+def index_product(product: Product):
+    """Refresh a created/updated product in the in-process index (no-op when it
+    isn't loaded, e.g. on Postgres where the tsvector column is maintained by the
+    database)."""
+    if _index_loaded:
+        _index.upsert(product.id, product.name, product.description)
+
+
+def remove_product(product_id: int):
+    """Drop a deleted product from the in-process index."""
+    if _index_loaded:
+        _index.remove(product_id)
@@ -0,0 +1,145 @@
+"""Pre-serialized JSON bodies for hot catalog reads.
+
+Entries hold the encoded JSON bytes for one query shape (plus gzip and, when
+the optional `brotli` package is installed, brotli variants built on first
+request) tagged with the catalog version they were rendered from. A lookup
+with a different version is a miss, so any catalog write or snapshot reload
+in `app/services/catalog_cache.py` retires every stored body at once.
+
+Each encoding is its own representation, so it gets its own strong ETag
+(`"<hash>-gzip"`, `"<hash>-br"`), and responses carry `Vary: Accept-Encoding`.
+"""
+import gzip
+import json
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Optional
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from app.utils.http_cache import body_etag, cache_headers, is_not_modified, not_modified_response
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "256"))
+# Bodies smaller than this aren't worth compressing
+COMPRESS_MIN_BYTES = 1024
+
+
+class _Entry:
+    __slots__ = ("version", "body", "encoded", "etag", "last_modified")
+
+    def __init__(self, version: Optional[int], body: bytes, last_modified: Optional[datetime]):
+        self.version = version
+        self.body = body
+        self.encoded: dict[str, bytes] = {}
+        self.etag = body_etag(body)
+        self.last_modified = last_modified
+
+
+def _pick_encoding(request: Request) -> Optional[str]:
+    accept = request.headers.get("accept-encoding", "")
+    offered = {part.split(";")[0].strip().lower() for part in accept.split(",")}
+    if brotli is not None and "br" in offered:
+        return "br"
+    if "gzip" in offered:
+        return "gzip"
+    return None
+
+
+def _variant_etag(etag: str, encoding: Optional[str]) -> str:
+    return etag if encoding is None else f'{etag[:-1]}-{encoding}"'
+
+
+def _encode(content) -> bytes:
+    return json.dumps(jsonable_encoder(content), separators=(",", ":")).encode("utf-8")
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, _Entry]" = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+    def _respond(self, entry: _Entry, request: Request) -> Response:
+        body = entry.body
+        encoding = _pick_encoding(request) if len(body) >= COMPRESS_MIN_BYTES else None
+        etag = _variant_etag(entry.etag, encoding)
+        if is_not_modified(request, etag, entry.last_modified):
+            response = not_modified_response(etag, entry.last_modified)
+            response.headers["Vary"] = "Accept-Encoding"
+            return response
+        headers = {"Vary": "Accept-Encoding", **cache_headers(etag, entry.last_modified)}
+        if entry.version is not None:
+            headers["X-Catalog-Version"] = str(entry.version)
+        if encoding:
+            compressed = entry.encoded.get(encoding)
+            if compressed is None:
+                compressed = entry.encoded[encoding] = _compress(body, encoding)
+            body = compressed
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def lookup(self, key: tuple, version: int, request: Request) -> Optional[Response]:
+        """Serve the stored body for `key` if it was rendered at `version`
+        (or a 304 when the client's validators still match it)."""
+        if not RESPONSE_CACHE_ENABLED:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.version != version:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return self._respond(entry, request)
+
+    def store(
+        self,
+        key: tuple,
+        version: int,
+        content,
+        request: Request,
+        last_modified: Optional[datetime] = None,
+    ) -> Response:
+        """Encode `content` once, keep the bytes for `key`, and return the response."""
+        entry = _Entry(version, _encode(content), last_modified)
+        if RESPONSE_CACHE_ENABLED:
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return self._respond(entry, request)
+
+    def render(self, content, request: Request, last_modified: Optional[datetime] = None) -> Response:
+        """Encode `content` and respond with the same validators and
+        compression as a stored body, without keeping it. For reads the
+        catalog snapshot can't answer."""
+        return self._respond(_Entry(None, _encode(content), last_modified), request)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": RESPONSE_CACHE_ENABLED,
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "brotli": brotli is not None,
+        }
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,208 @@
+"""Daily sales rollup behind `GET /admin/stats`.
+
+`DailySalesRollup` holds order count, items sold and revenue per
+(day, status, product). Order handlers apply their change to it in the
+same transaction as the order itself:
+
+- `add_order(session, order, lines)` when an order is placed, and with
+  `sign=-1` when it is deleted;
+- `change_status(session, order, lines, old_status)` when its status moves,
+  which shifts its figures from the old status bucket to the new one.
+
+Deltas are applied with `INSERT ... ON CONFLICT DO UPDATE`, so each change
+touches one row per product plus one totals row. Rows are written in key
+order so concurrent orders lock them in the same order.
+
+The dashboard then sums a few hundred rows instead of every order.
+`rebuild()` recomputes the table from the orders. It runs at startup when
+the table is empty and is exposed as `POST /admin/stats/rebuild`.
+"""
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+from sqlalchemy import Date, delete, func, insert, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlmodel import Session, select
+from app.models.models import DailySalesRollup, Order, OrderItem, Product
+
+# `product_id` of the whole-order totals rows
+ORDER_TOTALS = 0
+INSERT_BATCH_SIZE = 500
+
+_KEY = ("day", "status", "product_id")
+_MEASURES = ("orders", "items_sold", "revenue")
+
+
+def _order_day(order: Order) -> date:
+    return (order.created_at or datetime.utcnow()).date()
+
+
+def _order_revenue(order: Order) -> float:
+    return order.total_amount if order.total_amount is not None else (order.total_price or 0.0)
+
+
+def order_lines(session: Session, order_id: int) -> list[tuple]:
+    """(product_id, quantity, price) for each item of the order."""
+    return session.exec(
+        select(OrderItem.product_id, OrderItem.quantity, OrderItem.price).where(OrderItem.order_id == order_id)
+    ).all()
+
+
+def _deltas(order: Order, status: str, lines: Iterable[tuple], sign: int) -> dict[tuple, dict]:
+    day = _order_day(order)
+    lines = list(lines)
+    deltas = {
+        (day, status, ORDER_TOTALS): {
+            "orders": sign,
+            "items_sold": sign * sum(quantity for _, quantity, _ in lines),
+            "revenue": sign * _order_revenue(order),
+        }
+    }
+    for product_id, quantity, price in lines:
+        if product_id is None:
+            continue
+        delta = deltas.setdefault((day, status, product_id), {"orders": 0, "items_sold": 0, "revenue": 0.0})
+        # An order counts once per product even if the product is on several lines
+        delta["orders"] = sign
+        delta["items_sold"] += sign * quantity
+        delta["revenue"] += sign * quantity * price
+    return deltas
+
+
+def _apply(session: Session, deltas: dict[tuple, dict]):
+    rows = [dict(zip(_KEY, key), **deltas[key]) for key in sorted(deltas)]
+    table = DailySalesRollup.__table__
+    dialect = session.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        stmt = dialect_insert(table).values(rows)
+        session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=list(_KEY),
+                set_={name: table.c[name] + stmt.excluded[name] for name in _MEASURES},
+            )
+        )
+        return
+    for row in rows:
+        match = [table.c[name] == row[name] for name in _KEY]
+        result = session.execute(
+            update(table).where(*match).values({name: table.c[name] + row[name] for name in _MEASURES})
+        )
+        if result.rowcount == 0:
+            session.execute(insert(table).values(row))
+
+
+def add_order(session: Session, order: Order, lines: Iterable[tuple], sign: int = 1):
+    """Count a new order (or, with `sign=-1`, remove a deleted one)."""
+    _apply(session, _deltas(order, order.status, lines, sign))
+
+
+def change_status(session: Session, order: Order, lines: Iterable[tuple], old_status: str):
+    """Move an order's figures from `old_status` to its current status."""
+    if old_status == order.status:
+        return
+    lines = list(lines)
+    deltas = _deltas(order, old_status, lines, -1)
+    deltas.update(_deltas(order, order.status, lines, 1))
+    _apply(session, deltas)
+
+
+def rebuild(session: Session) -> int:
+    """Recompute the whole rollup from the orders; returns the number of rows."""
+    day = func.date(Order.created_at, type_=Date)
+    rows: dict[tuple, dict] = {}
+    totals = session.exec(
+        select(
+            day,
+            Order.status,
+            func.count(Order.id),
+            func.coalesce(func.sum(func.coalesce(Order.total_amount, Order.total_price)), 0.0),
+        ).group_by(day, Order.status)
+    ).all()
+    for order_day, status, orders, revenue in totals:
+        rows[(order_day, status, ORDER_TOTALS)] = {"orders": orders, "items_sold": 0, "revenue": revenue}
+    lines = session.exec(
+        select(
+            day,
+            Order.status,
+            OrderItem.product_id,
+            func.count(func.distinct(Order.id)),
+            func.sum(OrderItem.quantity),
+            func.sum(OrderItem.quantity * OrderItem.price),
+        )
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .group_by(day, Order.status, OrderItem.product_id)
+    ).all()
+    for order_day, status, product_id, orders, quantity, revenue in lines:
+        rows[(order_day, status, ORDER_TOTALS)]["items_sold"] += quantity or 0
+        if product_id is not None:
+            rows[(order_day, status, product_id)] = {"orders": orders, "items_sold": quantity or 0, "revenue": revenue or 0.0}
+
+    session.execute(delete(DailySalesRollup))
+    batch = [dict(zip(_KEY, key), **measures) for key, measures in sorted(rows.items())]
+    for start in range(0, len(batch), INSERT_BATCH_SIZE):
+        session.execute(insert(DailySalesRollup), batch[start:start + INSERT_BATCH_SIZE])
+    session.commit()
+    return len(batch)
+
+
+def ensure_built(session: Session) -> Optional[int]:
+    """Build the rollup if it is empty but orders exist (first start after upgrading)."""
+    if session.exec(select(DailySalesRollup.id).limit(1)).first() is not None:
+        return None
+    if session.exec(select(Order.id).limit(1)).first() is None:
+        return None
+    return rebuild(session)
+
+
+def dashboard(session: Session, days: int = 30, low_stock: int = 10, top: int = 10) -> dict:
+    """Figures for the admin dashboard, read from the rollup and the product table."""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    rollup = DailySalesRollup
+
+    by_status = {
+        status: {"orders": orders, "items_sold": items_sold, "revenue": revenue}
+        for status, orders, items_sold, revenue in session.exec(
+            select(rollup.status, func.sum(rollup.orders), func.sum(rollup.items_sold), func.sum(rollup.revenue))
+            .where(rollup.product_id == ORDER_TOTALS)
+            .group_by(rollup.status)
+        ).all()
+        if orders
+    }
+    daily = [
+        {"day": day, "orders": orders, "items_sold": items_sold, "revenue": revenue}
+        for day, orders, items_sold, revenue in session.exec(
+            select(rollup.day, func.sum(rollup.orders), func.sum(rollup.items_sold), func.sum(rollup.revenue))
+            .where(rollup.product_id == ORDER_TOTALS, rollup.day >= since)
+            .group_by(rollup.day)
+            .order_by(rollup.day)
+        ).all()
+    ]
+    items_sold = func.sum(rollup.items_sold)
+    top_products = [
+        {"product_id": product_id, "name": name, "items_sold": sold, "revenue": revenue}
+        for product_id, name, sold, revenue in session.exec(
+            select(rollup.product_id, Product.name, items_sold, func.sum(rollup.revenue))
+            .outerjoin(Product, Product.id == rollup.product_id)
+            .where(rollup.product_id != ORDER_TOTALS, rollup.day >= since, rollup.status != "cancelled")
+            .group_by(rollup.product_id, Product.name)
+            .having(items_sold > 0)
+            .order_by(items_sold.desc())
+            .limit(top)
+        ).all()
+    ]
+    products, low = session.exec(
+        select(func.count(Product.id), func.count(Product.id).filter(Product.stock_quantity < low_stock))
+    ).one()
+
+    return {
+        "totals": {
+            "orders": sum(s["orders"] for s in by_status.values()),
+            "items_sold": sum(s["items_sold"] for s in by_status.values()),
+            "revenue": sum(s["revenue"] for s in by_status.values()),
+        },
+        "by_status": by_status,
+        "daily": daily,
+        "top_products": top_products,
+        "products": {"total": products, "low_stock": low, "low_stock_threshold": low_stock},
+        "window": {"start": since, "days": days},
+    }
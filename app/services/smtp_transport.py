@@ -0,0 +1,178 @@
+"""Pooled SMTP connections for `app/services/email_service.py`.
+
+Opening a session to Gmail costs a TCP connect, STARTTLS and AUTH, which is
+most of the time spent sending a short notification. `SMTPTransport` keeps a
+few authenticated sessions open and reuses them:
+
+- idle sessions older than `SMTP_IDLE_SECONDS` are closed instead of reused
+  (servers drop quiet connections, usually after a few minutes);
+- a session is retired after `SMTP_MAX_MESSAGES_PER_CONNECTION` messages;
+- a send that fails because the server dropped the connection is retried
+  once on a fresh session. Other SMTP errors (rejected recipient, bad
+  credentials) propagate to the caller.
+"""
+import os
+import smtplib
+import threading
+import time
+from collections import deque
+from email.message import Message
+from typing import Optional
+
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+SMTP_IDLE_SECONDS = float(os.getenv("SMTP_IDLE_SECONDS", "60"))
+SMTP_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_MAX_MESSAGES_PER_CONNECTION", "100"))
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+
+# The connection itself is gone; the message can safely be sent again
+_CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, ConnectionError, TimeoutError)
+
+
+class _Connection:
+    __slots__ = ("smtp", "sent", "last_used")
+
+    def __init__(self, smtp: smtplib.SMTP):
+        self.smtp = smtp
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+    def close(self):
+        try:
+            self.smtp.quit()
+        except Exception:
+            self.smtp.close()
+
+
+class SMTPTransport:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        username: Optional[str],
+        password: Optional[str],
+        starttls: bool = True,
+        pool_size: int = SMTP_POOL_SIZE,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.pool_size = pool_size
+        self._idle: deque[_Connection] = deque()
+        self._lock = threading.Lock()
+        # Bounds the number of open sessions, idle or in use
+        self._slots = threading.BoundedSemaphore(pool_size)
+        self.connects = 0
+        self.messages = 0
+
+    def _connect(self) -> _Connection:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT_SECONDS)
+        try:
+            if self.starttls:
+                smtp.starttls()
+            if self.username and self.password:
+                smtp.login(self.username, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self.connects += 1
+        return _Connection(smtp)
+
+    def _checkout(self) -> _Connection:
+        """Most recently used idle session that is still fresh, or a new one."""
+        while True:
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            if conn is None:
+                return self._connect()
+            if time.monotonic() - conn.last_used <= SMTP_IDLE_SECONDS:
+                return conn
+            conn.close()
+
+    def _checkin(self, conn: _Connection):
+        conn.last_used = time.monotonic()
+        if conn.sent >= SMTP_MAX_MESSAGES_PER_CONNECTION:
+            conn.close()
+            return
+        with self._lock:
+            self._idle.append(conn)
+
+    def _send_on(self, conn: _Connection, message: Message):
+        conn.smtp.send_message(message)
+        conn.sent += 1
+        self.messages += 1
+
+    def send_many(self, messages: list[Message]) -> list[Optional[Exception]]:
+        """Send `messages` over one pooled session, in order.
+
+        Returns one entry per message: None if it was accepted, otherwise the
+        exception it failed with. A dropped connection is re-established once
+        per message.
+        """
+        results: list[Optional[Exception]] = []
+        with self._slots:
+            conn: Optional[_Connection] = None
+            try:
+                for message in messages:
+                    for attempt in range(2):
+                        try:
+                            if conn is None:
+                                conn = self._checkout()
+                            self._send_on(conn, message)
+                            results.append(None)
+                            break
+                        except _CONNECTION_ERRORS as exc:
+                            if conn is not None:
+                                conn.smtp.close()
+                                conn = None
+                            if attempt == 1:
+                                results.append(exc)
+                        except smtplib.SMTPException as exc:
+                            # Rejected by the server; the session is still usable
+                            # unless it was the connect/login itself that failed
+                            results.append(exc)
+                            break
+            finally:
+                if conn is not None:
+                    self._checkin(conn)
+        return results
+
+    def send(self, message: Message):
+        """Send one message, raising if it isn't accepted."""
+        error = self.send_many([message])[0]
+        if error is not None:
+            raise error
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> dict:
+        return {
+            "host": self.host,
+            "pool_size": self.pool_size,
+            "idle": len(self._idle),
+            "connects": self.connects,
+            "messages": self.messages,
+        }
+
+
+_transport: Optional[SMTPTransport] = None
+_transport_lock = threading.Lock()
+
+
+def get_transport(host: str, port: int, username: Optional[str], password: Optional[str], starttls: bool = True) -> SMTPTransport:
+    """Shared transport for the given settings; replaced if the settings change."""
+    global _transport
+    with _transport_lock:
+        current = _transport
+        if current is None or (current.host, current.port, current.username, current.password, current.starttls) != (
+            host, port, username, password, starttls
+        ):
+            if current is not None:
+                current.close()
+            _transport = SMTPTransport(host, port, username, password, starttls)
+        return _transport
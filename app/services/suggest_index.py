@@ -0,0 +1,136 @@
+"""In-memory typeahead index behind `GET /products/suggest`.
+
+Product and category names are stored as a sorted array of lowercase keys so
+a prefix lookup is one `bisect` plus a short forward scan. Every word of a
+name gets its own key ("gypsum board" is found by both "gyp" and "boa").
+
+The index is built from the database on first use and patched in place by
+the product and category routers. Each worker process holds its own copy, so
+it is also fully rebuilt every `SUGGEST_REBUILD_SECONDS` to pick up writes
+handled by other workers.
+"""
+import os
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from sqlmodel import Session, select
+from app.models.models import Category, Product
+
+SUGGEST_REBUILD_SECONDS = float(os.getenv("SUGGEST_REBUILD_SECONDS", "300"))
+# Upper bound on keys inspected per lookup so one-letter prefixes stay cheap
+MAX_SCAN = 200
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def _normalize(text: str) -> str:
+    return " ".join(_WORD_RE.findall((text or "").lower()))
+
+
+class SuggestIndex:
+    """Sorted (key, kind, id, display name) entries with per-item key lists for removal."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: list[tuple[str, str, int, str]] = []
+        self._keys_by_item: dict[tuple[str, int], list[str]] = {}
+
+    def __len__(self):
+        return len(self._keys_by_item)
+
+    def _remove(self, kind: str, item_id: int):
+        for key in self._keys_by_item.pop((kind, item_id), ()):
+            i = bisect_left(self._entries, (key, kind, item_id))
+            if i < len(self._entries) and self._entries[i][:3] == (key, kind, item_id):
+                del self._entries[i]
+
+    def _add(self, kind: str, item_id: int, name: str):
+        words = _normalize(name).split()
+        keys = [" ".join(words[i:]) for i in range(len(words))]
+        for key in keys:
+            insort(self._entries, (key, kind, item_id, name))
+        self._keys_by_item[(kind, item_id)] = keys
+
+    def upsert(self, kind: str, item_id: int, name: str):
+        with self._lock:
+            self._remove(kind, item_id)
+            self._add(kind, item_id, name)
+
+    def remove(self, kind: str, item_id: int):
+        with self._lock:
+            self._remove(kind, item_id)
+
+    def replace_all(self, items):
+        """Rebuild from an iterable of (kind, id, name) in one sort."""
+        entries = []
+        keys_by_item = {}
+        for kind, item_id, name in items:
+            words = _normalize(name).split()
+            keys = [" ".join(words[i:]) for i in range(len(words))]
+            entries.extend((key, kind, item_id, name) for key in keys)
+            keys_by_item[(kind, item_id)] = keys
+        entries.sort()
+        with self._lock:
+            self._entries = entries
+            self._keys_by_item = keys_by_item
+
+    def lookup(self, prefix: str, limit: int) -> list[dict]:
+        """Return up to `limit` items whose name has a word starting with `prefix`.
+
+        Names that start with the prefix come before mid-name word matches.
+        """
+        prefix = _normalize(prefix)
+        if not prefix:
+            return []
+        leading, inner, seen = [], [], set()
+        # upsert/remove edit `_entries` in place, so read it under the same
+        # lock; the scan is bounded by MAX_SCAN
+        with self._lock:
+            start = bisect_left(self._entries, (prefix,))
+            for key, kind, item_id, name in self._entries[start:start + MAX_SCAN]:
+                if not key.startswith(prefix):
+                    break
+                if (kind, item_id) in seen:
+                    continue
+                seen.add((kind, item_id))
+                is_leading = self._keys_by_item.get((kind, item_id), [None])[0] == key
+                (leading if is_leading else inner).append({"type": kind, "id": item_id, "name": name})
+        return (leading + inner)[:limit]
+
+
+_index = SuggestIndex()
+_built_at = None
+_build_lock = threading.Lock()
+
+
+def _rebuild(session: Session):
+    global _built_at
+    products = session.exec(select(Product.id, Product.name)).all()
+    categories = session.exec(select(Category.id, Category.name)).all()
+    _index.replace_all(
+        [("product", pid, name) for pid, name in products]
+        + [("category", cid, name) for cid, name in categories]
+    )
+    _built_at = time.monotonic()
+
+
+def suggest(session: Session, prefix: str, limit: int = 10) -> list[dict]:
+    """Prefix suggestions for product and category names."""
+    if _built_at is None or time.monotonic() - _built_at > SUGGEST_REBUILD_SECONDS:
+        with _build_lock:
+            if _built_at is None or time.monotonic() - _built_at > SUGGEST_REBUILD_SECONDS:
+                _rebuild(session)
+    return _index.lookup(prefix, limit)
+
+
+def index_item(kind: str, item_id: int, name: str):
+    """Add or rename a product/category after a write (no-op before the first build)."""
+    if _built_at is not None:
+        _index.upsert(kind, item_id, name)
+
+
+def remove_item(kind: str, item_id: int):
+    """Drop a deleted product/category (no-op before the first build)."""
+    if _built_at is not None:
+        _index.remove(kind, item_id)
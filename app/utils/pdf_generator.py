@@ -1,16 +1,59 @@
 # app/utils/pdf_generator.py
+import glob
+import hashlib
+import io
+import json
 import os
+import tempfile
 from datetime import datetime
+from typing import Optional
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import mm
 from reportlab.lib import colors
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
 from reportlab.lib.styles import getSampleStyleSheet
 
+# Rendered invoices are stored outside app/static, which is publicly mounted
+INVOICE_STORAGE_DIR = os.getenv("INVOICE_STORAGE_DIR", "app/storage/invoices")
 
-def generate_invoice_pdf(invoice_data: dict, output_dir: str = "app/static/invoices") -> str:
+# Built once; ReportLab only reads styles while laying out a document
+STYLES = getSampleStyleSheet()
+ITEMS_COL_WIDTHS = [70*mm, 30*mm, 35*mm, 35*mm]
+ITEMS_TABLE_STYLE = TableStyle([
+    ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#2E8B57")),  # header
+    ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
+    ("ALIGN", (1, 1), (-1, -1), "CENTER"),
+    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+    ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+    ("BACKGROUND", (0, 1), (-1, -2), colors.whitesmoke),
+    ("BACKGROUND", (-2, -1), (-1, -1), colors.beige),
+    ("FONTNAME", (0, -1), (-1, -1), "Helvetica-Bold"),
+])
+
+
+def invoice_content_hash(invoice_data: dict) -> str:
+    """Short hash of everything printed on the invoice. Any change to the
+    items, totals or customer details gives a different hash."""
+    canonical = json.dumps(invoice_data, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def _shard(invoice_id: int) -> str:
+    """Two directory levels from a hash of the id, e.g. `3f/a2`, so no single
+    directory grows past a few hundred files. All versions of one invoice
+    share a directory."""
+    digest = hashlib.sha1(str(invoice_id).encode("ascii")).hexdigest()
+    return os.path.join(digest[:2], digest[2:4])
+
+
+def invoice_pdf_path(invoice_id: int, content_hash: str, output_dir: str = INVOICE_STORAGE_DIR) -> str:
+    """Path `save_invoice_pdf` stores this version of the invoice at."""
+    return os.path.join(output_dir, _shard(invoice_id), f"invoice_{invoice_id}_{content_hash}.pdf")
+
+
+def render_invoice_pdf(invoice_data: dict) -> bytes:
     """
-    Generate an invoice PDF and return its file path.
+    Render an invoice PDF in memory and return its bytes.
     invoice_data should include:
     - invoice_id
     - customer_name
@@ -20,14 +63,63 @@ def generate_invoice_pdf(invoice_data: dict, output_dir: str = "app/static/invoi
     - total_price
     - invoice_date
     """
+    buffer = io.BytesIO()
+    _build_invoice(invoice_data, buffer)
+    return buffer.getvalue()
+
+
+def load_invoice_pdf(invoice_id: int, content_hash: str, output_dir: str = INVOICE_STORAGE_DIR) -> Optional[bytes]:
+    """Stored bytes of this version of the invoice, or None if it was never saved."""
+    try:
+        with open(invoice_pdf_path(invoice_id, content_hash, output_dir), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def save_invoice_pdf(invoice_id: int, content_hash: str, data: bytes, output_dir: str = INVOICE_STORAGE_DIR) -> str:
+    """Store a rendered invoice and drop older versions of it. Returns the path."""
+    file_path = invoice_pdf_path(invoice_id, content_hash, output_dir)
+    directory = os.path.dirname(file_path)
+    os.makedirs(directory, exist_ok=True)
+
+    # Write to a temp file and rename, so a concurrent reader never sees a partial PDF
+    fd, tmp_path = tempfile.mkstemp(suffix=".pdf.tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    for stale in glob.glob(os.path.join(directory, f"invoice_{invoice_id}_*.pdf")):
+        if stale != file_path:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+    return file_path
+
+
+def generate_invoice_pdf(invoice_data: dict, output_dir: str = INVOICE_STORAGE_DIR) -> str:
+    """
+    Generate an invoice PDF on disk and return its file path.
+    Stored files are keyed by content hash: if this exact invoice was saved
+    before, its path is returned without rendering it again.
+    """
+    invoice_id = invoice_data["invoice_id"]
+    content_hash = invoice_content_hash(invoice_data)
+    file_path = invoice_pdf_path(invoice_id, content_hash, output_dir)
+    if os.path.exists(file_path):
+        return file_path
+    return save_invoice_pdf(invoice_id, content_hash, render_invoice_pdf(invoice_data), output_dir)
 
-    os.makedirs(output_dir, exist_ok=True)
-    filename = f"invoice_{invoice_data['invoice_id']}.pdf"
-    file_path = os.path.join(output_dir, filename)
 
-    # Set up PDF document
-    doc = SimpleDocTemplate(file_path, pagesize=A4)
-    styles = getSampleStyleSheet()
+def _build_invoice(invoice_data: dict, target):
+    # Set up PDF document; `target` is a path or a binary file object
+    doc = SimpleDocTemplate(target, pagesize=A4)
+    styles = STYLES
     elements = []
 
     # Header section
@@ -58,17 +150,8 @@ def generate_invoice_pdf(invoice_data: dict, output_dir: str = "app/static/invoi
     table_data.append(["", "", "<b>Total:</b>", f"<b>{invoice_data['total_price']:.2f}</b>"])
 
     # Table design
-    table = Table(table_data, colWidths=[70*mm, 30*mm, 35*mm, 35*mm])
-    table.setStyle(TableStyle([
-        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#2E8B57")),  # header
-        ("TEXTCOLOR", (0, 0), (-1, 0), colors.whitesmoke),
-        ("ALIGN", (1, 1), (-1, -1), "CENTER"),
-        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-        ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
-        ("BACKGROUND", (0, 1), (-1, -2), colors.whitesmoke),
-        ("BACKGROUND", (-2, -1), (-1, -1), colors.beige),
-        ("FONTNAME", (0, -1), (-1, -1), "Helvetica-Bold"),
-    ]))
+    table = Table(table_data, colWidths=ITEMS_COL_WIDTHS)
+    table.setStyle(ITEMS_TABLE_STYLE)
     elements.append(table)
     elements.append(Spacer(1, 15))
 
@@ -79,4 +162,3 @@ def generate_invoice_pdf(invoice_data: dict, output_dir: str = "app/static/invoi
 
     # Build PDF
     doc.build(elements)
-    return file_path
@@ -0,0 +1,60 @@
+import html
+import os
+import threading
+from string import Formatter
+from typing import Optional
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates")
+
+_formatter = Formatter()
+
+
+class Safe(str):
+    """Markup that templates insert without escaping (e.g. pre-rendered rows)."""
+
+
+class Template:
+    """A `str.format`-style template parsed once into literal and field segments.
+
+    `render(context)` looks fields up in the context dict (`{order[id]}` and
+    `{amount:,.2f}` work as in `str.format`) and HTML-escapes each value unless
+    the template is plain text or the value is `Safe`.
+    """
+
+    def __init__(self, source: str, escape: bool = True):
+        self.escape = escape
+        self._segments: list[tuple[str, Optional[str], str, Optional[str]]] = []
+        for literal, field, spec, conversion in _formatter.parse(source):
+            if field is not None and (not field or field.isdigit()):
+                raise ValueError("templates only support named fields")
+            if spec and "{" in spec:
+                raise ValueError("nested fields in format specs are not supported")
+            self._segments.append((literal, field, spec or "", conversion))
+
+    def render(self, context: dict) -> str:
+        parts = []
+        for literal, field, spec, conversion in self._segments:
+            parts.append(literal)
+            if field is None:
+                continue
+            value, _ = _formatter.get_field(field, (), context)
+            if conversion:
+                value = _formatter.convert_field(value, conversion)
+            text = format(value, spec)
+            parts.append(html.escape(text) if self.escape and not isinstance(value, Safe) else text)
+        return "".join(parts)
+
+
+_cache: dict[str, Template] = {}
+_cache_lock = threading.Lock()
+
+
+def get_template(name: str) -> Template:
+    """Compiled template `name` (relative to `app/templates`), loaded on first use."""
+    template = _cache.get(name)
+    if template is None:
+        with open(os.path.join(TEMPLATE_DIR, name), encoding="utf-8") as f:
+            template = Template(f.read())
+        with _cache_lock:
+            template = _cache.setdefault(name, template)
+    return template
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Order Export Script
+Write orders and their items as CSV or JSON lines, streamed from the database.
+Same output as GET /orders/export; see app/services/order_export.py.
+
+Usage:
+    python export_orders.py [--format csv|jsonl] [--from 2026-01-01] [--to 2026-02-01]
+                            [--status completed] [--payment-status verified] [--payment-method mpesa]
+                            [--output orders.csv]
+"""
+import argparse
+import sys
+import os
+from datetime import datetime
+
+# Add the app directory to the path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from app.services.order_export import EXPORT_FORMATS
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export orders and order items")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv")
+    parser.add_argument("--from", dest="created_from", type=datetime.fromisoformat, help="Orders placed at or after this date/time")
+    parser.add_argument("--to", dest="created_to", type=datetime.fromisoformat, help="Orders placed before this date/time")
+    parser.add_argument("--status")
+    parser.add_argument("--payment-status")
+    parser.add_argument("--payment-method")
+    parser.add_argument("--output", "-o", help="File to write (default: stdout)")
+    args = parser.parse_args()
+
+    generate, _ = EXPORT_FORMATS[args.format]
+    chunks = generate(
+        status=args.status,
+        payment_status=args.payment_status,
+        payment_method=args.payment_method,
+        created_from=args.created_from,
+        created_to=args.created_to,
+    )
+    output = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+    try:
+        for chunk in chunks:
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
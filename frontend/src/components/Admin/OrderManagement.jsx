@@ -5,15 +5,24 @@ export default function OrderManagement() {
   const [orders, setOrders] = useState([]);
   const [loading, setLoading] = useState(true);
   const [selectedOrder, setSelectedOrder] = useState(null);
+  const [statusFilter, setStatusFilter] = useState("");
+  const [nextCursor, setNextCursor] = useState(null);
 
   useEffect(() => {
     fetchOrders();
-  }, []);
+  }, [statusFilter]);
 
-  const fetchOrders = async () => {
+  // Orders are paginated server-side; pass a cursor to append the next page
+  const fetchOrders = async (cursor = null) => {
     try {
-      const response = await api.get("/orders/");
-      setOrders(response.data);
+      const params = {};
+      if (statusFilter) params.status = statusFilter;
+      if (cursor) params.cursor = cursor;
+      const response = await api.get("/orders/", { params });
+      setOrders((prev) =>
+        cursor ? [...prev, ...response.data.items] : response.data.items
+      );
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error("Failed to fetch orders:", error);
       alert("Failed to load orders");
@@ -66,7 +75,21 @@ export default function OrderManagement() {
 
   return (
     <div>
-      <h2 className="mb-4">Order Management</h2>
+      <div className="d-flex justify-content-between align-items-center mb-4">
+        <h2>Order Management</h2>
+        <select
+          className="form-select w-auto"
+          value={statusFilter}
+          onChange={(e) => setStatusFilter(e.target.value)}
+        >
+          <option value="">All statuses</option>
+          <option value="pending">Pending</option>
+          <option value="processing">Processing</option>
+          <option value="shipped">Shipped</option>
+          <option value="completed">Completed</option>
+          <option value="cancelled">Cancelled</option>
+        </select>
+      </div>
 
       <div className="row">
         <div className={selectedOrder ? "col-md-7" : "col-md-12"}>
@@ -129,6 +152,16 @@ export default function OrderManagement() {
               </tbody>
             </table>
           </div>
+          {nextCursor && (
+            <div className="text-center mb-3">
+              <button
+                className="btn btn-outline-primary"
+                onClick={() => fetchOrders(nextCursor)}
+              >
+                Load more
+              </button>
+            </div>
+          )}
         </div>
 
         {selectedOrder && (
@@ -8,16 +8,22 @@ export default function ProductManagement() {
   const [loading, setLoading] = useState(true);
   const [editingProduct, setEditingProduct] = useState(null);
   const [showForm, setShowForm] = useState(false);
+  const [nextCursor, setNextCursor] = useState(null);
 
   useEffect(() => {
     fetchProducts();
     fetchCategories();
   }, []);
 
-  const fetchProducts = async () => {
+  const fetchProducts = async (cursor = null) => {
     try {
-      const response = await api.get("/products/");
-      setProducts(response.data);
+      const response = await api.get("/products/", {
+        params: cursor ? { cursor } : {},
+      });
+      setProducts((prev) =>
+        cursor ? [...prev, ...response.data.items] : response.data.items
+      );
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error("Failed to fetch products:", error);
       alert("Failed to load products");
@@ -165,6 +171,16 @@ export default function ProductManagement() {
           </tbody>
         </table>
       </div>
+      {nextCursor && (
+        <div className="text-center mb-3">
+          <button
+            className="btn btn-outline-primary"
+            onClick={() => fetchProducts(nextCursor)}
+          >
+            Load more
+          </button>
+        </div>
+      )}
     </div>
   );
 }
@@ -16,6 +16,7 @@ export default function MpesaVerification({
   const [pushRequested, setPushRequested] = useState(false);
   const [requestId, setRequestId] = useState(null);
   const [polling, setPolling] = useState(false);
+  const [paymentFailed, setPaymentFailed] = useState(false);
   const businessNumber = getMpesaBusinessNumber();
 
   useEffect(() => {
@@ -66,6 +67,7 @@ export default function MpesaVerification({
 
   const requestStkPush = async () => {
     setError("");
+    setPaymentFailed(false);
     setLoading(true);
     try {
       const res = await api.post(`/orders/${orderId}/mpesa/push`, {
@@ -88,21 +90,48 @@ export default function MpesaVerification({
     }
   };
 
-  // Poll for status when pushRequested/polling is true
+  // Wait for the payment confirmation once an STK push was requested. The
+  // server pushes status changes over SSE; polling is only a fallback for
+  // browsers without EventSource.
   useEffect(() => {
     if (!polling || !pushRequested) return;
 
     let cancelled = false;
+    // Returns true once there is nothing more to wait for
+    const handleStatus = (data) => {
+      if (!data || cancelled) return false;
+      if (data.payment_verified) {
+        setPolling(false);
+        setPushRequested(false);
+        onVerified(data);
+        return true;
+      }
+      // Cancelled on the phone, timed out or insufficient funds. Ignore a
+      // failure left over from an earlier push.
+      if (data.payment_status === "failed" && data.mpesa_request_id === requestId) {
+        setPolling(false);
+        setPushRequested(false);
+        setPaymentFailed(true);
+        return true;
+      }
+      return false;
+    };
+
+    if (typeof window !== "undefined" && window.EventSource) {
+      const source = new EventSource(`${api.defaults.baseURL}/orders/${orderId}/mpesa/events`);
+      source.addEventListener("status", (event) => {
+        if (handleStatus(JSON.parse(event.data))) source.close();
+      });
+      return () => {
+        cancelled = true;
+        source.close();
+      };
+    }
+
     const interval = setInterval(async () => {
       try {
         const res = await api.get(`/orders/${orderId}/mpesa/status`);
-        if (res.data && res.data.payment_verified) {
-          if (!cancelled) {
-            setPolling(false);
-            setPushRequested(false);
-            onVerified(res.data);
-          }
-        }
+        handleStatus(res.data);
       } catch (err) {
         console.error("Polling error:", err);
       }
@@ -112,7 +141,7 @@ export default function MpesaVerification({
       cancelled = true;
       clearInterval(interval);
     };
-  }, [polling, pushRequested, orderId, onVerified]);
+  }, [polling, pushRequested, orderId, requestId, onVerified]);
 
   return (
     <div className="card">
@@ -139,6 +168,16 @@ export default function MpesaVerification({
           )}
         </div>
 
+        {paymentFailed && (
+          <div className="alert alert-danger mb-3" role="alert">
+            <p className="mb-1"><strong>Payment not completed</strong></p>
+            <p className="mb-0">
+              The M-PESA request was cancelled or did not go through. Request a new
+              STK Push to try again, or pay manually and enter the confirmation code below.
+            </p>
+          </div>
+        )}
+
         {!pushRequested ? (
           <div className="mb-3">
             <button
@@ -147,7 +186,7 @@ export default function MpesaVerification({
               onClick={requestStkPush}
               disabled={loading}
             >
-              {loading ? "Requesting…" : "Request STK Push (One-tap)"}
+              {loading ? "Requesting…" : paymentFailed ? "Retry STK Push" : "Request STK Push (One-tap)"}
             </button>
             <small className="form-text text-muted mt-2">
               You can request an STK Push to your phone to pay without entering the MPESA code manually.
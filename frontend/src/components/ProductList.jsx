@@ -5,28 +5,30 @@ import { Link } from "react-router-dom";
 export default function ProductList({ categoryId, searchTerm }) {
   const [products, setProducts] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [sort, setSort] = useState("newest");
+  const [nextCursor, setNextCursor] = useState(null);
 
   useEffect(() => {
     fetchProducts();
-  }, [categoryId, searchTerm]);
+  }, [categoryId, searchTerm, sort]);
 
-  const fetchProducts = async () => {
-    setLoading(true);
+  // The grid only needs a few fields; descriptions are loaded on the detail page
+  const fetchProducts = async (cursor = null) => {
+    if (!cursor) setLoading(true);
     try {
-      let url = "/products/";
-      const params = new URLSearchParams();
-      if (categoryId) {
-        params.append("category_id", categoryId);
-      }
-      if (searchTerm) {
-        params.append("search", searchTerm);
-      }
-      if (params.toString()) {
-        url += `?${params.toString()}`;
-      }
+      const params = {
+        sort,
+        fields: "id,name,price,image_url,stock_quantity,category",
+      };
+      if (categoryId) params.category_id = categoryId;
+      if (searchTerm) params.search = searchTerm;
+      if (cursor) params.cursor = cursor;
 
-      const response = await api.get(url);
-      setProducts(response.data);
+      const response = await api.get("/products/", { params });
+      setProducts((prev) =>
+        cursor ? [...prev, ...response.data.items] : response.data.items
+      );
+      setNextCursor(response.data.next_cursor);
     } catch (err) {
       console.error(err);
       alert("Failed to load products");
@@ -54,6 +56,19 @@ export default function ProductList({ categoryId, searchTerm }) {
   }
 
   return (
+    <>
+    <div className="d-flex justify-content-end mb-3">
+      <select
+        className="form-select w-auto"
+        value={sort}
+        onChange={(e) => setSort(e.target.value)}
+      >
+        <option value="newest">Newest</option>
+        <option value="price_asc">Price: low to high</option>
+        <option value="price_desc">Price: high to low</option>
+        <option value="name">Name</option>
+      </select>
+    </div>
     <div className="product-grid">
       {products.map((p) => (
         <article key={p.id} className="product-card card h-100">
@@ -74,10 +89,7 @@ export default function ProductList({ categoryId, searchTerm }) {
             {p.category && (
               <span className="badge bg-secondary mb-2">{p.category.name}</span>
             )}
-            <p className="card-text flex-grow-1">
-              {p.description?.substring(0, 120)}
-              {p.description?.length > 120 ? "..." : ""}
-            </p>
+            <div className="flex-grow-1" />
             <div className="d-flex justify-content-between align-items-center">
               <div>
                 <strong className="text-primary">KES {p.price?.toLocaleString()}</strong>
@@ -103,5 +115,16 @@ export default function ProductList({ categoryId, searchTerm }) {
         </article>
       ))}
     </div>
+    {nextCursor && (
+      <div className="text-center my-3">
+        <button
+          className="btn btn-outline-primary"
+          onClick={() => fetchProducts(nextCursor)}
+        >
+          Load more
+        </button>
+      </div>
+    )}
+    </>
   );
 }
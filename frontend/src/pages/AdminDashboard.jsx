@@ -19,29 +19,16 @@ export default function AdminDashboard() {
     fetchStats();
   }, []);
 
+  // Totals are computed server-side from the daily sales rollup
   const fetchStats = async () => {
     try {
-      const [productsRes, ordersRes] = await Promise.all([
-        api.get("/products/"),
-        api.get("/orders/"),
-      ]);
-
-      const products = productsRes.data;
-      const orders = ordersRes.data;
-
-      const totalRevenue = orders.reduce(
-        (sum, order) => sum + (order.total_amount || 0),
-        0
-      );
-      const lowStockItems = products.filter(
-        (p) => p.stock_quantity < 10
-      ).length;
+      const { data } = await api.get("/admin/stats", { params: { low_stock: 10 } });
 
       setStats({
-        totalProducts: products.length,
-        totalOrders: orders.length,
-        totalRevenue,
-        lowStockItems,
+        totalProducts: data.products.total,
+        totalOrders: data.totals.orders,
+        totalRevenue: data.totals.revenue,
+        lowStockItems: data.products.low_stock,
       });
     } catch (error) {
       console.error("Failed to fetch stats:", error);
@@ -5,18 +5,24 @@ import api from "../api/axios";
 export default function OrderHistory() {
   const [orders, setOrders] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextCursor, setNextCursor] = useState(null);
 
   useEffect(() => {
     fetchOrders();
   }, []);
 
-  const fetchOrders = async () => {
+  const fetchOrders = async (cursor = null) => {
     try {
       // This endpoint should return orders for the current customer
       // For now, we'll use the general orders endpoint
-      // In production, you'd filter by customer email/phone
-      const response = await api.get("/orders/");
-      setOrders(response.data);
+      // In production, pass customer_phone / customer_email to filter server-side
+      const response = await api.get("/orders/", {
+        params: cursor ? { cursor } : {},
+      });
+      setOrders((prev) =>
+        cursor ? [...prev, ...response.data.items] : response.data.items
+      );
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error("Failed to fetch orders:", error);
     } finally {
@@ -96,6 +102,16 @@ export default function OrderHistory() {
               ))}
             </tbody>
           </table>
+          {nextCursor && (
+            <div className="text-center mb-3">
+              <button
+                className="btn btn-outline-primary"
+                onClick={() => fetchOrders(nextCursor)}
+              >
+                Load more
+              </button>
+            </div>
+          )}
         </div>
       )}
     </div>
@@ -6,11 +6,30 @@ function Store() {
   const [categories, setCategories] = useState([]);
   const [selectedCategory, setSelectedCategory] = useState(null);
   const [searchTerm, setSearchTerm] = useState("");
+  const [searchInput, setSearchInput] = useState("");
+  const [suggestions, setSuggestions] = useState([]);
 
   useEffect(() => {
     fetchCategories();
   }, []);
 
+  // Typeahead comes from the lightweight suggest endpoint; the product list
+  // itself is only re-queried once typing pauses.
+  useEffect(() => {
+    const term = searchInput.trim();
+    if (!term) {
+      setSuggestions([]);
+      setSearchTerm("");
+      return;
+    }
+    api
+      .get("/products/suggest", { params: { q: term } })
+      .then((response) => setSuggestions(response.data))
+      .catch(() => setSuggestions([]));
+    const timer = setTimeout(() => setSearchTerm(term), 300);
+    return () => clearTimeout(timer);
+  }, [searchInput]);
+
   const fetchCategories = async () => {
     try {
       const response = await api.get("/categories/");
@@ -40,9 +59,15 @@ function Store() {
                   type="text"
                   className="form-control"
                   placeholder="Search products..."
-                  value={searchTerm}
-                  onChange={(e) => setSearchTerm(e.target.value)}
+                  list="product-suggestions"
+                  value={searchInput}
+                  onChange={(e) => setSearchInput(e.target.value)}
                 />
+                <datalist id="product-suggestions">
+                  {suggestions.map((s) => (
+                    <option key={`${s.type}-${s.id}`} value={s.name} />
+                  ))}
+                </datalist>
               </div>
               <div className="mb-3">
                 <label className="form-label">Category</label>
@@ -65,7 +90,7 @@ function Store() {
                 className="btn btn-secondary w-100"
                 onClick={() => {
                   setSelectedCategory(null);
-                  setSearchTerm("");
+                  setSearchInput("");
                 }}
               >
                 Clear Filters
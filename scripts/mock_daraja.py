@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Safaricom Daraja STK-push API.
+
+Usage:
+    python scripts/mock_daraja.py [--port 8090] [--latency 0.2] [--fail-rate 0.1] [--callback-delay 3]
+
+Then run the API with
+    MPESA_BASE_URL=http://127.0.0.1:8090 MPESA_CONSUMER_KEY=x MPESA_CONSUMER_SECRET=x
+    MPESA_SHORTCODE=174379 MPESA_PASSKEY=x
+    MPESA_CALLBACK_URL=http://127.0.0.1:8000/orders/mpesa/webhook
+
+Implements the two endpoints the API uses:
+- GET  /oauth/v1/generate: a token valid for `--token-ttl` seconds
+- POST /mpesa/stkpush/v1/processrequest: accepts the push and, after
+  `--callback-delay` seconds, posts a Daraja-style callback to CallBackURL.
+  Phone numbers ending in 000 simulate the customer cancelling (ResultCode 1032).
+
+`--latency` delays every response and `--fail-rate` answers that share of
+requests with 503, for exercising timeouts, retries and the circuit breaker.
+"""
+import argparse
+import asyncio
+import base64
+import random
+import secrets
+import string
+import time
+import httpx
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import JSONResponse
+
+
+def _receipt() -> str:
+    return "".join(random.choices(string.ascii_uppercase + string.digits, k=10))
+
+
+def create_app(latency: float = 0.0, fail_rate: float = 0.0, callback_delay: float = 3.0,
+               token_ttl: int = 3599, callback_transport=None) -> FastAPI:
+    app = FastAPI(title="Mock Daraja")
+    tokens: dict[str, float] = {}
+    app.state.stats = {"tokens": 0, "pushes": 0, "callbacks": 0, "failed": 0}
+
+    @app.middleware("http")
+    async def chaos(request: Request, call_next):
+        if latency:
+            await asyncio.sleep(latency)
+        if fail_rate and random.random() < fail_rate:
+            app.state.stats["failed"] += 1
+            return JSONResponse({"errorMessage": "Service unavailable"}, status_code=503)
+        return await call_next(request)
+
+    @app.get("/oauth/v1/generate")
+    def generate(grant_type: str, authorization: str = Header(None)):
+        if grant_type != "client_credentials" or not (authorization or "").startswith("Basic "):
+            raise HTTPException(status_code=400, detail="Invalid credentials")
+        token = secrets.token_urlsafe(24)
+        tokens[token] = time.monotonic() + token_ttl
+        app.state.stats["tokens"] += 1
+        return {"access_token": token, "expires_in": str(token_ttl)}
+
+    async def send_callback(url: str, body: dict):
+        await asyncio.sleep(callback_delay)
+        try:
+            async with httpx.AsyncClient(transport=callback_transport, timeout=10) as client:
+                await client.post(url, json=body)
+            app.state.stats["callbacks"] += 1
+        except httpx.HTTPError as e:
+            print(f"Warning: callback to {url} failed: {e!r}")
+
+    @app.post("/mpesa/stkpush/v1/processrequest")
+    async def process_request(payload: dict, authorization: str = Header(None)):
+        token = (authorization or "").removeprefix("Bearer ")
+        if tokens.get(token, 0) < time.monotonic():
+            return JSONResponse({"errorCode": "404.001.03", "errorMessage": "Invalid Access Token"}, status_code=401)
+        # Password is base64(shortcode + passkey + timestamp); the passkey isn't known here
+        try:
+            password = base64.b64decode(payload.get("Password") or "").decode()
+        except ValueError:
+            password = ""
+        shortcode, timestamp = str(payload.get("BusinessShortCode")), str(payload.get("Timestamp"))
+        if not (password.startswith(shortcode) and password.endswith(timestamp)):
+            return JSONResponse({"errorCode": "400.002.02", "errorMessage": "Invalid Password"}, status_code=400)
+        for field in ("PhoneNumber", "Amount", "CallBackURL"):
+            if not payload.get(field):
+                return JSONResponse({"errorCode": "400.002.02", "errorMessage": f"Invalid {field}"}, status_code=400)
+
+        app.state.stats["pushes"] += 1
+        merchant_id = f"{random.randint(10000, 99999)}-{random.randint(1000000, 9999999)}-1"
+        checkout_id = f"ws_CO_{time.strftime('%d%m%Y%H%M%S')}{random.randint(100000, 999999)}"
+        phone = str(payload["PhoneNumber"])
+        if phone.endswith("000"):
+            callback = {"ResultCode": 1032, "ResultDesc": "Request cancelled by user"}
+        else:
+            callback = {
+                "ResultCode": 0,
+                "ResultDesc": "The service request is processed successfully.",
+                "CallbackMetadata": {"Item": [
+                    {"Name": "Amount", "Value": payload["Amount"]},
+                    {"Name": "MpesaReceiptNumber", "Value": _receipt()},
+                    {"Name": "TransactionDate", "Value": int(time.strftime("%Y%m%d%H%M%S"))},
+                    {"Name": "PhoneNumber", "Value": int(phone)},
+                ]},
+            }
+        body = {"Body": {"stkCallback": {"MerchantRequestID": merchant_id, "CheckoutRequestID": checkout_id, **callback}}}
+        asyncio.get_running_loop().create_task(send_callback(payload["CallBackURL"], body))
+        return {
+            "MerchantRequestID": merchant_id,
+            "CheckoutRequestID": checkout_id,
+            "ResponseCode": "0",
+            "ResponseDescription": "Success. Request accepted for processing",
+            "CustomerMessage": "Success. Request accepted for processing",
+        }
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--callback-delay", type=float, default=3.0, help="Seconds before the payment callback")
+    parser.add_argument("--token-ttl", type=int, default=3599)
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(
+        create_app(args.latency, args.fail_rate, args.callback_delay, args.token_ttl),
+        host=args.host,
+        port=args.port,
+    )
+
+
+if __name__ == "__main__":
+    main()
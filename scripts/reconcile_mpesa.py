@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""Mark unpaid M-Pesa orders paid from an M-Pesa statement export (CSV).
+
+Usage:
+    python scripts/reconcile_mpesa.py statement.csv [--dry-run]
+
+Same matching as POST /admin/mpesa/reconcile; see
+`app/services/mpesa_reconciliation.py`.
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlmodel import Session
+from app.db.session import engine
+from app.services.mpesa_reconciliation import reconcile_statement
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("statement", help="Path to the statement CSV")
+    parser.add_argument("--dry-run", action="store_true", help="Report matches without marking orders paid")
+    args = parser.parse_args()
+
+    with open(args.statement, encoding="utf-8-sig", newline="") as stream, Session(engine) as session:
+        report = reconcile_statement(session, stream, dry_run=args.dry_run)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""Shared fixtures: the API against a throwaway SQLite database.
+
+The environment is set before `app` is imported, since settings are read at
+import time. Outbox jobs are left in the table (no worker thread) and invoice
+PDFs are rendered inline without touching the on-disk store.
+"""
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="morine-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'test.db')}"
+os.environ["OUTBOX_WORKER_ENABLED"] = "false"
+os.environ["PDF_RENDER_WORKERS"] = "0"
+os.environ["INVOICE_PDF_PERSIST"] = "false"
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# StaticFiles is mounted relative to the working directory
+os.chdir(ROOT)
+
+import pytest
+from fastapi.testclient import TestClient
+from app.db.session import engine
+from app.main import app
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def make_product(client):
+    def make(name="Gypsum board", price=100, stock=100):
+        response = client.post("/products/", data={"name": name, "price": str(price), "stock_quantity": str(stock)})
+        assert response.status_code == 201, response.text
+        return response.json()["id"]
+    return make
+
+
+@pytest.fixture
+def order_payload():
+    def payload(product_id, quantity=1, price=100, phone="0712345678"):
+        return {
+            "customer_name": "Test Customer",
+            "customer_phone": phone,
+            "payment_method": "mpesa",
+            "delivery_address": "Nairobi",
+            "items": [{"product_id": product_id, "quantity": quantity, "price": price}],
+        }
+    return payload
+
+
+@pytest.fixture
+def count_statements():
+    """Context manager counting the SQL statements executed on the engine."""
+    from contextlib import contextmanager
+    from sqlalchemy import event
+
+    @contextmanager
+    def counter():
+        counts = {"statements": 0}
+
+        def before_cursor_execute(*args, **kwargs):
+            counts["statements"] += 1
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield counts
+        finally:
+            event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    return counter
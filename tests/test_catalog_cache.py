@@ -0,0 +1,54 @@
+"""Catalog snapshot (user-007) behaviour under checkouts."""
+from app.services.catalog_cache import catalog_cache
+from app.services.response_cache import response_cache
+
+
+def test_checkout_keeps_listing_cache_warm_and_product_stock_current(client, make_product, order_payload):
+    product_id = make_product(name="Checkout board", price=300, stock=9)
+    first = client.get("/products/", params={"limit": 5})
+    assert first.status_code == 200
+    version = first.headers["X-Catalog-Version"]
+    stock_updates = catalog_cache.stats()["stock_updates"]
+
+    response = client.post("/orders/", json=order_payload(product_id, quantity=3, price=300))
+    assert response.status_code == 201
+
+    hits = response_cache.hits
+    again = client.get("/products/", params={"limit": 5})
+    assert again.headers["X-Catalog-Version"] == version
+    assert response_cache.hits == hits + 1
+    assert catalog_cache.stats()["stock_updates"] == stock_updates + 1
+    assert client.get(f"/products/{product_id}").json()["stock_quantity"] == 6
+
+
+NAMES = ["apple", "Banana", "cherry", "Date", "eggplant", "Fig", "grape"]
+
+
+def _name_pages(client, category_id, sources, monkeypatch):
+    """Page through `sort=name`, switching between snapshot and SQL per page."""
+    from app.services import catalog_cache as catalog_cache_module
+
+    names, cursor = [], None
+    for use_snapshot in sources:
+        monkeypatch.setattr(catalog_cache_module, "CATALOG_CACHE_ENABLED", use_snapshot)
+        params = {"sort": "name", "limit": 2, "category_id": category_id}
+        if cursor:
+            params["cursor"] = cursor
+        page = client.get("/products/", params=params).json()
+        names += [item["name"] for item in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    return names
+
+
+def test_name_cursor_is_shared_by_snapshot_and_sql(client, monkeypatch):
+    category = client.post("/categories/", json={"name": "Name sort"}).json()
+    for name in reversed(NAMES):
+        response = client.post(
+            "/products/", data={"name": name, "price": "10", "stock_quantity": "1", "category_id": str(category["id"])}
+        )
+        assert response.status_code == 201
+
+    assert _name_pages(client, category["id"], [True, False, True, False], monkeypatch) == NAMES
+    assert _name_pages(client, category["id"], [False, True, False, True], monkeypatch) == NAMES
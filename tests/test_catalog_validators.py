@@ -0,0 +1,61 @@
+"""Validators on catalog listings (user-009): per-encoding ETags, Last-Modified
+that covers deletions, and the same headers when the snapshot is off."""
+from sqlalchemy import func
+from sqlmodel import Session, select
+
+from app.db.session import engine
+from app.models.models import CatalogTombstone
+from app.services import catalog_cache as catalog_cache_module
+from app.services.catalog_cache import catalog_cache
+
+
+def _listing(client, **headers):
+    return client.get("/products/", params={"limit": 200}, headers=headers)
+
+
+def _ensure_compressible(make_product):
+    # Enough products for the page to pass COMPRESS_MIN_BYTES
+    for n in range(12):
+        make_product(name=f"Validator board {n}", price=100 + n, stock=5)
+
+
+def test_etag_differs_per_encoding(client, make_product):
+    _ensure_compressible(make_product)
+    plain = _listing(client, **{"Accept-Encoding": "identity"})
+    gzipped = _listing(client, **{"Accept-Encoding": "gzip"})
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert "Content-Encoding" not in plain.headers
+    assert plain.headers["ETag"] != gzipped.headers["ETag"]
+    assert plain.headers["Vary"] == gzipped.headers["Vary"] == "Accept-Encoding"
+
+    # A validator only matches the representation it was issued for
+    assert _listing(client, **{"Accept-Encoding": "gzip", "If-None-Match": gzipped.headers["ETag"]}).status_code == 304
+    stale = _listing(client, **{"Accept-Encoding": "gzip", "If-None-Match": plain.headers["ETag"]})
+    assert stale.status_code == 200
+    not_modified = _listing(client, **{"Accept-Encoding": "identity", "If-None-Match": plain.headers["ETag"]})
+    assert not_modified.status_code == 304
+    assert not_modified.headers["Vary"] == "Accept-Encoding"
+
+
+def test_last_modified_includes_deletions_after_reload(client, make_product):
+    product_id = make_product(name="Short-lived board")
+    assert client.delete(f"/products/{product_id}").status_code in (200, 204)
+    # As another worker would see it: a fresh snapshot loaded from the database
+    catalog_cache.invalidate()
+    assert _listing(client).status_code == 200
+    with Session(engine) as session:
+        deleted_at = session.exec(select(func.max(CatalogTombstone.deleted_at))).one()
+    assert catalog_cache.last_modified() >= deleted_at
+
+
+def test_uncached_listings_send_validators(client, make_product, monkeypatch):
+    _ensure_compressible(make_product)
+    monkeypatch.setattr(catalog_cache_module, "CATALOG_CACHE_ENABLED", False)
+    for path in ("/products/", "/categories/"):
+        response = client.get(path)
+        assert response.status_code == 200
+        assert response.headers["ETag"]
+        assert response.headers["Last-Modified"]
+        assert "X-Catalog-Version" not in response.headers
+        revalidated = client.get(path, headers={"If-None-Match": response.headers["ETag"]})
+        assert revalidated.status_code == 304
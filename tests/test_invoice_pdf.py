@@ -0,0 +1,19 @@
+"""Invoice and receipt downloads (user-019) are rendered in memory."""
+
+
+def test_invoice_download_is_a_pdf_with_validators(client, make_product, order_payload):
+    product_id = make_product(name="Invoice board", price=120, stock=5)
+    order_id = client.post("/orders/", json=order_payload(product_id, price=120)).json()["id"]
+
+    for path in (f"/orders/{order_id}/invoice", f"/orders/{order_id}/receipt"):
+        response = client.get(path)
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/pdf"
+        assert response.content.startswith(b"%PDF")
+        assert client.get(path, headers={"If-None-Match": response.headers["ETag"]}).status_code == 304
+
+
+def test_pdf_routes_are_documented_as_pdf(client):
+    paths = client.get("/openapi.json").json()["paths"]
+    for path in ("/orders/{order_id}/invoice", "/orders/{order_id}/receipt"):
+        assert set(paths[path]["get"]["responses"]["200"]["content"]) == {"application/pdf"}
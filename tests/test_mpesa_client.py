@@ -0,0 +1,133 @@
+"""DarajaClient (user-023) against an in-process httpx transport."""
+import asyncio
+
+import httpx
+import pytest
+
+from app.services.mpesa_client import DarajaClient, MpesaRequestError, MpesaUnavailable
+
+PUSH_OK = {"MerchantRequestID": "1", "CheckoutRequestID": "ws_CO_1", "ResponseCode": "0", "CustomerMessage": "ok"}
+
+
+class _Daraja:
+    """Counts calls; `push` decides how each STK push is answered."""
+
+    def __init__(self, push):
+        self.push = push
+        self.tokens = 0
+        self.pushes = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/oauth/v1/generate":
+            self.tokens += 1
+            return httpx.Response(200, json={"access_token": f"token-{self.tokens}", "expires_in": "3599"})
+        self.pushes += 1
+        return await self.push(request)
+
+
+def _client(daraja, **kwargs):
+    return DarajaClient(
+        "key", "secret", "174379", "passkey", "http://shop/cb",
+        base_url="http://daraja", max_retries=0, transport=httpx.MockTransport(daraja), **kwargs,
+    )
+
+
+def test_rejected_push_is_not_repeated():
+    async def push(request):
+        return httpx.Response(400, json={"errorCode": "400.002.02", "errorMessage": "Invalid PhoneNumber"})
+
+    daraja = _Daraja(push)
+
+    async def scenario():
+        client = _client(daraja)
+        try:
+            with pytest.raises(MpesaRequestError) as error:
+                await client.stk_push("0712345678", 100, "ORDER1")
+            return client, error.value
+        finally:
+            await client.aclose()
+
+    client, error = asyncio.run(scenario())
+    assert error.status_code == 400
+    assert daraja.pushes == 1
+    assert daraja.tokens == 1
+    assert client.breaker.state == "closed"
+
+
+def test_revoked_token_is_refreshed_once():
+    async def push(request):
+        if request.headers["Authorization"] == "Bearer token-1":
+            return httpx.Response(401, json={"errorCode": "404.001.03", "errorMessage": "Invalid Access Token"})
+        return httpx.Response(200, json=PUSH_OK)
+
+    daraja = _Daraja(push)
+
+    async def scenario():
+        client = _client(daraja)
+        try:
+            return await client.stk_push("0712345678", 100, "ORDER1")
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(scenario())["CheckoutRequestID"] == "ws_CO_1"
+    assert daraja.pushes == 2
+    assert daraja.tokens == 2
+
+
+@pytest.mark.parametrize("outcome", ["cancelled", "decoding_error"])
+def test_half_open_trial_is_released(outcome):
+    calls = {"n": 0}
+
+    async def push(request):
+        calls["n"] += 1
+        if calls["n"] == 1:
+            if outcome == "cancelled":
+                await asyncio.sleep(10)
+            raise httpx.DecodingError("garbled response")
+        return httpx.Response(200, json=PUSH_OK)
+
+    daraja = _Daraja(push)
+
+    async def scenario():
+        client = _client(daraja)
+        try:
+            await client._access_token()
+            # Open the breaker; with reset_seconds=0 it is immediately half-open
+            client.breaker.reset_seconds = 0
+            client.breaker.opened_at = 0.0
+            assert client.breaker.state == "half-open"
+            if outcome == "cancelled":
+                with pytest.raises(asyncio.TimeoutError):
+                    await asyncio.wait_for(client.stk_push("0712345678", 100, "ORDER1"), 0.05)
+            else:
+                with pytest.raises(httpx.DecodingError):
+                    await client.stk_push("0712345678", 100, "ORDER1")
+            # The trial slot is free again, so the next push is let through
+            return await client.stk_push("0712345678", 100, "ORDER1")
+        finally:
+            await client.aclose()
+
+    assert asyncio.run(scenario())["ResponseCode"] == "0"
+
+
+def test_breaker_opens_after_consecutive_failures():
+    async def push(request):
+        return httpx.Response(503)
+
+    daraja = _Daraja(push)
+
+    async def scenario():
+        client = _client(daraja)
+        client.breaker.threshold = 2
+        try:
+            await client._access_token()
+            for _ in range(2):
+                with pytest.raises(MpesaUnavailable):
+                    await client.stk_push("0712345678", 100, "ORDER1")
+            with pytest.raises(MpesaUnavailable, match="circuit open"):
+                await client.stk_push("0712345678", 100, "ORDER1")
+        finally:
+            await client.aclose()
+
+    asyncio.run(scenario())
+    assert daraja.pushes == 2
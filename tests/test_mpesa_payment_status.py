@@ -0,0 +1,35 @@
+"""Failed STK prompts (user-020): the order is marked `failed` for the waiting
+page, and a new push puts it back to `pending`."""
+
+
+def _cancelled_callback(request_id):
+    return {"Body": {"stkCallback": {
+        "MerchantRequestID": "29115-34620561-1",
+        "CheckoutRequestID": request_id,
+        "ResultCode": 1032,
+        "ResultDesc": "Request cancelled by user",
+    }}}
+
+
+def _push(client, order_id):
+    response = client.post(f"/orders/{order_id}/mpesa/push", json={"phone_number": "0712345678"})
+    assert response.status_code == 200, response.text
+    return response.json()["request_id"]
+
+
+def test_cancelled_prompt_marks_payment_failed_until_retried(client, make_product, order_payload):
+    product_id = make_product(name="Ceiling board", stock=5)
+    order_id = client.post("/orders/", json=order_payload(product_id)).json()["id"]
+    request_id = _push(client, order_id)
+
+    assert client.post("/orders/mpesa/webhook", json=_cancelled_callback(request_id)).status_code == 200
+    status = client.get(f"/orders/{order_id}/mpesa/status").json()
+    assert status["payment_status"] == "failed"
+    assert status["mpesa_request_id"] == request_id
+    assert not status["payment_verified"]
+
+    retry_id = _push(client, order_id)
+    assert retry_id != request_id
+    status = client.get(f"/orders/{order_id}/mpesa/status").json()
+    assert status["payment_status"] == "pending"
+    assert status["mpesa_request_id"] == retry_id
@@ -0,0 +1,94 @@
+"""M-Pesa statement reconciliation (user-022): statement rows mark unpaid
+orders paid, and the customers waiting on those orders are told."""
+from sqlmodel import Session
+from app.db.session import engine
+from app.models.models import Order
+from app.services.payment_events import payment_events
+
+HEADER = "Receipt No.,Completion Time,Details,Transaction Status,Paid In,Phone\n"
+
+
+def _place_order(client, make_product, order_payload, phone):
+    product_id = make_product(name=f"Reconciled board {phone}", price=100, stock=5)
+    response = client.post("/orders/", json=order_payload(product_id, phone=phone))
+    assert response.status_code == 201, response.text
+    return response.json()
+
+
+def _reconcile(client, rows, dry_run=False):
+    statement = HEADER + "".join(f"{code},2026-10-17 10:00:00,Funds received,Completed,{amount},{phone}\n" for code, amount, phone in rows)
+    response = client.post(
+        "/admin/mpesa/reconcile",
+        params={"dry_run": dry_run},
+        files={"statement": ("statement.csv", statement, "text/csv")},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _submit_code(order_id, code):
+    # A code the customer gave but that was never confirmed, as left by a failed push
+    with Session(engine) as session:
+        order = session.get(Order, order_id)
+        order.mpesa_code = code
+        session.add(order)
+        session.commit()
+
+
+def _status(client, order_id):
+    return client.get(f"/orders/{order_id}/mpesa/status").json()
+
+
+def test_reconciled_payment_is_announced(client, make_product, order_payload, monkeypatch):
+    order = _place_order(client, make_product, order_payload, "0722000101")
+    published = []
+    monkeypatch.setattr(payment_events, "publish", lambda order_id, status: published.append((order_id, status)))
+
+    report = _reconcile(client, [("RCN0000101", order["total_amount"], "254722000101")])
+    assert report["marked_paid"] == 1
+
+    status = _status(client, order["id"])
+    assert status["payment_verified"]
+    assert status["mpesa_code"] == "RCN0000101"
+    assert published == [(order["id"], status)]
+
+
+def test_statement_matches_by_code_then_phone_and_amount(client, make_product, order_payload):
+    by_code = _place_order(client, make_product, order_payload, "0722000201")
+    by_phone = _place_order(client, make_product, order_payload, "0722000202")
+    _submit_code(by_code["id"], "RCN0000201")
+
+    rows = [
+        # Paid from another phone: only the receipt number ties it to the order
+        ("RCN0000201", by_code["total_amount"], "0799000201"),
+        ("RCN0000202", f"{by_phone['total_amount']:.2f}", "+254 722 000 202"),
+        ("RCN0000203", 12345, "0722000203"),
+    ]
+    report = _reconcile(client, rows)
+    assert report["payments"] == 3
+    assert report["matched_by_code"] == 1
+    assert report["matched_by_phone_amount"] == 1
+    assert report["marked_paid"] == 2
+    assert report["unmatched"] == 1
+    assert report["unmatched_sample"] == [{"code": "RCN0000203", "phone": "0722000203", "amount": 12345}]
+    assert _status(client, by_code["id"])["payment_verified"]
+    assert _status(client, by_phone["id"])["mpesa_code"] == "RCN0000202"
+
+    # The same statement uploaded again changes nothing
+    again = _reconcile(client, rows)
+    assert again["marked_paid"] == 0
+    assert again["already_applied"] == 2
+
+
+def test_dry_run_reports_matches_without_marking_orders_paid(client, make_product, order_payload):
+    order = _place_order(client, make_product, order_payload, "0722000301")
+
+    report = _reconcile(client, [("RCN0000301", order["total_amount"], "0722000301")], dry_run=True)
+    assert report["dry_run"]
+    assert report["matched"] == 1
+    assert report["marked_paid"] == 0
+    status = _status(client, order["id"])
+    assert not status["payment_verified"]
+    assert status["mpesa_code"] is None
+
+    assert _reconcile(client, [("RCN0000301", order["total_amount"], "0722000301")])["marked_paid"] == 1
@@ -0,0 +1,65 @@
+"""GET /orders/export (user-025): CSV has one row per order item, JSONL one
+line per order with its items, and the listing filters apply."""
+import csv
+import io
+import json
+from datetime import datetime
+
+
+def _place_order(client, make_product, names):
+    product_ids = [make_product(name=name, price=75, stock=10) for name in names]
+    payload = {
+        "customer_name": "Export Customer",
+        "customer_phone": "0744000101",
+        "payment_method": "cash_on_delivery",
+        "delivery_address": "Nakuru",
+        "items": [{"product_id": product_id, "quantity": 2, "price": 75} for product_id in product_ids],
+    }
+    response = client.post("/orders/", json=payload)
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+
+def _export(client, **params):
+    response = client.get("/orders/export", params=params)
+    assert response.status_code == 200, response.text
+    return response
+
+
+def test_export_writes_a_csv_row_per_item_and_a_json_line_per_order(client, make_product):
+    since = datetime.utcnow().isoformat()
+    first = _place_order(client, make_product, ["Export cornice", "Export primer"])
+    second = _place_order(client, make_product, ["Export trowel"])
+
+    response = _export(client, format="csv", created_from=since)
+    assert response.headers["content-type"].startswith("text/csv")
+    assert ".csv" in response.headers["content-disposition"]
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [(int(row["order_id"]), row["product_name"]) for row in rows] == [
+        (first, "Export cornice"),
+        (first, "Export primer"),
+        (second, "Export trowel"),
+    ]
+    assert {row["quantity"] for row in rows} == {"2"}
+    datetime.fromisoformat(rows[0]["created_at"])
+
+    response = _export(client, format="jsonl", created_from=since)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    orders = [json.loads(line) for line in response.text.splitlines()]
+    assert [order["id"] for order in orders] == [first, second]
+    assert [[item["product_name"] for item in order["items"]] for order in orders] == [
+        ["Export cornice", "Export primer"],
+        ["Export trowel"],
+    ]
+    assert orders[0]["total_price"] == 300
+
+
+def test_export_filters_by_status(client, make_product):
+    since = datetime.utcnow().isoformat()
+    _place_order(client, make_product, ["Export filler"])
+    processing = _place_order(client, make_product, ["Export sealant"])
+    assert client.patch(f"/orders/{processing}", json={"status": "processing"}).status_code == 200
+
+    response = _export(client, format="jsonl", status="processing", created_from=since)
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == [processing]
+    assert client.get("/orders/export", params={"format": "xml"}).status_code == 422
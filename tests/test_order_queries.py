@@ -0,0 +1,46 @@
+"""GET /orders/ loads items and products eagerly (user-001): the number of
+statements doesn't grow with the number of orders on the page."""
+
+
+def _place_orders(client, make_product, phone, count):
+    for n in range(count):
+        # Distinct products per order, so lazy loads would show up per order
+        product_ids = [make_product(name=f"{phone} product {n}.{line}", price=50, stock=10) for line in range(2)]
+        payload = {
+            "customer_name": "Query Count",
+            "customer_phone": phone,
+            "payment_method": "cash_on_delivery",
+            "delivery_address": "Nairobi",
+            "items": [{"product_id": product_id, "quantity": 1, "price": 50} for product_id in product_ids],
+        }
+        assert client.post("/orders/", json=payload).status_code == 201
+
+
+def _statements_for_listing(client, count_statements, phone, expected):
+    with count_statements() as counts:
+        response = client.get("/orders/", params={"customer_phone": phone, "limit": 50})
+    assert response.status_code == 200
+    orders = response.json()["items"]
+    assert len(orders) == expected
+    assert all(item["product"]["name"] for order in orders for item in order["items"])
+    return counts["statements"]
+
+
+def test_order_listing_runs_constant_number_of_statements(client, make_product, count_statements):
+    _place_orders(client, make_product, "0700000001", 1)
+    _place_orders(client, make_product, "0700000025", 25)
+
+    one = _statements_for_listing(client, count_statements, "0700000001", 1)
+    many = _statements_for_listing(client, count_statements, "0700000025", 25)
+    assert one == many
+
+
+def test_order_listing_filters_by_status(client, make_product):
+    _place_orders(client, make_product, "0700000099", 2)
+    orders = client.get("/orders/", params={"customer_phone": "0700000099"}).json()["items"]
+    response = client.patch(f"/orders/{orders[0]['id']}", json={"status": "completed"})
+    assert response.status_code == 200, response.text
+
+    completed = client.get("/orders/", params={"customer_phone": "0700000099", "status": "completed"})
+    assert completed.status_code == 200
+    assert [order["id"] for order in completed.json()["items"]] == [orders[0]["id"]]
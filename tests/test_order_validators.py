@@ -0,0 +1,20 @@
+"""Order ETag / Last-Modified (user-009) only change with what the order
+response shows."""
+
+
+def test_other_checkouts_keep_order_validators(client, make_product, order_payload):
+    product_id = make_product(name="Validator sheet", price=80, stock=20)
+    order_id = client.post("/orders/", json=order_payload(product_id, price=80)).json()["id"]
+    first = client.get(f"/orders/{order_id}")
+    etag, last_modified = first.headers["ETag"], first.headers["Last-Modified"]
+
+    # Another customer's checkout decrements the same product's stock
+    assert client.post("/orders/", json=order_payload(product_id, price=80, phone="0722000000")).status_code == 201
+    assert client.get(f"/orders/{order_id}", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(f"/orders/{order_id}", headers={"If-Modified-Since": last_modified}).status_code == 304
+
+    # Renaming the product changes the embedded name, so the ETag moves
+    assert client.put(f"/products/{product_id}", data={"name": "Validator sheet 2"}).status_code == 200
+    renamed = client.get(f"/orders/{order_id}", headers={"If-None-Match": etag})
+    assert renamed.status_code == 200
+    assert renamed.json()["items"][0]["product"]["name"] == "Validator sheet 2"
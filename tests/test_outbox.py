@@ -0,0 +1,71 @@
+"""Outbox retries (user-013): a failing job is retried after a backoff, then
+dead-lettered once out of attempts and can be requeued from /admin/outbox."""
+from datetime import datetime
+from sqlmodel import Session
+from app.db.session import engine
+from app.models.models import OutboxJob
+from app.services import outbox
+
+# Ahead of any jobs the other tests left in the queue
+LONG_AGO = datetime(2000, 1, 1)
+
+
+def _enqueue(kind, max_attempts):
+    with Session(engine) as session:
+        job = outbox.enqueue(session, kind, {"n": 1}, max_attempts=max_attempts)
+        job.run_after = LONG_AGO
+        session.commit()
+        return job.id
+
+
+def _job(job_id):
+    with Session(engine) as session:
+        return session.get(OutboxJob, job_id)
+
+
+def _run_next(worker, job_id):
+    jobs = outbox.claim_jobs(1)
+    assert [job.id for job in jobs] == [job_id]
+    worker._execute(jobs[0])
+
+
+def _make_due(job_id):
+    # Skip the backoff wait
+    with Session(engine) as session:
+        job = session.get(OutboxJob, job_id)
+        job.run_after = LONG_AGO
+        session.commit()
+
+
+def test_failing_job_is_retried_then_dead_lettered_and_requeued(client, monkeypatch):
+    calls = []
+
+    def flaky(payload):
+        calls.append(payload)
+        if len(calls) <= 2:
+            raise ConnectionError("mail server unavailable")
+
+    monkeypatch.setitem(outbox._handlers, "test_flaky", flaky)
+    worker = outbox.OutboxWorker(concurrency=1)
+    job_id = _enqueue("test_flaky", max_attempts=2)
+
+    _run_next(worker, job_id)
+    job = _job(job_id)
+    assert (job.status, job.attempts, worker.retried) == ("pending", 1, 1)
+    assert job.run_after > datetime.utcnow()
+    assert job.last_error == "ConnectionError: mail server unavailable"
+
+    _make_due(job_id)
+    _run_next(worker, job_id)
+    job = _job(job_id)
+    assert (job.status, job.attempts, worker.dead_lettered) == ("dead", 2, 1)
+    dead = client.get("/admin/outbox").json()["dead"]
+    assert job_id in [entry["id"] for entry in dead]
+
+    assert client.post(f"/admin/outbox/{job_id}/retry").status_code == 200
+    _make_due(job_id)
+    _run_next(worker, job_id)
+    job = _job(job_id)
+    assert (job.status, job.attempts, job.last_error) == ("done", 1, None)
+    assert len(calls) == 3
+    assert client.post(f"/admin/outbox/{job_id}/retry").status_code == 404
@@ -0,0 +1,53 @@
+"""Repeated payment confirmations (user-021): a provider retrying a callback,
+or a customer resubmitting a code, applies the payment once."""
+from app.services import idempotency
+from app.services.idempotency import IdempotencyCache
+from app.services.payment_events import payment_events
+
+
+def _place_order(client, make_product, order_payload, phone):
+    product_id = make_product(name=f"Idempotent board {phone}", stock=5)
+    response = client.post("/orders/", json=order_payload(product_id, phone=phone))
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+
+def _record_published(monkeypatch):
+    published = []
+    monkeypatch.setattr(payment_events, "publish", lambda order_id, status: published.append(order_id))
+    return published
+
+
+def test_replayed_webhook_is_applied_once(client, make_product, order_payload, monkeypatch):
+    order_id = _place_order(client, make_product, order_payload, "0733000101")
+    published = _record_published(monkeypatch)
+    callback = {"order_id": order_id, "mpesa_code": "IDM0000101", "phone_number": "0733000101", "status": "SUCCESS"}
+
+    first = client.post("/orders/mpesa/webhook", json=callback).json()
+    assert first == {"received": True, "order_id": order_id}
+    # Answered from the cache of applied keys
+    assert client.post("/orders/mpesa/webhook", json=callback).json()["duplicate"]
+    # A worker that hasn't seen the key finds it in the database
+    monkeypatch.setattr(idempotency, "payment_keys", IdempotencyCache())
+    monkeypatch.setattr("app.routers.order_router.payment_keys", idempotency.payment_keys)
+    assert client.post("/orders/mpesa/webhook", json=callback).json()["duplicate"]
+
+    assert published == [order_id]
+    assert client.get(f"/orders/{order_id}/mpesa/status").json()["mpesa_code"] == "IDM0000101"
+
+
+def test_resubmitted_code_gets_the_same_answer_and_cannot_pay_another_order(client, make_product, order_payload):
+    order_id = _place_order(client, make_product, order_payload, "0733000201")
+    other_id = _place_order(client, make_product, order_payload, "0733000201")
+    verification = {"mpesa_code": "idm0000201", "phone_number": "0733000201"}
+
+    first = client.post(f"/orders/{order_id}/verify-payment", json=verification)
+    assert first.status_code == 200, first.text
+    again = client.post(f"/orders/{order_id}/verify-payment", json=verification)
+    assert again.status_code == 200
+    assert again.json() == first.json()
+
+    reused = client.post(f"/orders/{other_id}/verify-payment", json=verification)
+    assert reused.status_code == 400
+    assert "already been used" in reused.json()["detail"]
+    assert not client.get(f"/orders/{other_id}/mpesa/status").json()["payment_verified"]
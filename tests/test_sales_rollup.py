@@ -0,0 +1,65 @@
+"""The daily sales rollup (user-024) stays equal to a rebuild from the
+orders when status changes and deletes race each other."""
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlmodel import Session, select
+
+from app.db.session import engine
+from app.models.models import DailySalesRollup
+from app.services import sales_rollup
+
+STATUSES = ["processing", "completed", "cancelled", "shipped"]
+
+
+def _rollup():
+    with Session(engine) as session:
+        rows = session.exec(select(DailySalesRollup)).all()
+        return {
+            (row.day, row.status, row.product_id): (row.orders, row.items_sold, round(row.revenue, 2))
+            for row in rows
+            if row.orders or row.items_sold or row.revenue
+        }
+
+
+def _rebuilt():
+    with Session(engine) as session:
+        sales_rollup.rebuild(session)
+    return _rollup()
+
+
+def _place(client, make_product, order_payload, count):
+    product_id = make_product(name="Rollup board", price=250, stock=100)
+    return [
+        client.post("/orders/", json=order_payload(product_id, quantity=2, price=250, phone="0711000024")).json()["id"]
+        for _ in range(count)
+    ]
+
+
+def _race(change, count):
+    with ThreadPoolExecutor(max_workers=12) as pool:
+        return list(pool.map(change, range(count)))
+
+
+def test_concurrent_status_changes_move_the_rollup_once(client, make_product, order_payload):
+    order_ids = _place(client, make_product, order_payload, 2)
+
+    def change(n):
+        # Many requests moving the same order out of the same status
+        order_id = order_ids[n % len(order_ids)]
+        return client.patch(f"/orders/{order_id}", json={"status": STATUSES[n % len(STATUSES)]}).status_code
+
+    assert set(_race(change, 40)) == {200}
+    assert _rollup() == _rebuilt()
+
+
+def test_status_changes_racing_deletes_keep_rollup_exact(client, make_product, order_payload):
+    order_ids = _place(client, make_product, order_payload, 4)
+
+    def change(n):
+        order_id = order_ids[n % len(order_ids)]
+        if n % 7 == 6:
+            return client.delete(f"/orders/{order_id}").status_code
+        return client.patch(f"/orders/{order_id}", json={"status": STATUSES[n % len(STATUSES)]}).status_code
+
+    assert set(_race(change, 48)) <= {200, 404}
+    assert _rollup() == _rebuilt()
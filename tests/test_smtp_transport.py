@@ -0,0 +1,135 @@
+"""SMTPTransport (user-014) against a local stand-in SMTP server."""
+import socketserver
+import threading
+from email.message import EmailMessage
+
+import pytest
+
+from app.services import smtp_transport
+from app.services.smtp_transport import SMTPTransport
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough ESMTP for smtplib: EHLO, AUTH, MAIL, RCPT, DATA, RSET, QUIT."""
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+        self.wfile.flush()
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        accepted = 0
+        self.reply("220 stand-in ESMTP")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip().upper()
+            if command.startswith("EHLO"):
+                self.reply("250-stand-in")
+                self.reply("250 AUTH PLAIN LOGIN")
+            elif command.startswith("AUTH"):
+                self.reply("235 Authentication successful")
+            elif command.startswith(("HELO", "MAIL", "RCPT", "RSET", "NOOP")):
+                self.reply("250 OK")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                while self.rfile.readline() not in (b".\r\n", b".\n", b""):
+                    pass
+                server.messages += 1
+                accepted += 1
+                self.reply("250 Queued")
+                if server.drop_after and accepted >= server.drop_after:
+                    # Hang up without QUIT, like a server timing out a session
+                    return
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _SMTPHandler)
+        self.connections = 0
+        self.messages = 0
+        self.drop_after = None
+
+
+@pytest.fixture
+def smtp_server():
+    server = _SMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def transport(smtp_server):
+    transport = SMTPTransport("127.0.0.1", smtp_server.server_address[1], "user", "secret", starttls=False)
+    yield transport
+    transport.close()
+
+
+def _message(n=0):
+    message = EmailMessage()
+    message["From"] = "shop@example.com"
+    message["To"] = "customer@example.com"
+    message["Subject"] = f"Order #{n}"
+    message.set_content("Thanks for your order.")
+    return message
+
+
+def test_connection_is_reused_across_sends(smtp_server, transport):
+    for n in range(5):
+        transport.send(_message(n))
+    assert transport.send_many([_message(n) for n in range(3)]) == [None, None, None]
+    assert smtp_server.messages == 8
+    assert smtp_server.connections == 1
+    assert transport.connects == 1
+
+
+def test_idle_connection_is_retired(smtp_server, transport, monkeypatch):
+    transport.send(_message())
+    monkeypatch.setattr(smtp_transport, "SMTP_IDLE_SECONDS", 0)
+    transport._idle[-1].last_used -= 1
+    transport.send(_message())
+    assert smtp_server.messages == 2
+    assert transport.connects == 2
+
+
+def test_connection_is_retired_after_max_messages(smtp_server, transport, monkeypatch):
+    monkeypatch.setattr(smtp_transport, "SMTP_MAX_MESSAGES_PER_CONNECTION", 2)
+    for n in range(5):
+        transport.send(_message(n))
+    assert smtp_server.messages == 5
+    # 2 + 2 + 1 messages; the first two sessions are closed once full
+    assert transport.connects == 3
+    assert len(transport._idle) == 1
+
+
+def test_dropped_connection_is_reconnected_once(smtp_server, transport):
+    smtp_server.drop_after = 1
+    transport.send(_message(1))
+    # The server hung up after the first message; the next send finds the
+    # session dead and goes through on a fresh one
+    transport.send(_message(2))
+    assert smtp_server.messages == 2
+    assert transport.connects == 2
+
+
+def test_unreachable_server_fails_after_one_retry(smtp_server, transport):
+    transport.send(_message())
+    transport._idle[-1].smtp.close()
+    smtp_server.shutdown()
+    smtp_server.server_close()
+    results = transport.send_many([_message()])
+    assert isinstance(results[0], (ConnectionError, smtp_transport.smtplib.SMTPServerDisconnected))
+    assert transport.connects == 1
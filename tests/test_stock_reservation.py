@@ -0,0 +1,29 @@
+"""Concurrent checkouts of one SKU must never oversell it (user-012)."""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+@pytest.mark.parametrize("quantity", [1, 3])
+def test_parallel_orders_take_exactly_the_stock(client, make_product, order_payload, quantity):
+    stock = 10
+    attempts = 40
+    product_id = make_product(name=f"Last boards x{quantity}", stock=stock)
+
+    def checkout(_):
+        response = client.post("/orders/", json=order_payload(product_id, quantity=quantity))
+        return response.status_code, response.json()
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(checkout, range(attempts)))
+
+    succeeded = sum(1 for code, _ in results if code == 201)
+    assert succeeded == stock // quantity
+    # An oversell attempt is rejected as 400 naming the product
+    rejected = [body for code, body in results if code != 201]
+    assert [code for code, _ in results if code != 201] == [400] * len(rejected)
+    assert all("Insufficient stock" in body["detail"] for body in rejected)
+
+    remaining = client.get(f"/products/{product_id}").json()["stock_quantity"]
+    assert remaining == stock - succeeded * quantity
+    assert remaining >= 0